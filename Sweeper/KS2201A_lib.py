@@ -14,10 +14,32 @@ import logging
 import os
 from firmware_manager import FirmwareVersionTracker
 from generic_logging import quick_config
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, NamedTuple
 
 logger = logging.getLogger(__name__)
 
+# Timing of the voltage ramp loop (program_step_to_target_voltage), in ns
+STEP_INCREMENT_START_DELAY = 90 # V Chx += step
+STEP_WRAP_START_DELAY = 100 # if V Chx > 65535 (time matched)
+STEP_WRAP_SUBTRACT_START_DELAY = 10+80 # V Chx -= 65536
+STEP_OUTPUT_START_DELAY = 200 # set AWG offset
+STEP_VG_WRITE_START_DELAY = 100 # write VG register bank
+# The loop time used by calc_slewTimer is derived from the start delays of the generated instructions, not measured:
+# these step instructions plus the loop_overhead given by each ramp loop (sync while, sync blocks, counters).
+REGISTER_16BIT_MAX = 2**16 - 1 # voltage registers hold 16-bit values, see program_16bit_wrap
+OFFSET_BINARY_OFFSET = 2**15 # converts 16-bit two's complement register values to offset binary for unsigned comparisons
+
+# Config fields grouped by the cheapest way of applying their changes to a compiled HVI sequence (see classify_config_change)
+REGISTER_UPDATE_FIELDS = ("vi_1d", "vf_1d", "num_steps_1d", "vi_2d", "vf_2d", "num_steps_2d", "vi_3d", "vf_3d", "num_steps_3d",
+                          "integration_time_input", "stabilization_time", "pause_time", "dig_prescaler", "QD_emulator_Cm")
+DAQ_RECONFIGURE_FIELDS = ("fullscale", "load_digitizer_channel_config", "acquisition_delay")
+RECOMPILE_FIELDS = ("AWG_channel_1d", "AWG_channel_2d", "AWG_channel_3d", "slew_rate_1d", "slew_rate_2d", "slew_rate_3d", "dV", # baked in the ramp delays
+                    "use_virtual_gates", "nb_VG_awg_modules", "vg_module_descriptor_list", "use_QD_emulator", "hardware_simulated",
+                    "main_awg_engine_name", "secondary_awg_engine_name", "third_awg_engine_name", "fourth_awg_engine_name", "tertiary_awg_engine_name", "main_dig_engine_name")
+CONFIG_CHANGE_DAQ = "DAQ reconfigure"
+CONFIG_CHANGE_REGISTERS = "register update"
+CONFIG_CHANGE_RECOMPILE = "recompile"
+
 #%% 3rd Level: Classes and Functions to Use SD1/M3xxxA Instruments
 #################################################################
 
@@ -179,7 +201,29 @@ def send_waveforms(config, awg_module: Module):
         awg_module.instrument.AWGstart(channel) # AWG starts and waits for an AWG trigger
 
 
-def configure_digitizer(config, digitizer_module: Module, num_channels = 4, num_cycles_override = None):
+def configure_digitizer(config, digitizer_module: Module, num_channels = 4, num_cycles_override = None, configure_channels = True):
+    """
+    Configure the DAQ channels of the digitizer for the next acquisition.
+
+    Parameters
+    ----------
+    config : ApplicationConfig1D, ApplicationConfig2D or ApplicationConfig3D
+        Experiment configuration.
+    digitizer_module : Module
+        Digitizer module.
+    num_channels : int, optional
+        Number of DAQ channels to configure, by default 4.
+    num_cycles_override : int, optional
+        Number of cycles to acquire instead of config.num_cycles, by default None. Used for the segments of long measurements.
+    configure_channels : bool, optional
+        Configure the input and prescaler of the channels, by default True. If False, the DAQs are only armed for the next
+        acquisition, which is enough when the fullscale, channel config and prescaler didn't change since the last call.
+
+    Returns
+    -------
+    int
+        Number of points per cycle.
+    """
     config.logger.info("Configuring Digitizer {}".format(digitizer_module.slot_number))
     # Input settings
     prescaler = config.dig_prescaler
@@ -192,14 +236,6 @@ def configure_digitizer(config, digitizer_module: Module, num_channels = 4, num_
     if num_cycles_override is not None:
         num_cycles = num_cycles_override
 
-    # TODO: reset QD emulator to make long measurements, to be tested
-    # if config.use_QD_emulator:
-        # Reset FPGA to avoid timeout
-        # config.logger.debug("Resetting digitizer FPGA")
-        # reset_mode = keysightSD1.SD_ResetMode.PULSE
-        # digitizer_module.instrument.FPGAreset(reset_mode)
-        # load_digitizer(config, digitizer_module)
-
     # Configure DAQ channels
     for n_DAQ in range (1, num_channels+1):
         # DAQstop: stops any previous acquisition
@@ -208,11 +244,12 @@ def configure_digitizer(config, digitizer_module: Module, num_channels = 4, num_
         # Resets the DAQ
         digitizer_module.instrument.DAQflush(n_DAQ)
 
-        if config.load_digitizer_channel_config == True: # changing the impedance or coupling can create voltage spikes
-            # Digitizer channel configuration
-            digitizer_module.instrument.channelInputConfig(n_DAQ, fullscale, keysightSD1.AIN_Impedance.AIN_IMPEDANCE_HZ, keysightSD1.AIN_Coupling.AIN_COUPLING_DC)
-        
-        digitizer_module.instrument.channelPrescalerConfig(n_DAQ, prescaler)
+        if configure_channels:
+            if config.load_digitizer_channel_config == True: # changing the impedance or coupling can create voltage spikes
+                # Digitizer channel configuration
+                digitizer_module.instrument.channelInputConfig(n_DAQ, fullscale, keysightSD1.AIN_Impedance.AIN_IMPEDANCE_HZ, keysightSD1.AIN_Coupling.AIN_COUPLING_DC)
+
+            digitizer_module.instrument.channelPrescalerConfig(n_DAQ, prescaler)
 
         # DAQ acquisitions configuration
         digitizer_module.instrument.DAQconfig(n_DAQ, points_per_cycle, num_cycles, acquisition_delay, trigger_mode)
@@ -337,9 +374,47 @@ def define_fpga_resources(sys_def, module_dict, config):
             else:
                 raise ValueError("Module model number {} is not supported by the HVI application. Exiting...".format(module.model_number))
 
-def program_step_to_target_voltage(sequencer, awg_module: Module, awg_sequence, config, AWG_channel, voltage_channel, target_voltage_register, slew_rate, use_dV_from_config = False, output_voltage=True, source_VG_module=None):
+def program_16bit_wrap(awg_sequence, config, register, start_delay):
     """
-    Program a step in the AWG sequence to reach the target voltage.
+    Keep a register within 16 bits after adding a 16-bit value to it. The wrap around of the HVI registers is not verified on
+    hardware (the branching step loop reset 65537 to 0), so the carry is removed explicitly.
+
+    Parameters
+    ----------
+    awg_sequence : HVI sequence
+        HVI sequence of the AWG module.
+    config : ApplicationConfig1D
+        Configuration of the HVI program.
+    register : HVI register
+        Register to keep within 16 bits.
+    start_delay : int
+        Start delay of the IF statement in ns.
+
+    Returns
+    -------
+    None
+    """
+    # Configure IF condition
+    if_condition = kthvi.Condition.register_comparison(register, kthvi.ComparisonOperator.GREATER_THAN, REGISTER_16BIT_MAX)
+
+    # Add If statement
+    enable_ifbranches_time_matching = True # Set flag that enables to match the execution time of all the IF branches
+    instruction_label = config.instruction_name.unique("Register > 16 bits")
+    if_statement = awg_sequence.add_if(instruction_label, start_delay, if_condition, enable_ifbranches_time_matching)
+
+    # Program IF branch
+    if_sequence = if_statement.if_branch.sequence
+    # Add statements in if-sequence
+    instruction_label = config.instruction_name.unique("Register -= 65536")
+    instruction = if_sequence.add_instruction(instruction_label, STEP_WRAP_SUBTRACT_START_DELAY, if_sequence.instruction_set.subtract.id)
+    instruction.set_parameter(if_sequence.instruction_set.subtract.destination.id, register)
+    instruction.set_parameter(if_sequence.instruction_set.subtract.left_operand.id, register)
+    instruction.set_parameter(if_sequence.instruction_set.subtract.right_operand.id, REGISTER_16BIT_MAX + 1)
+
+def program_ramp_direction(sequencer, awg_module: Module, awg_sequence, config, voltage_channel, target_voltage_register, step_register):
+    """
+    Program the instructions deciding the direction of a voltage ramp of unknown start voltage (e.g. going to Vi).
+    Executed once before the ramp loop so program_step_to_target_voltage only has to add the step register to the voltage.
 
     Parameters
     ----------
@@ -351,175 +426,129 @@ def program_step_to_target_voltage(sequencer, awg_module: Module, awg_sequence,
         HVI sequence of the AWG module.
     config : ApplicationConfig1D
         Configuration of the HVI program.
-    AWG_channel : int
-        Number of the AWG channel to output the voltage.
     voltage_channel : HVI register
         Register of the voltage channel to sweep.
     target_voltage_register : HVI register
         Register of the target voltage to reach.
-    slew_rate : float
-        Slew rate of the voltage ramp.
-    use_dV_from_config : bool, optional
-        Use the voltage increment set in the config or not, by default False. If False, the voltage increment is set to 1 by default.
-    output_voltage : bool, optional
-        Choose if the sequence outputs the voltage to the AWG channel, by default True. Otherwise, the voltage value is written to the virtual gates memory bank in the FPGA firmware.
-    source_VG_module : Module, optional
-        Source module of the voltage to be sent to other virtual gate modules, by default None.
+    step_register : HVI register
+        Register set to +1 or -1 (16-bit two's complement) depending on the ramp direction.
 
     Returns
     -------
     None
     """
-    max_positive = 32767 # max integer considered as positive (1.5V = 32767, -1.5V = 32768 or 32769)
-    max_negative = 65536
-
     awg_engine_name = awg_module.engine_name
 
     # Get register values
     awg_registers = sequencer.sync_sequence.scopes[awg_engine_name].registers
-    sweep_direction = awg_registers[config.sweep_direction_name]
-    neg_counter = awg_registers[config.neg_counter_name]
-    # slew_time = awg_registers[config.slew_time_name]
-    # awg_debug = awg_registers[config.awg_debug_name]
-    if use_dV_from_config:
-        voltage_increment = awg_registers[config.voltage_increment_name]
-        neg_voltage_increment = awg_registers[config.neg_voltage_increment_name]
+    offset_voltage = awg_registers[config.offset_voltage_name]
+    offset_target = awg_registers[config.offset_target_name]
+
+    ###########################################################################
+    # Convert the voltages to offset binary so that the unsigned comparison follows the voltage order
+    instruction_label = config.instruction_name.unique("Offset V Chx = V Chx + offset")
+    instruction = awg_sequence.add_instruction(instruction_label, 10+80, awg_sequence.instruction_set.add.id)
+    instruction.set_parameter(awg_sequence.instruction_set.add.destination.id, offset_voltage)
+    instruction.set_parameter(awg_sequence.instruction_set.add.left_operand.id, voltage_channel)
+    instruction.set_parameter(awg_sequence.instruction_set.add.right_operand.id, OFFSET_BINARY_OFFSET)
+    program_16bit_wrap(awg_sequence, config, offset_voltage, STEP_WRAP_START_DELAY)
+
+    instruction_label = config.instruction_name.unique("Offset target = target + offset")
+    instruction = awg_sequence.add_instruction(instruction_label, 10+80, awg_sequence.instruction_set.add.id)
+    instruction.set_parameter(awg_sequence.instruction_set.add.destination.id, offset_target)
+    instruction.set_parameter(awg_sequence.instruction_set.add.left_operand.id, target_voltage_register)
+    instruction.set_parameter(awg_sequence.instruction_set.add.right_operand.id, OFFSET_BINARY_OFFSET)
+    program_16bit_wrap(awg_sequence, config, offset_target, STEP_WRAP_START_DELAY)
 
-      ###########################################################################
-    # Check if the target voltage is smaller or bigger than the actual voltage and define the sweep direction accordingly
+    ###########################################################################
+    # Check if the target voltage is smaller or bigger than the actual voltage and define the ramp direction accordingly
     # Configure IF condition
-    if_condition = kthvi.Condition.register_comparison(target_voltage_register, kthvi.ComparisonOperator.LESS_THAN, voltage_channel)
+    if_condition = kthvi.Condition.register_comparison(offset_target, kthvi.ComparisonOperator.LESS_THAN, offset_voltage)
 
     # Add If statement
     enable_ifbranches_time_matching = True # Set flag that enables to match the execution time of all the IF branches
     instruction_label = config.instruction_name.unique("Target voltage < V Chx")
-    if_statement = awg_sequence.add_if(instruction_label, 430, if_condition, enable_ifbranches_time_matching)
+    if_statement = awg_sequence.add_if(instruction_label, 100, if_condition, enable_ifbranches_time_matching)
 
     # Program IF branch
     if_sequence = if_statement.if_branch.sequence
     # Add statements in if-sequence
-    instruction_label = config.instruction_name.unique("Sweep dir = -dV")
+    instruction_label = config.instruction_name.unique("Ramp direction = -1")
     instruction = if_sequence.add_instruction(instruction_label, 10+50, if_sequence.instruction_set.assign.id)
-    instruction.set_parameter(if_sequence.instruction_set.assign.destination.id, sweep_direction)
-    if use_dV_from_config:
-        instruction.set_parameter(if_sequence.instruction_set.assign.source.id, neg_voltage_increment)
-    else:
-        instruction.set_parameter(if_sequence.instruction_set.assign.source.id, -1) 
+    instruction.set_parameter(if_sequence.instruction_set.assign.destination.id, step_register)
+    instruction.set_parameter(if_sequence.instruction_set.assign.source.id, OFFSET_BINARY_OFFSET*2 - 1) # -1 in 16-bit two's complement
 
     # Else-branch
     # Program Else branch
     else_sequence = if_statement.else_branch.sequence
     # Add statements in Else-sequence
-    instruction_label = config.instruction_name.unique("Sweep dir = dV")
+    instruction_label = config.instruction_name.unique("Ramp direction = 1")
     instruction = else_sequence.add_instruction(instruction_label, 10+50, else_sequence.instruction_set.assign.id)
-    instruction.set_parameter(else_sequence.instruction_set.assign.destination.id, sweep_direction)
-    if use_dV_from_config:
-        instruction.set_parameter(else_sequence.instruction_set.assign.source.id, voltage_increment)
-    else:
-        instruction.set_parameter(else_sequence.instruction_set.assign.source.id, 1)
-
-    ###########################################################################
-    # Check if the target voltage is negative
-    instruction_label = config.instruction_name.unique("Negative counter = 0")
-    instruction = awg_sequence.add_instruction(instruction_label, 10+50, awg_sequence.instruction_set.assign.id)
-    instruction.set_parameter(awg_sequence.instruction_set.assign.destination.id, neg_counter)
-    instruction.set_parameter(awg_sequence.instruction_set.assign.source.id, 0)
+    instruction.set_parameter(else_sequence.instruction_set.assign.destination.id, step_register)
+    instruction.set_parameter(else_sequence.instruction_set.assign.source.id, 1)
 
-    # Configure IF condition
-    if_condition = kthvi.Condition.register_comparison(target_voltage_register, kthvi.ComparisonOperator.GREATER_THAN, max_positive) # if target_voltage_register is negative
-
-    # Add If statement
-    enable_ifbranches_time_matching = True # Set flag that enables to match the execution time of all the IF branches
-    instruction_label = config.instruction_name.unique("Target voltage > max positive")
-    if_statement = awg_sequence.add_if(instruction_label, 100, if_condition, enable_ifbranches_time_matching)
-
-    # Program IF branch
-    if_sequence = if_statement.if_branch.sequence
-    # Add statements in if-sequence
-    instruction_label = config.instruction_name.unique("Negative counter +1")
-    instruction = if_sequence.add_instruction(instruction_label, 10+80, if_sequence.instruction_set.add.id)
-    instruction.set_parameter(if_sequence.instruction_set.add.destination.id, neg_counter)
-    instruction.set_parameter(if_sequence.instruction_set.add.left_operand.id, neg_counter)
-    instruction.set_parameter(if_sequence.instruction_set.add.right_operand.id, 1)
-
-    ###########################################################################
-    # Check if the current voltage is negative
-    # Configure IF condition
-    if_condition = kthvi.Condition.register_comparison(voltage_channel, kthvi.ComparisonOperator.GREATER_THAN, max_positive) # if V Ch1 is negative
+def program_step_to_target_voltage(sequencer, awg_module: Module, awg_sequence, config, AWG_channel, voltage_channel, step_register, slew_rate, use_dV_from_config = False, output_voltage=True, source_VG_module=None, loop_overhead=0):
+    """
+    Program a step in the AWG sequence to reach the target voltage.
+    The direction and size of the step are decided before the ramp, either by the host (see calc_sweep_direction) or
+    by program_ramp_direction, so the loop only adds the step register to the voltage, writes it and waits.
 
-    # Add If statement
-    enable_ifbranches_time_matching = True # Set flag that enables to match the execution time of all the IF branches
-    instruction_label = config.instruction_name.unique("V Chx > max positive")
-    if_statement = awg_sequence.add_if(instruction_label, 100, if_condition, enable_ifbranches_time_matching)
+    Parameters
+    ----------
+    sequencer : kthvi.Sequencer
+        HVI sequencer object.
+    awg_module : Module
+        AWG module object.
+    awg_sequence : HVI sequence
+        HVI sequence of the AWG module.
+    config : ApplicationConfig1D
+        Configuration of the HVI program.
+    AWG_channel : int
+        Number of the AWG channel to output the voltage.
+    voltage_channel : HVI register
+        Register of the voltage channel to sweep.
+    step_register : HVI register
+        Register of the signed voltage increment (16-bit two's complement) added at each step.
+    slew_rate : float
+        Slew rate of the voltage ramp.
+    use_dV_from_config : bool, optional
+        Use the voltage increment set in the config to calculate the wait time or not, by default False. If False, the voltage increment is 1 by default.
+    output_voltage : bool, optional
+        Choose if the sequence outputs the voltage to the AWG channel, by default True. Otherwise, the voltage value is written to the virtual gates memory bank in the FPGA firmware.
+    source_VG_module : Module, optional
+        Source module of the voltage to be sent to other virtual gate modules, by default None.
+    loop_overhead : int, optional
+        Sum of the start delays in ns of the instructions executed at each iteration of the enclosing loop besides this step
+        (sync while, sync blocks, counters), by default 0. Subtracted from the wait with the step instructions to keep the slew rate.
 
-    # Program IF branch
-    if_sequence = if_statement.if_branch.sequence
-    # Add statements in if-sequence
-    instruction_label = config.instruction_name.unique("Negative counter +1")
-    instruction = if_sequence.add_instruction(instruction_label, 10+80, if_sequence.instruction_set.add.id)
-    instruction.set_parameter(if_sequence.instruction_set.add.destination.id, neg_counter)
-    instruction.set_parameter(if_sequence.instruction_set.add.left_operand.id, neg_counter)
-    instruction.set_parameter(if_sequence.instruction_set.add.right_operand.id, 1)
+    Returns
+    -------
+    None
+    """
+    loop_time = loop_overhead + STEP_INCREMENT_START_DELAY + STEP_WRAP_START_DELAY + STEP_WRAP_SUBTRACT_START_DELAY # ns
 
     ###########################################################################
-    # If only one voltage value is negative (bigger than 32 767), the negative voltage integer value will be bigger than the positive (less than 32 767) voltage value.
-    # The IF condition will be inverted so it needs to be corrected by inverting it.
-    # Configure IF condition
-    if_condition = kthvi.Condition.register_comparison(neg_counter, kthvi.ComparisonOperator.EQUAL_TO, 1)
-
-    # Add If statement
-    enable_ifbranches_time_matching = True # Set flag that enables to match the execution time of all the IF branches
-    instruction_label = config.instruction_name.unique("Neg counter = 1")
-    if_statement = awg_sequence.add_if(instruction_label, 100, if_condition, enable_ifbranches_time_matching)
-
-    # Program IF branch
-    if_sequence = if_statement.if_branch.sequence
-    # Add statements in if-sequence
-    instruction_label = config.instruction_name.unique("V Chx -= sweep direction")
-    instruction = if_sequence.add_instruction(instruction_label, 10+80, if_sequence.instruction_set.subtract.id)
-    instruction.set_parameter(if_sequence.instruction_set.add.destination.id, voltage_channel)
-    instruction.set_parameter(if_sequence.instruction_set.add.left_operand.id, voltage_channel)
-    instruction.set_parameter(if_sequence.instruction_set.add.right_operand.id, sweep_direction)
-
-    # Else-branch
-    # Program Else branch
-    else_sequence = if_statement.else_branch.sequence
-    # Add statements in Else-sequence
-    instruction_label = config.instruction_name.unique("V Chx += sweep direction")
-    instruction = else_sequence.add_instruction(instruction_label, 10+80, else_sequence.instruction_set.add.id)
-    instruction.set_parameter(else_sequence.instruction_set.add.destination.id, voltage_channel)
-    instruction.set_parameter(else_sequence.instruction_set.add.left_operand.id, voltage_channel)
-    instruction.set_parameter(else_sequence.instruction_set.add.right_operand.id, sweep_direction)
-
-    ###########################################################################
-    # Keep the voltage value within 16 bits
-    # Configure IF condition
-    if_condition = kthvi.Condition.register_comparison(voltage_channel, kthvi.ComparisonOperator.EQUAL_TO, max_negative+1)
-
-    # Add If statement
-    enable_ifbranches_time_matching = True # Set flag that enables to match the execution time of all the IF branches
-    instruction_label = config.instruction_name.unique("V Chx = max negative + 1")
-    if_statement = awg_sequence.add_if(instruction_label, 100, if_condition, enable_ifbranches_time_matching)
-
-    # Program IF branch
-    if_sequence = if_statement.if_branch.sequence
-    # Add statements in if-sequence
-    instruction_label = config.instruction_name.unique("V Chx = 0")
-    instruction = if_sequence.add_instruction(instruction_label, 10+80, if_sequence.instruction_set.assign.id)
-    instruction.set_parameter(if_sequence.instruction_set.assign.destination.id, voltage_channel)
-    instruction.set_parameter(if_sequence.instruction_set.assign.source.id, 0)
+    # Increment the voltage. A negative step is added as its 16-bit two's complement and the sum is brought back within 16 bits.
+    instruction_label = config.instruction_name.unique("V Chx += step")
+    instruction = awg_sequence.add_instruction(instruction_label, STEP_INCREMENT_START_DELAY, awg_sequence.instruction_set.add.id)
+    instruction.set_parameter(awg_sequence.instruction_set.add.destination.id, voltage_channel)
+    instruction.set_parameter(awg_sequence.instruction_set.add.left_operand.id, voltage_channel)
+    instruction.set_parameter(awg_sequence.instruction_set.add.right_operand.id, step_register)
+    program_16bit_wrap(awg_sequence, config, voltage_channel, STEP_WRAP_START_DELAY)
 
     ###########################################################################
 
     if output_voltage:
         instruction_label = config.instruction_name.unique("set AWG offset")
-        instruction = awg_sequence.add_instruction(instruction_label, 200, awg_module.instrument.hvi.instruction_set.set_offset.id)
+        instruction = awg_sequence.add_instruction(instruction_label, STEP_OUTPUT_START_DELAY, awg_module.instrument.hvi.instruction_set.set_offset.id)
+        loop_time += STEP_OUTPUT_START_DELAY
         instruction.set_parameter(awg_module.instrument.hvi.instruction_set.set_offset.channel.id, AWG_channel)
         instruction.set_parameter(awg_module.instrument.hvi.instruction_set.set_offset.value.id, voltage_channel)
     else:
         if config.nb_VG_awg_modules > 1:
             instruction_label = config.instruction_name.unique("Write voltage register to register bank")
-            writeFpgaReg = awg_sequence.add_instruction(instruction_label, 100, awg_sequence.instruction_set.fpga_register_write.id)
+            writeFpgaReg = awg_sequence.add_instruction(instruction_label, STEP_VG_WRITE_START_DELAY, awg_sequence.instruction_set.fpga_register_write.id)
+            loop_time += STEP_VG_WRITE_START_DELAY
             voltage_register_VG = awg_sequence.engine.fpga_sandboxes[config.M3xxxA_sandbox].fpga_registers["Voltage_card{}_V_ch{}".format(source_VG_module.card_num_VG, (source_VG_module.card_num_VG-1)*4+AWG_channel)] # card1 has channels 1-4, card2 has channels 5-8
             writeFpgaReg.set_parameter(awg_sequence.instruction_set.fpga_register_write.fpga_register.id, voltage_register_VG)
             writeFpgaReg.set_parameter(awg_sequence.instruction_set.fpga_register_write.value.id, voltage_channel)
@@ -561,12 +590,11 @@ def program_step_to_target_voltage(sequencer, awg_module: Module, awg_sequence,
 
     # Wait Time
     instruction_label = config.instruction_name.unique("Wait")
-    # awg_sequence.add_wait_time(instruction_label, 20, slew_time)
 
     if use_dV_from_config:
-        delay =  calc_slewTimer(config.vi_1d_internal, config.vf_1d_internal, slew_rate, dV=config.dV)
+        delay =  calc_slewTimer(config.vi_1d_internal, config.vf_1d_internal, slew_rate, dV=config.dV, loop_time=loop_time*1e-9)
     else:
-        delay =  calc_slewTimer(config.vi_1d_internal, config.vf_1d_internal, slew_rate)
+        delay =  calc_slewTimer(config.vi_1d_internal, config.vf_1d_internal, slew_rate, loop_time=loop_time*1e-9)
 
     awg_sequence.add_delay(instruction_label, round(delay*10))   
 
@@ -641,7 +669,7 @@ def set_hvi_done(sequencer, dig_module: Module, config):
     instruction.set_parameter(dig_sequence.instruction_set.assign.source.id, 1)
     
 #%% Python functions
-def calc_slewTimer(Vi, Vf, slewRate, dV=45.7778e-6):
+def calc_slewTimer(Vi, Vf, slewRate, dV=45.7778e-6, loop_time=0):
     """
     Calculates the time to wait for each voltage step to achieve a given slew rate.
 
@@ -655,21 +683,23 @@ def calc_slewTimer(Vi, Vf, slewRate, dV=45.7778e-6):
         Slew rate in V/s.
     dV : float
         Voltage step size in V.
+    loop_time : float, optional
+        Duration in s of one iteration of the ramp loop without the wait, by default 0 (longest wait). Depends on the loop,
+        see program_step_to_target_voltage. Was 1090e-9 (measured) for all the loops with the branching step loop.
     
     Returns
     -------
     int
         Time to wait in 10ns steps.
     """
-    HVI_loop_time = 1090e-9 # fixed by the HVI code used (program_step_to_target_voltage 2023-06-25)
     if slewRate == 0:
         slewTimer = 1 # minimum time to wait for HVI compiler
     else:
         # slewTimer = int((dV/slewRate)*1e8) # not taking into account the HVI execution time
-        slewTimer = int((dV/slewRate - HVI_loop_time)*1e8)*2 # x2 because AWG is outputting twice the voltage on high impedance loads
+        slewTimer = int((dV/slewRate - loop_time)*1e8)*2 # x2 because AWG is outputting twice the voltage on high impedance loads
         if slewTimer <= 0:
             slewTimer = 1 # minimum time to wait for HVI compiler
-            logger.info("Min slewTimer achieved. Slew rate: {:.03f} V/s".format(dV/(HVI_loop_time+slewTimer*10e-9)))
+            logger.info("Min slewTimer achieved. Slew rate: {:.03f} V/s".format(dV/(loop_time+slewTimer*10e-9)))
 
     return slewTimer
 
@@ -718,14 +748,72 @@ def calc_step_counter(Vi, Vf, nbSteps, dV=45.7778e-6):
     int
         Number of steps needed to go from Vi to Vf with a step size of dV.
     """    
-    stepSize = calc_stepSize(Vi, Vf, nbSteps)
-
     # in some cases there are to many steps and sometimes one step is missing. To investigate
-    if stepSize == 0:
-        return 0
+    return int(calc_sweep_counters(Vi, Vf, nbSteps, dV=dV)[1])
+
+def calc_sweep_counters(Vi, Vf, nbSteps, dV=45.7778e-6):
+    """
+    Calculates the ramp counter, step counter and maximum number of steps of one or many sweeps at once.
+    Same arithmetic as calc_step_counter, which uses this function.
+
+    Parameters
+    ----------
+    Vi : float or array_like
+        Initial voltages.
+    Vf : float or array_like
+        Final voltages.
+    nbSteps : int or array_like
+        Number of steps between Vi and Vf (including Vi and Vf, so 2 minimum).
+    dV : float, optional
+        Approximately the smallest step size possible with the AWG (measured after one voltage step in HVI), by default 45.7778e-6.
+
+    Returns
+    -------
+    ramp_counter : np.ndarray
+        Number of voltage increments to go from Vi to Vf (step counter of a sweep with 2 steps).
+    step_counter : np.ndarray
+        Number of voltage increments needed to go through one step.
+    max_num_steps : np.ndarray
+        Maximum number of steps between Vi and Vf with a step size of dV.
+    """
+    span = np.abs(np.asarray(Vf, dtype=float) - np.asarray(Vi, dtype=float))
+    nbSteps = np.asarray(nbSteps)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stepSize = np.where(nbSteps > 1, span/(nbSteps - 1), 0) # same as calc_stepSize
+    ramp_counter = (span/dV).astype(int)
+
+    return ramp_counter, (stepSize/dV).astype(int), ramp_counter + 1
+
+
+def calc_sweep_direction(awg_module, Vi, Vf, dV=45.7778e-6):
+    """
+    Calculates the signed voltage increment of a sweep from Vi to Vf, written to the step register used by program_step_to_target_voltage.
+
+    Parameters
+    ----------
+    awg_module : Module
+        AWG module object (used for the voltage to integer conversion).
+    Vi : float
+        Initial voltage.
+    Vf : float
+        Final voltage.
+    dV : float, optional
+        Voltage step size in V, by default 45.7778e-6.
+
+    Returns
+    -------
+    int
+        Voltage increment as an AWG integer, negative if Vf < Vi.
+    """
+    if Vf < Vi:
+        return awg_module.instrument.voltsToInt(-1*dV)
     else:
-        return int((stepSize/dV)) # or int((stepSize/dV)-1)?
-    
+        return awg_module.instrument.voltsToInt(dV)
+
+# Messages of the sweep parameters verification, formatted with the axis name ("1D", "2D" or "3D")
+SWEEP_STEP_TOO_SMALL_WARNING = "Requested voltage step is too small for the {axis} sweep. Maximum number of points is {max_num_steps} for a sweep between {vi} and {vf} V with a voltage increment of {dV}."
+SWEEP_STEP_NOT_MULTIPLE_WARNING = "The voltage step between measurements ({step_counter}) is not a multiple of the voltage step between vi and vf ({ramp_counter}) for the {axis} sweep. The number of steps should be {num_steps}"
+SWEEP_STEP_TOO_BIG_ERROR = "The voltage step between measurements ({step_counter}) cannot be bigger than the voltage between vi and vf ({ramp_counter}) for the {axis} sweep."
 
 def verify_sweep_parameters_1d(config, warning_string="", silence_warnings=False, auto_fix=False):
     """
@@ -766,12 +854,12 @@ def verify_sweep_parameters_1d(config, warning_string="", silence_warnings=False
             step_counter_1d = calc_step_counter(config.vi_1d_internal, config.vf_1d_internal, config.num_steps_1d, dV=config.dV)
             config.logger.info("Number of 1D steps updated to {}".format(new_num_steps_1d))
         else:
-            warning = "Requested voltage step is too small for the 2D sweep. Maximum number of points is {} for a sweep between {} and {} V with a voltage increment of {}.".format(new_num_steps_1d, config.vi_1d_internal, config.vf_1d_internal, config.dV)
+            warning = SWEEP_STEP_TOO_SMALL_WARNING.format(axis="1D", max_num_steps=new_num_steps_1d, vi=config.vi_1d_internal, vf=config.vf_1d_internal, dV=config.dV)
             warning_string = warning_string + warning + "\n"
             step_counter_1d = 1 # set the step counter to 1 to avoid division by 0 in the next if statement
 
     if step_counter_1d > ramp_counter_1d:
-        raise ValueError("The voltage step between measurements ({}) cannot be bigger than the voltage between vi and vf ({}) for the 1D sweep.".format(step_counter_1d, ramp_counter_1d))
+        raise ValueError(SWEEP_STEP_TOO_BIG_ERROR.format(step_counter=step_counter_1d, ramp_counter=ramp_counter_1d, axis="1D"))
 
     if (ramp_counter_1d // step_counter_1d)+1 != config.num_steps_1d:
         new_num_steps_1d = (ramp_counter_1d // step_counter_1d)+1
@@ -780,7 +868,7 @@ def verify_sweep_parameters_1d(config, warning_string="", silence_warnings=False
             step_counter_1d = calc_step_counter(config.vi_1d_internal, config.vf_1d_internal, config.num_steps_1d, dV=config.dV)
             config.logger.info("Number of 1D steps updated to {}".format(new_num_steps_1d))
         else:
-            warning = "The voltage step between measurements ({}) is not a multiple of the voltage step between vi and vf ({}) for the 1D sweep. The number of steps should be {}".format(step_counter_1d, ramp_counter_1d, new_num_steps_1d)
+            warning = SWEEP_STEP_NOT_MULTIPLE_WARNING.format(step_counter=step_counter_1d, ramp_counter=ramp_counter_1d, axis="1D", num_steps=new_num_steps_1d)
             warning_string = warning_string + warning + "\n"
     
     if not silence_warnings and warning_string != "": # if there are warnings
@@ -818,29 +906,29 @@ def verify_sweep_parameters_2d(config, warning_string="", silence_warnings=False
         If the voltage step between measurements is not a multiple of the voltage step between vi and vf.
     """
     config.logger.info("Verifying sweep parameters...")
-    ramp_counter_2d = calc_step_counter(config.vi_2d_internal, config.vf_2d, 2, dV=config.dV)
-    step_counter_2d = calc_step_counter(config.vi_2d_internal, config.vf_2d, config.num_steps_2d, dV=config.dV)
+    ramp_counter_2d = calc_step_counter(config.vi_2d_internal, config.vf_2d_internal, 2, dV=config.dV)
+    step_counter_2d = calc_step_counter(config.vi_2d_internal, config.vf_2d_internal, config.num_steps_2d, dV=config.dV)
 
     if step_counter_2d < 1:
-        new_num_steps_2d = int(abs(config.vf_2d - config.vi_2d_internal)/config.dV)+1
+        new_num_steps_2d = int(abs(config.vf_2d_internal - config.vi_2d_internal)/config.dV)+1
         if auto_fix:
             config.num_steps_2d = new_num_steps_2d
-            step_counter_2d = calc_step_counter(config.vi_2d_internal, config.vf_2d, config.num_steps_2d, dV=config.dV)
+            step_counter_2d = calc_step_counter(config.vi_2d_internal, config.vf_2d_internal, config.num_steps_2d, dV=config.dV)
             config.logger.info("Number of 2D steps updated to {}".format(new_num_steps_2d))
-        warning = "Requested voltage step is too small for the 2D sweep. Maximum number of points is {} for a sweep between {} and {} V with a voltage increment of {}.".format(new_num_steps_2d, config.vi_2d_internal, config.vf_2d, config.dV)
+        warning = SWEEP_STEP_TOO_SMALL_WARNING.format(axis="2D", max_num_steps=new_num_steps_2d, vi=config.vi_2d_internal, vf=config.vf_2d_internal, dV=config.dV)
         warning_string = warning_string + warning + "\n"
         step_counter_2d = 1 # set the step counter to 1 to avoid division by 0 in the next if statement
 
     if step_counter_2d > ramp_counter_2d:
-        raise ValueError("The voltage step between measurements ({}) cannot be bigger than the voltage between vi and vf ({}) for the 2D sweep.".format(step_counter_2d, ramp_counter_2d))
+        raise ValueError(SWEEP_STEP_TOO_BIG_ERROR.format(step_counter=step_counter_2d, ramp_counter=ramp_counter_2d, axis="2D"))
 
     if (ramp_counter_2d // step_counter_2d)+1 != config.num_steps_2d:
         new_num_steps_2d = (ramp_counter_2d // step_counter_2d)+1
         if auto_fix:
             config.num_steps_2d = new_num_steps_2d
-            step_counter_2d = calc_step_counter(config.vi_2d_internal, config.vf_2d, config.num_steps_2d, dV=config.dV)
+            step_counter_2d = calc_step_counter(config.vi_2d_internal, config.vf_2d_internal, config.num_steps_2d, dV=config.dV)
             config.logger.info("Number of 2D steps updated to {}".format(new_num_steps_2d))
-        warning = "The voltage step between measurements ({}) is not a multiple of the voltage step between vi and vf ({}) for the 2D sweep. The number of steps should be {}".format(step_counter_2d, ramp_counter_2d, new_num_steps_2d)
+        warning = SWEEP_STEP_NOT_MULTIPLE_WARNING.format(step_counter=step_counter_2d, ramp_counter=ramp_counter_2d, axis="2D", num_steps=new_num_steps_2d)
         warning_string = warning_string + warning + "\n"
 
     if not silence_warnings and warning_string != "": # if there are warnings
@@ -849,7 +937,135 @@ def verify_sweep_parameters_2d(config, warning_string="", silence_warnings=False
     config.logger.info("2D params verification complete")
 
     return warning_string
+
+def verify_sweep_parameters_3d(config, warning_string="", silence_warnings=False, auto_fix=False):
+    """
+    Verifies if the 3D sweep parameters are valid.
+
+    Parameters
+    ----------
+    config : ApplicationConfig3D
+        Configuration of the HVI program.
+    warning_string : str, optional
+        String containing all the warnings returned by other verication functions, by default "".
+    silence_warnings : bool, optional
+        If True, no warning will be raised to allow the next verification function to be executed, by default False.
+    auto_fix : bool, optional
+        If True, the config will be updated with the new parameters and no warning will be raised, by default False.
+    
+    Returns
+    -------
+    str
+        String containing all the warnings.
+    
+    Raises
+    ------
+    ValueError
+        If the voltage step is too small for the 3D sweep.
+    ValueError
+        If the voltage step between measurements is not a multiple of the voltage step between vi and vf.
+    """
+    config.logger.info("Verifying sweep parameters...")
+    ramp_counter_3d = calc_step_counter(config.vi_3d_internal, config.vf_3d_internal, 2, dV=config.dV)
+    step_counter_3d = calc_step_counter(config.vi_3d_internal, config.vf_3d_internal, config.num_steps_3d, dV=config.dV)
+
+    if step_counter_3d < 1:
+        new_num_steps_3d = int(abs(config.vf_3d_internal - config.vi_3d_internal)/config.dV)+1
+        if auto_fix:
+            config.num_steps_3d = new_num_steps_3d
+            step_counter_3d = calc_step_counter(config.vi_3d_internal, config.vf_3d_internal, config.num_steps_3d, dV=config.dV)
+            config.logger.info("Number of 3D steps updated to {}".format(new_num_steps_3d))
+        warning = SWEEP_STEP_TOO_SMALL_WARNING.format(axis="3D", max_num_steps=new_num_steps_3d, vi=config.vi_3d_internal, vf=config.vf_3d_internal, dV=config.dV)
+        warning_string = warning_string + warning + "\n"
+        step_counter_3d = 1 # set the step counter to 1 to avoid division by 0 in the next if statement
+
+    if step_counter_3d > ramp_counter_3d:
+        raise ValueError(SWEEP_STEP_TOO_BIG_ERROR.format(step_counter=step_counter_3d, ramp_counter=ramp_counter_3d, axis="3D"))
+
+    if (ramp_counter_3d // step_counter_3d)+1 != config.num_steps_3d:
+        new_num_steps_3d = (ramp_counter_3d // step_counter_3d)+1
+        if auto_fix:
+            config.num_steps_3d = new_num_steps_3d
+            step_counter_3d = calc_step_counter(config.vi_3d_internal, config.vf_3d_internal, config.num_steps_3d, dV=config.dV)
+            config.logger.info("Number of 3D steps updated to {}".format(new_num_steps_3d))
+        warning = SWEEP_STEP_NOT_MULTIPLE_WARNING.format(step_counter=step_counter_3d, ramp_counter=ramp_counter_3d, axis="3D", num_steps=new_num_steps_3d)
+        warning_string = warning_string + warning + "\n"
+
+    if not silence_warnings and warning_string != "": # if there are warnings
+        raise ValueError(warning_string)
+    
+    config.logger.info("3D params verification complete")
+
+    return warning_string
     
+class SweepVerification(NamedTuple):
+    "Result of verify_sweep_parameters_batch, one element per candidate sweep"
+    num_steps: np.ndarray # number of steps fixed like auto_fix does
+    step_counter: np.ndarray # step counter of the fixed sweep
+    ramp_counter: np.ndarray
+    valid: np.ndarray # False if the sweep can't be measured (the scalar verification raises a ValueError)
+    warnings: list # warning messages, "" if the parameters didn't need to be fixed
+
+def verify_sweep_parameters_batch(vi, vf, num_steps, dV=45.7778e-6, axis="1D", HZ=True) -> SweepVerification:
+    """
+    Verifies many candidate sweeps at once, for example to choose a sweep window among thousands of candidates.
+    Applies the same checks and fixes as verify_sweep_parameters_1d with auto_fix=True, with vectorized arithmetic.
+    Warning messages are only built for the candidates that needed a fix.
+
+    Parameters
+    ----------
+    vi : array_like
+        Initial voltages of the candidate sweeps [V].
+    vf : array_like
+        Final voltages of the candidate sweeps [V].
+    num_steps : array_like
+        Requested number of steps of the candidate sweeps. vi, vf and num_steps are broadcast together.
+    dV : float, optional
+        Voltage increment of the AWG used by the HVI sweeps, by default 45.7778e-6.
+    axis : str, optional
+        Name of the sweep axis used in the warning messages, by default "1D".
+    HZ : bool, optional
+        The AWG is outputting twice the voltage on high impedance loads, by default True.
+
+    Returns
+    -------
+    SweepVerification
+        Fixed number of steps, step counters, ramp counters, validity and warnings of the flattened candidates.
+    """
+    vi, vf, num_steps = [array.ravel() for array in np.broadcast_arrays(np.asarray(vi, dtype=float), np.asarray(vf, dtype=float), np.asarray(num_steps, dtype=int))]
+    if HZ:
+        # Divide by 2 since AWG is outputing twice the voltage on HZ loads
+        vi, vf = vi/2.0, vf/2.0
+
+    ramp_counter, step_counter, max_num_steps = calc_sweep_counters(vi, vf, num_steps, dV=dV)
+
+    # Too many steps for the voltage increment: use the maximum number of steps
+    too_small = step_counter < 1
+    fixed_num_steps = np.where(too_small, max_num_steps, num_steps)
+    step_counter = np.where(too_small, calc_sweep_counters(vi, vf, fixed_num_steps, dV=dV)[1], step_counter)
+    step_counter = np.maximum(step_counter, 1) # avoid division by 0 when vi == vf
+
+    # The steps must divide the ramp
+    valid = step_counter <= ramp_counter
+    multiple_num_steps = ramp_counter // step_counter + 1
+    not_multiple = valid & (multiple_num_steps != fixed_num_steps)
+    fixed_num_steps = np.where(valid, multiple_num_steps, fixed_num_steps)
+    checked_step_counter = step_counter
+    step_counter = calc_sweep_counters(vi, vf, fixed_num_steps, dV=dV)[1]
+
+    warnings = [""]*vi.size
+    for index in np.flatnonzero(too_small | not_multiple | ~valid):
+        messages = []
+        if too_small[index]:
+            messages.append(SWEEP_STEP_TOO_SMALL_WARNING.format(axis=axis, max_num_steps=max_num_steps[index], vi=vi[index], vf=vf[index], dV=dV))
+        if not valid[index]:
+            messages.append(SWEEP_STEP_TOO_BIG_ERROR.format(step_counter=checked_step_counter[index], ramp_counter=ramp_counter[index], axis=axis))
+        elif not_multiple[index]:
+            messages.append(SWEEP_STEP_NOT_MULTIPLE_WARNING.format(step_counter=checked_step_counter[index], ramp_counter=ramp_counter[index], axis=axis, num_steps=fixed_num_steps[index]))
+        warnings[index] = "\n".join(messages)
+
+    return SweepVerification(num_steps=fixed_num_steps, step_counter=step_counter, ramp_counter=ramp_counter, valid=valid, warnings=warnings)
+
 class instruction_name:
 
     def __init__(self):
@@ -1355,10 +1571,63 @@ def release_all_modules(config):
             module_dict[engine_name].instrument.close()
         config.logger.info("PXI modules closed")
 
+class RunPlan(NamedTuple):
+    "Immutable parameters of one measurement derived from the config, computed once by make_run_plan and used by the acquisition loops"
+    points_per_cycle: int # [Sa] points acquired by each DAQ trigger
+    num_cycles: int # number of DAQ triggers of the whole sweep
+    acquisition_points: int # [Sa] points acquired per channel
+    cycles_per_segment: int
+    num_segments: int
+    conversion_factor: float # [V] per digitizer count
+    integration_time: float # [ns]
+    cycle_duration: float # [s] minimum duration of one cycle (stabilization, integration and pause)
+    axes: tuple # voltages of each sweep axis [V], outermost axis first
+    data_shape: tuple # shape of the data of one channel once reshaped, outermost axis first
+
+def make_run_plan(config) -> RunPlan:
+    """
+    Compute the parameters of the next measurement once, so that the acquisition loops don't evaluate the config properties at each iteration.
+    Must be called after the last change of the config and before the measurement.
+
+    Parameters
+    ----------
+    config : ApplicationConfig1D, ApplicationConfig2D or ApplicationConfig3D
+        Configuration of the HVI program. The axes are detected from the num_steps_2d and num_steps_3d attributes.
+
+    Returns
+    -------
+    RunPlan
+        Parameters of the measurement.
+    """
+    points_per_cycle = config.acquisition_points_per_cycle # evaluate the properties only once
+    num_cycles = config.num_cycles
+    cycles_per_segment, num_segments = calc_num_cycles_per_segment(num_cycles, points_per_cycle, config.use_QD_emulator)
+
+    if config.use_QD_emulator:
+        conversion_factor = 2**-12
+    else:
+        conversion_factor = float(config.fullscale)/(2.**15 -1)
+
+    axes = [np.linspace(config.vi_1d, config.vf_1d, config.num_steps_1d)]
+    if hasattr(config, "num_steps_2d"):
+        axes.insert(0, np.linspace(config.vi_2d, config.vf_2d, config.num_steps_2d))
+    if hasattr(config, "num_steps_3d"):
+        axes.insert(0, np.linspace(config.vi_3d, config.vf_3d, config.num_steps_3d))
+    for axis in axes:
+        axis.setflags(write=False)
+
+    cycle_duration = (config.stabilization_cycles + config.integration_cycles + config.pause_cycles)*config.hvi_clock_cycle*1e-9
+
+    return RunPlan(points_per_cycle=points_per_cycle, num_cycles=num_cycles, acquisition_points=points_per_cycle*num_cycles,
+                   cycles_per_segment=cycles_per_segment, num_segments=num_segments, conversion_factor=conversion_factor,
+                   integration_time=config.integration_time, cycle_duration=cycle_duration,
+                   axes=tuple(axes), data_shape=tuple(axis.size for axis in axes))
+
 def calc_num_cycles_per_segment(num_cycles, points_per_cycle, use_QD_emulator=False) -> Tuple[int, int]:
     """
     Calculate the number of cycles per measurement segment and the number of segments.
-    The number of cycles per segment is calculated to avoid reaching the maximum number of points that can be acquired in one go.
+    The number of cycles per segment is calculated to avoid reaching the maximum number of points that can be acquired in one go
+    and to fit in the 16-bit HVI register counting the cycles of a segment (needed for 3D sweeps and large 2D sweeps).
 
     Parameters
     ----------
@@ -1378,10 +1647,11 @@ def calc_num_cycles_per_segment(num_cycles, points_per_cycle, use_QD_emulator=Fa
         POINTS_THRESHOLD = 10000000 # to be tested, timeout is time related rather than the number of points measured
     else:
         POINTS_THRESHOLD = 1000000000 # actual limit is around 2^32
+    MAX_CYCLES_PER_SEGMENT = 2**15-1 # Num Cycles per segment is a 16-bit HVI register
     acquisition_points = num_cycles*points_per_cycle
 
-    if acquisition_points > POINTS_THRESHOLD:
-        num_segments = int(np.ceil(acquisition_points/POINTS_THRESHOLD))
+    if acquisition_points > POINTS_THRESHOLD or num_cycles > MAX_CYCLES_PER_SEGMENT:
+        num_segments = max(int(np.ceil(acquisition_points/POINTS_THRESHOLD)), int(np.ceil(num_cycles/MAX_CYCLES_PER_SEGMENT)))
         cycles_per_segment = int(np.ceil(num_cycles/num_segments))
               
         if cycles_per_segment*num_segments < num_cycles:
@@ -1392,3 +1662,59 @@ def calc_num_cycles_per_segment(num_cycles, points_per_cycle, use_QD_emulator=Fa
 
     return cycles_per_segment, num_segments
 
+def snapshot_config(config) -> dict:
+    """
+    Copy the config fields that define a compiled HVI sequence and the values of its registers.
+
+    Parameters
+    ----------
+    config : ApplicationConfig1D, ApplicationConfig2D or ApplicationConfig3D
+        Configuration of the HVI program.
+
+    Returns
+    -------
+    dict
+        Value of each field of REGISTER_UPDATE_FIELDS, DAQ_RECONFIGURE_FIELDS and RECOMPILE_FIELDS. Missing fields are None.
+    """
+    snapshot = {}
+    for field in REGISTER_UPDATE_FIELDS + DAQ_RECONFIGURE_FIELDS + RECOMPILE_FIELDS:
+        value = getattr(config, field, None)
+        if isinstance(value, list):
+            value = tuple(str(item) for item in value) # module descriptors are compared by content
+        snapshot[field] = value
+
+    return snapshot
+
+def classify_config_change(snapshot, config) -> Tuple[str, List[str]]:
+    """
+    Compare the config used to compile and update the current HVI sequence with the new config
+    and choose the cheapest way to apply the changes: reconfigure the DAQ only, update the registers or recompile.
+
+    Parameters
+    ----------
+    snapshot : dict or None
+        Snapshot of the config applied to the HVI sequence (see snapshot_config). If None, the registers are updated.
+    config : ApplicationConfig1D, ApplicationConfig2D or ApplicationConfig3D
+        New configuration of the HVI program.
+
+    Returns
+    -------
+    action : str
+        CONFIG_CHANGE_DAQ, CONFIG_CHANGE_REGISTERS or CONFIG_CHANGE_RECOMPILE.
+    changed_fields : list of str
+        Fields that changed and require this action.
+    """
+    if snapshot is None:
+        return CONFIG_CHANGE_REGISTERS, []
+
+    new_snapshot = snapshot_config(config)
+    changed_fields = [field for field in new_snapshot if new_snapshot[field] != snapshot.get(field)]
+
+    recompile_fields = [field for field in changed_fields if field in RECOMPILE_FIELDS]
+    if recompile_fields:
+        return CONFIG_CHANGE_RECOMPILE, recompile_fields
+    register_fields = [field for field in changed_fields if field in REGISTER_UPDATE_FIELDS]
+    if register_fields:
+        return CONFIG_CHANGE_REGISTERS, register_fields
+
+    return CONFIG_CHANGE_DAQ, changed_fields
@@ -6,13 +6,14 @@ from matplotlib.widgets import Button
 from mpl_toolkits.axes_grid1.axes_divider import make_axes_locatable
 import os
 import yaml
+import copy
 import inspect
 try:
     import pyqtgraph as pqt
-    from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
+    from pyqtgraph.Qt import QtGui, QtWidgets
     PYQTGRAPH_INSTALLED = True
 except ImportError:
-    from PyQt5 import QtCore, QtGui, QtWidgets # can replace pyqtgraph
+    from PyQt5 import QtGui, QtWidgets # can replace pyqtgraph
     PYQTGRAPH_INSTALLED = False
 from threading import Event
 from generic_logging import quick_config
@@ -25,12 +26,36 @@ except ImportError:
     import keysight_hvi as kthvi
 from KS2201A_lib import ModuleDescriptor, open_modules, configure_awg, configure_digitizer, \
                         calc_slewTimer, calc_step_counter, define_hvi_resources, convertFloatingPointToInteger, \
-                        program_step_to_target_voltage, digitizer_measurement_chx, export_hvi_sequences, \
+                        program_step_to_target_voltage, program_ramp_direction, calc_sweep_direction, digitizer_measurement_chx, export_hvi_sequences, \
                         load_awg, load_digitizer, instruction_name, send_CC_matrix, \
                         Module, read_channel_voltage, verify_sweep_parameters_1d, set_hvi_done, \
-                        initialize_logging, calc_num_cycles_per_segment
+                        initialize_logging, calc_num_cycles_per_segment, make_run_plan
 from file_save_system import create_save_filename
-from firmware_manager import FirmwareVersionTracker
+from firmware_manager import get_firmware_catalogue
+from live_plotting import LivePlotRefresher, BlittedLine, MinMaxDecimator
+
+# Firmwares used by the configs, resolved from the firmware catalogue the first time they are needed
+# structure: {config attribute: (firmware name, model, firmware version)}
+FIRMWARE_REQUIREMENTS = {
+    "M3202A_voltage_registers_firmware": ("Voltage_registers_firmware_SD1_HVI", "M3202A", "04.03.00"),
+    "M3201A_voltage_registers_firmware": ("Voltage_registers_firmware_SD1_HVI", "M3201A", "04.04.00"),
+    "M3202A_virtual_gates_firmware": ("M3202A_virtual_gates_firmware", "M3202A", "04.03.00"), # offset and waveform
+    "M3202A_VG_CC8_card1_voltreg_firmware": ("VG_CC8_card1_v3_firmware", "M3202A", "04.03.00"),
+    "M3202A_VG_CC8_card2_voltreg_firmware": ("VG_CC8_card2_v3_firmware", "M3202A", "04.03.00"),
+    "M3201A_VG_CC8_card1_voltreg_firmware": ("VG_CC8_card1_v3_firmware", "M3201A", "04.04.00"),
+    "M3201A_VG_CC8_card2_voltreg_firmware": ("VG_CC8_card2_v3_firmware", "M3201A", "04.04.00"),
+    "M3202A_VG_CC12_card1_voltreg_firmware": ("VG_CC12_card1_v3_firmware", "M3202A", "04.03.00"),
+    "M3202A_VG_CC12_card2_voltreg_firmware": ("VG_CC12_card2_v3_firmware", "M3202A", "04.03.00"),
+    "M3202A_VG_CC12_card3_voltreg_firmware": ("VG_CC12_card3_v3_firmware", "M3202A", "04.03.00"),
+    "M3100A_default_firmware": ("Digitizer_default_firmware", "M3100A", "02.03.00"),
+    "QD_emulator_firmware": ("QD_emulator_firmware_Cm_variable", "M3100A", "02.03.00"),
+}
+# Firmwares of each VG card, indexed by card_num_VG. structure: {config attribute: (config attributes of FIRMWARE_REQUIREMENTS)}
+FIRMWARE_LISTS = {
+    "M3202A_VG_CC8_firmware_list": ("M3202A_voltage_registers_firmware", "M3202A_VG_CC8_card1_voltreg_firmware", "M3202A_VG_CC8_card2_voltreg_firmware"),
+    "M3201A_VG_CC8_firmware_list": ("M3201A_voltage_registers_firmware", "M3201A_VG_CC8_card1_voltreg_firmware", "M3201A_VG_CC8_card2_voltreg_firmware"),
+    "M3202A_VG_CC12_firmware_list": ("M3202A_voltage_registers_firmware", "M3202A_VG_CC12_card1_voltreg_firmware", "M3202A_VG_CC12_card2_voltreg_firmware", "M3202A_VG_CC12_card3_voltreg_firmware"),
+}
 
 #%% Config
 class ApplicationConfig1D:
@@ -69,10 +94,10 @@ class ApplicationConfig1D:
         # self.slew_time_name = "Slew Time" # the register is reused and updated before all voltages ramps
         self.ramp_counter_1d_name = "Ramp Counter 1D"
         self.awg_loop_counter_1d_name = "AWG Loop Counter 1D"
-        self.voltage_increment_name = "Voltage Increment"
-        self.neg_voltage_increment_name = "Neg Voltage Increment"
-        self.sweep_direction_name = "Sweep Direction" # positive or negative
-        self.neg_counter_name = "Neg Counter" # increment if VchX and/or Vi is negative
+        self.sweep_direction_name = "Sweep Direction" # signed voltage increment of the 1D sweep, set by the PC
+        self.ramp_direction_1d_name = "Ramp Direction 1D" # +1 or -1, set by HVI before ramps with an unknown starting voltage
+        self.offset_voltage_name = "Offset Voltage" # voltage in offset binary, used to compare voltages of different signs
+        self.offset_target_name = "Offset Target" # target voltage in offset binary
         self.awg_debug_name = "AWG Debug" # register used to debug
 
         self.stabilization_time_name = "Stabilization Time"
@@ -83,6 +108,8 @@ class ApplicationConfig1D:
         self.num_cycles_since_config_name = "Num Cycles Since Config"
         self.hvi_done_name = "HVI Done"
         self.dig_debug_name = "DIG Debug"
+        self.trace_counter_1d_name = "Trace Counter 1D" # traces measured in the current run when the sweep is repeated (video mode)
+        self.num_traces_1d_name = "Num Traces 1D" # traces measured in each run when the sweep is repeated (video mode)
         
         self.instruction_name = instruction_name() # class to generate unique names for instructions
 
@@ -92,25 +119,7 @@ class ApplicationConfig1D:
         Define names of FPGA sandbox resources
         """
         # Bitstream files generated by compiling PathWave FPGA project files
-        self.fw_database = FirmwareVersionTracker()
-        self.fw_database.load_database()
-
-        self.M3202A_voltage_registers_firmware = self.fw_database.get_fw("Voltage_registers_firmware_SD1_HVI", "M3202A", "04.03.00")
-        self.M3201A_voltage_registers_firmware = self.fw_database.get_fw("Voltage_registers_firmware_SD1_HVI", "M3201A", "04.04.00")
-        self.M3202A_virtual_gates_firmware = self.fw_database.get_fw("M3202A_virtual_gates_firmware", "M3202A", "04.03.00") # offset and waveform
-        self.M3202A_VG_CC8_card1_voltreg_firmware = self.fw_database.get_fw("VG_CC8_card1_v3_firmware", "M3202A", "04.03.00")
-        self.M3202A_VG_CC8_card2_voltreg_firmware = self.fw_database.get_fw("VG_CC8_card2_v3_firmware", "M3202A", "04.03.00")
-        self.M3202A_VG_CC8_firmware_list = [self.M3202A_voltage_registers_firmware, self.M3202A_VG_CC8_card1_voltreg_firmware, self.M3202A_VG_CC8_card2_voltreg_firmware]
-        self.M3201A_VG_CC8_card1_voltreg_firmware = self.fw_database.get_fw("VG_CC8_card1_v3_firmware", "M3201A", "04.04.00")
-        self.M3201A_VG_CC8_card2_voltreg_firmware = self.fw_database.get_fw("VG_CC8_card2_v3_firmware", "M3201A", "04.04.00")
-        self.M3201A_VG_CC8_firmware_list = [self.M3201A_voltage_registers_firmware, self.M3201A_VG_CC8_card1_voltreg_firmware, self.M3201A_VG_CC8_card2_voltreg_firmware]
-        self.M3202A_VG_CC12_card1_voltreg_firmware = self.fw_database.get_fw("VG_CC12_card1_v3_firmware", "M3202A", "04.03.00")
-        self.M3202A_VG_CC12_card2_voltreg_firmware = self.fw_database.get_fw("VG_CC12_card2_v3_firmware", "M3202A", "04.03.00")
-        self.M3202A_VG_CC12_card3_voltreg_firmware = self.fw_database.get_fw("VG_CC12_card3_v3_firmware", "M3202A", "04.03.00")
-        self.M3202A_VG_CC12_firmware_list = [self.M3202A_voltage_registers_firmware, self.M3202A_VG_CC12_card1_voltreg_firmware, self.M3202A_VG_CC12_card2_voltreg_firmware, self.M3202A_VG_CC12_card3_voltreg_firmware]
-        self.M3100A_default_firmware = self.fw_database.get_fw("Digitizer_default_firmware", "M3100A", "02.03.00")
-        self.QD_emulator_firmware  = self.fw_database.get_fw("QD_emulator_firmware_Cm_variable", "M3100A", "02.03.00")
-
+        # They are resolved from the firmware catalogue on first use (see FIRMWARE_REQUIREMENTS and __getattr__)
         # Sandbox name defined by each instrument. See SD1 3.x User Guide for further info
         self.M3xxxA_sandbox = "sandbox0" # The M3xxxA_sandbox name is not arbitrary and cannot be changed
         # FPGA Sandbox resource names
@@ -168,6 +177,8 @@ class ApplicationConfig1D:
         self.pause_time = 0
         self.max_time = 30 # Maximum time in between data acquisitions before timeout
         self.print_interval = 0.3 # 0 for real-time logging in interact_with_hvi
+        self.live_plot_fps = 10 # refresh rate of the live plots [frames/s]
+        self.colour_percentiles = None # (low, high) percentiles used as colour limits of the live images, None for the min/max
 
         """
         AWG parameters
@@ -251,27 +262,36 @@ class ApplicationConfig1D:
         # Add number of virtual gates modules to config
         config.nb_VG_awg_modules = nb_VG_awg_modules
 
-        # Update yaml file with verified_num_steps_1d
-        with open(yaml_file, 'r+') as file:
-            lines = file.readlines()
-            for i, line in enumerate(lines):
-                if "verified_num_steps_1d" in line:
-                    split_line = line.split(":")
-                    split_value = split_line[1].split(" ") # verified_num_steps_1d = split_value[1]
+        # Add YAML config filename and content to config, the file itself is never modified
+        config.yaml_file = yaml_file
+        config.yaml_data = data
 
-                    # Recombine the split line
-                    split_value[1] = str(config.num_steps_1d)
-                    split_line[1] = " ".join(split_value)
-                    lines[i] = ":".join(split_line)
+        return config
 
-            # Write the updated lines to the file
-            file.seek(0)
-            file.writelines(lines)
+    def to_yaml(self, yaml_file):
+        """
+        Save the config used for a measurement in a YAML file with the same structure as the file given to from_yaml.
+        The values are taken from the config object, including the sweep parameters fixed by the verify_sweep_parameters functions.
 
-        # Add YAML config filename to config
-        config.yaml_file = yaml_file
+        Parameters
+        ----------
+        yaml_file : str
+            Path of the YAML file to write, usually next to the dataset.
+        """
+        data = copy.deepcopy(self.yaml_data)
+        config_data = data["ApplicationConfig"]
+        attribute_names = {"prescaler": "dig_prescaler", "integration_time": "integration_time_input"} # YAML keys that differ from the attribute names
+        for key in config_data:
+            if key.startswith("verified_"):
+                attribute_name = key[len("verified_"):]
+            else:
+                attribute_name = attribute_names.get(key, key)
+            if attribute_name in self.__dict__:
+                value = self.__dict__[attribute_name]
+                config_data[key] = value.item() if isinstance(value, np.generic) else value # numpy scalars can't be dumped by safe_dump
 
-        return config
+        with open(yaml_file, 'w') as file:
+            yaml.safe_dump(data, file, sort_keys=False)
     
     @property
     def vi_1d_internal(self):
@@ -337,6 +357,20 @@ class ApplicationConfig1D:
 
     def __repr__(self):
         return self.__str__()
+
+    def __getattr__(self, name):
+        # Only called when the attribute isn't found, i.e. the first time a firmware is needed
+        if name in FIRMWARE_REQUIREMENTS:
+            value = get_firmware_catalogue().get_fw(*FIRMWARE_REQUIREMENTS[name])
+        elif name in FIRMWARE_LISTS:
+            value = [getattr(self, firmware_name) for firmware_name in FIRMWARE_LISTS[name]]
+        elif name == "fw_database":
+            return get_firmware_catalogue() # not cached to follow the changes of the database file
+        else:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+        setattr(self, name, value)
+        return value
     
     def __del__(self):
         self.console_handler.close()
@@ -381,10 +415,11 @@ def define_awg_registers_1d(sequencer, awg_module: Module, config):
     config.logger.info("Slew Timer: {}".format(calc_slewTimer(config.vi_1d_internal, config.vf_1d_internal, config.slew_rate_1d, dV=config.dV)))
 
     # sweep_direction
-    sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.sweep_direction_name, kthvi.RegisterSize.SHORT)
-
-    neg_counter = sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.neg_counter_name, kthvi.RegisterSize.SHORT)
-    neg_counter.initial_value = 0
+    sweep_direction = sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.sweep_direction_name, kthvi.RegisterSize.SHORT)
+    sweep_direction.initial_value = calc_sweep_direction(awg_module, config.vi_1d_internal, config.vf_1d_internal, dV=config.dV)
+    sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.ramp_direction_1d_name, kthvi.RegisterSize.SHORT)
+    sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.offset_voltage_name, kthvi.RegisterSize.SHORT)
+    sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.offset_target_name, kthvi.RegisterSize.SHORT)
 
     # awg_debug = sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.awg_debug_name, kthvi.RegisterSize.SHORT)
     # awg_debug.initial_value = 0
@@ -394,12 +429,8 @@ def define_awg_registers_1d(sequencer, awg_module: Module, config):
     ramp_counter_1d = sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.ramp_counter_1d_name, kthvi.RegisterSize.SHORT)
     ramp_counter = calc_step_counter(config.vi_1d_internal, config.vf_1d_internal, 2, dV=config.dV)
     ramp_counter_1d.initial_value = ramp_counter
-    voltage_increment = sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.voltage_increment_name, kthvi.RegisterSize.SHORT)
-    voltage_increment.initial_value = awg_module.instrument.voltsToInt(config.dV)
-    neg_voltage_increment = sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.neg_voltage_increment_name, kthvi.RegisterSize.SHORT)
-    neg_voltage_increment.initial_value = awg_module.instrument.voltsToInt(-1*config.dV)
     config.logger.info("Ramp counter 1d: {}".format(ramp_counter))
-    config.logger.info("Voltage increment: {}".format(awg_module.instrument.voltsToInt(config.dV)))
+    config.logger.info("Sweep direction: {}".format(sweep_direction.initial_value))
 
 
 def define_dig_registers_1d(sequencer, dig_module: Module, config):
@@ -470,37 +501,55 @@ def update_awg_registers_1d(hvi, awg_module, config, module_dict):
     vf_1d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.vf_1d_name]
     vf_1d.initial_value = awg_module.instrument.voltsToInt(config.vf_1d_internal)
 
-    if config.use_virtual_gates:
-        secondary_awg_module = module_dict[config.secondary_awg_engine_name]
-        v_2d, v_2d_int = read_channel_voltage(config.AWG_channel_2d, secondary_awg_module, HZ=False)
-        vg_v_2d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
-        vg_v_2d.initial_value = v_2d_int
-
-        # Update the voltage register on the vg modules
-        for vg_module_descriptor in config.vg_module_descriptor_list:
-            vg_v_2d = hvi.sync_sequence.scopes[vg_module_descriptor.engine_name].registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
-            vg_v_2d.initial_value = v_2d_int
+    update_vg_voltage_registers_1d(hvi, awg_module, config, module_dict)
 
     # slew_time = hvi.sync_sequence.scopes[awg_engine_name].registers[config.slew_time_name]
     # slew_time.initial_value = calc_slewTimer(config.vi_1d_internal, config.vf_1d_internal, config.slew_rate_1d, dV=config.dV)
 
-    neg_counter = hvi.sync_sequence.scopes[awg_engine_name].registers[config.neg_counter_name]
-    neg_counter.initial_value = 0
+    sweep_direction = hvi.sync_sequence.scopes[awg_engine_name].registers[config.sweep_direction_name]
+    sweep_direction.initial_value = calc_sweep_direction(awg_module, config.vi_1d_internal, config.vf_1d_internal, dV=config.dV)
 
     awg_loop_counter_1d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.awg_loop_counter_1d_name]
     awg_loop_counter_1d.initial_value = 0
     ramp_counter_1d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.ramp_counter_1d_name]
     ramp_counter = calc_step_counter(config.vi_1d_internal, config.vf_1d_internal, 2, dV=config.dV)
     ramp_counter_1d.initial_value = ramp_counter
-    voltage_increment = hvi.sync_sequence.scopes[awg_engine_name].registers[config.voltage_increment_name]
-    voltage_increment.initial_value = awg_module.instrument.voltsToInt(config.dV)
-    neg_voltage_increment = hvi.sync_sequence.scopes[awg_engine_name].registers[config.neg_voltage_increment_name]
-    neg_voltage_increment.initial_value = awg_module.instrument.voltsToInt(-1*config.dV)
 
     # awg_debug = hvi.sync_sequence.scopes[awg_engine_name].registers[config.awg_debug_name]
     # awg_debug.initial_value = 0
 
 
+def update_vg_voltage_registers_1d(hvi, awg_module, config, module_dict):
+    """
+    Update the virtual gates registers of the 1D sweep holding the 2D voltage read on the hardware.
+    The voltage can change between two runs without any change of the config, so these registers are updated before each run.
+
+    Parameters
+    ----------
+    hvi : kthvi.Hvi
+        HVI object.
+    awg_module : Module
+        AWG module object.
+    config : ApplicationConfig1D
+        Configuration of the HVI program.
+    module_dict : dict
+        Dictionary containing all the modules used in the HVI program.
+    """
+    if not config.use_virtual_gates:
+        return
+    awg_engine_name = awg_module.engine_name
+
+    secondary_awg_module = module_dict[config.secondary_awg_engine_name]
+    v_2d, v_2d_int = read_channel_voltage(config.AWG_channel_2d, secondary_awg_module, HZ=False)
+    vg_v_2d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
+    vg_v_2d.initial_value = v_2d_int
+
+    # Update the voltage register on the vg modules
+    for vg_module_descriptor in config.vg_module_descriptor_list:
+        vg_v_2d = hvi.sync_sequence.scopes[vg_module_descriptor.engine_name].registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
+        vg_v_2d.initial_value = v_2d_int
+
+
 def update_dig_registers_1d(hvi, dig_module, config):
     """
     Update the 1D sweep digitizer registers of the module's HVI engine in the scope of the global sync sequence.
@@ -616,9 +665,10 @@ def sweeper_1d(sequencer, awg_module, dig_module, config, virtual_gates_modules=
     awg_registers = sequencer.sync_sequence.scopes[awg_engine_name].registers
     voltage_channel_1d = awg_registers[config.voltage_1d_name.format(config.AWG_channel_1d)] 
     vi_1d = awg_registers[config.vi_1d_name]
-    vf_1d = awg_registers[config.vf_1d_name]
     awg_loop_counter_1d = awg_registers[config.awg_loop_counter_1d_name]
     ramp_counter_1d = awg_registers[config.ramp_counter_1d_name]
+    sweep_direction = awg_registers[config.sweep_direction_name]
+    ramp_direction_1d = awg_registers[config.ramp_direction_1d_name]
     # awg_debug = awg_registers[config.awg_debug_name]
 
     dig_registers = sequencer.sync_sequence.scopes[dig_engine_name].registers
@@ -632,29 +682,52 @@ def sweeper_1d(sequencer, awg_module, dig_module, config, virtual_gates_modules=
     ###########################################################################
 
     # Start by going to initial voltage by increments of 1 (ramp_counter_1d can't be calculated in define_awg_registers_1d for an unknown starting voltage)
+    # The ramp direction is decided once before the ramp so the loop doesn't need any condition
+    instruction_label = config.instruction_name.unique("Ramp direction Vi 1D")
+    sync_block = sequencer.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    awg_sequence = sync_block.sequences[awg_engine_name]
+    program_ramp_direction(sequencer, awg_module, awg_sequence, config, voltage_channel_1d, vi_1d, ramp_direction_1d)
+    if len(virtual_gates_modules) > 0:
+        for virtual_gate_module in virtual_gates_modules:
+            vg_awg_registers = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers
+            voltage_channel = vg_awg_registers[config.vg_voltage_1d_name.format(config.AWG_channel_1d)]
+            program_ramp_direction(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, voltage_channel, vg_awg_registers[config.vi_1d_name], vg_awg_registers[config.ramp_direction_1d_name])
+
+    # Start delays of the loop instructions around the step, subtracted from the wait to keep the slew rate
+    sync_while_start_delay = 570
+    sync_block_start_delay = 260
+    loop_overhead = sync_while_start_delay + sync_block_start_delay
+
     # Configure Sync While Condition
     sync_while_condition = kthvi.Condition.register_comparison(voltage_channel_1d, kthvi.ComparisonOperator.NOT_EQUAL_TO, vi_1d)
     instruction_label = config.instruction_name.unique("While Voltage Chx != Vi 1D")
-    sync_while_init = sequencer.sync_sequence.add_sync_while(instruction_label, 570, sync_while_condition)
+    sync_while_init = sequencer.sync_sequence.add_sync_while(instruction_label, sync_while_start_delay, sync_while_condition)
 
     # Add a sync block
     instruction_label = config.instruction_name.unique("Go to Vi")
-    sync_block = sync_while_init.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    sync_block = sync_while_init.sync_sequence.add_sync_multi_sequence_block(instruction_label, sync_block_start_delay)
     awg_sequence = sync_block.sequences[awg_engine_name]
 
     voltage_channel = sequencer.sync_sequence.scopes[awg_module.engine_name].registers[config.voltage_1d_name.format(config.AWG_channel_1d)]
-    program_step_to_target_voltage(sequencer, awg_module, awg_sequence, config, config.AWG_channel_1d, voltage_channel, vi_1d, config.slew_rate_1d, use_dV_from_config=False)
+    program_step_to_target_voltage(sequencer, awg_module, awg_sequence, config, config.AWG_channel_1d, voltage_channel, ramp_direction_1d, config.slew_rate_1d, use_dV_from_config=False, loop_overhead=loop_overhead)
     if len(virtual_gates_modules) > 0:
         for virtual_gate_module in virtual_gates_modules:
             voltage_channel = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers[config.vg_voltage_1d_name.format(config.AWG_channel_1d)]
             vg_awg_registers = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers
-            vg_vi_1d = vg_awg_registers[config.vi_1d_name]
-            program_step_to_target_voltage(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, config.AWG_channel_1d, voltage_channel, vg_vi_1d, config.slew_rate_1d, use_dV_from_config=False, output_voltage=False, source_VG_module=awg_module)
+            vg_ramp_direction_1d = vg_awg_registers[config.ramp_direction_1d_name]
+            program_step_to_target_voltage(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, config.AWG_channel_1d, voltage_channel, vg_ramp_direction_1d, config.slew_rate_1d, use_dV_from_config=False, output_voltage=False, source_VG_module=awg_module, loop_overhead=loop_overhead)
 
     # Add a sync block
     instruction_label = config.instruction_name.unique("First measurement")
     sync_block = sequencer.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
 
+    # Decide the direction of the voltage ramps on the virtual gates modules (unknown starting voltage)
+    if len(virtual_gates_modules) > 0:
+        for virtual_gate_module in virtual_gates_modules:
+            vg_awg_registers = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers
+            voltage_channel = vg_awg_registers[config.vg_voltage_1d_name.format(config.AWG_channel_1d)]
+            program_ramp_direction(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, voltage_channel, vg_awg_registers[config.vf_1d_name], vg_awg_registers[config.ramp_direction_1d_name])
+
     # Do first measurement at Vi 1D
     dig_sequence = sync_block.sequences[dig_engine_name]
     digitizer_measurement_chx(dig_sequence, config)
@@ -680,29 +753,39 @@ def sweeper_1d(sequencer, awg_module, dig_module, config, virtual_gates_modules=
 
     ###########################################################################
 
+    # Start delays of the loop instructions around the step, subtracted from the wait to keep the slew rate.
+    # The Measure block is counted without the measurement, the steps with a measurement are only slower.
+    sync_while_start_delay = 320
+    sync_block_start_delay = 260
+    awg_loop_counter_start_delay = 10
+    measure_block_start_delay = 100
+    loop_counter_start_delay = 10+80
+    measure_if_start_delay = 70+40 # 100 ns needed for the loop counter to be updated before condition
+    loop_overhead = sync_while_start_delay + sync_block_start_delay + awg_loop_counter_start_delay + measure_block_start_delay + loop_counter_start_delay + measure_if_start_delay
+
     # Configure Sync While Condition
     sync_while_condition = kthvi.Condition.register_comparison(awg_loop_counter_1d, kthvi.ComparisonOperator.LESS_THAN, ramp_counter_1d)
     instruction_label = config.instruction_name.unique("While AWG loop counter 1D < ramp counter 1D")
-    sync_while_1D = sequencer.sync_sequence.add_sync_while(instruction_label, 320, sync_while_condition)
+    sync_while_1D = sequencer.sync_sequence.add_sync_while(instruction_label, sync_while_start_delay, sync_while_condition)
 
     # Add a sync block
     instruction_label = config.instruction_name.unique("Sweep")
-    sync_block = sync_while_1D.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    sync_block = sync_while_1D.sync_sequence.add_sync_multi_sequence_block(instruction_label, sync_block_start_delay)
     awg_sequence = sync_block.sequences[awg_engine_name]
 
     # Go to final voltage
     voltage_channel = sequencer.sync_sequence.scopes[awg_module.engine_name].registers[config.voltage_1d_name.format(config.AWG_channel_1d)]
-    program_step_to_target_voltage(sequencer, awg_module, awg_sequence, config, config.AWG_channel_1d, voltage_channel, vf_1d, config.slew_rate_1d, use_dV_from_config = True)
+    program_step_to_target_voltage(sequencer, awg_module, awg_sequence, config, config.AWG_channel_1d, voltage_channel, sweep_direction, config.slew_rate_1d, use_dV_from_config = True, loop_overhead=loop_overhead)
     if len(virtual_gates_modules) > 0:
         for virtual_gate_module in virtual_gates_modules:
             voltage_channel = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers[config.vg_voltage_1d_name.format(config.AWG_channel_1d)]
             vg_awg_registers = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers
-            vg_vf_1d = vg_awg_registers[config.vf_1d_name]
-            program_step_to_target_voltage(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, config.AWG_channel_1d, voltage_channel, vg_vf_1d, config.slew_rate_1d, use_dV_from_config=False, output_voltage=False, source_VG_module=awg_module)
+            vg_ramp_direction_1d = vg_awg_registers[config.ramp_direction_1d_name]
+            program_step_to_target_voltage(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, config.AWG_channel_1d, voltage_channel, vg_ramp_direction_1d, config.slew_rate_1d, use_dV_from_config=False, output_voltage=False, source_VG_module=awg_module, loop_overhead=loop_overhead)
 
     # Increment AWG loop counter
     instruction_label = config.instruction_name.unique("AWG loop counter 1D += 1")
-    instruction = awg_sequence.add_instruction(instruction_label, 10, awg_sequence.instruction_set.add.id)
+    instruction = awg_sequence.add_instruction(instruction_label, awg_loop_counter_start_delay, awg_sequence.instruction_set.add.id)
     instruction.set_parameter(awg_sequence.instruction_set.add.destination.id, awg_loop_counter_1d)
     instruction.set_parameter(awg_sequence.instruction_set.add.left_operand.id, awg_loop_counter_1d)
     instruction.set_parameter(awg_sequence.instruction_set.add.right_operand.id, 1)
@@ -727,13 +810,13 @@ def sweeper_1d(sequencer, awg_module, dig_module, config, virtual_gates_modules=
 
     # Add a sync block
     instruction_label = config.instruction_name.unique("Measure")
-    sync_block = sync_while_1D.sync_sequence.add_sync_multi_sequence_block(instruction_label, 100)
+    sync_block = sync_while_1D.sync_sequence.add_sync_multi_sequence_block(instruction_label, measure_block_start_delay)
 
     # Measure with digitizer
     dig_sequence = sync_block.sequences[dig_engine_name]
 
     instruction_label = config.instruction_name.unique("Loop Counter += 1")
-    instruction = dig_sequence.add_instruction(instruction_label, 10+80, dig_sequence.instruction_set.add.id)
+    instruction = dig_sequence.add_instruction(instruction_label, loop_counter_start_delay, dig_sequence.instruction_set.add.id)
     instruction.set_parameter(dig_sequence.instruction_set.add.destination.id, loop_counter_1d)
     instruction.set_parameter(dig_sequence.instruction_set.add.left_operand.id, loop_counter_1d)
     instruction.set_parameter(dig_sequence.instruction_set.add.right_operand.id, 1)
@@ -745,7 +828,7 @@ def sweeper_1d(sequencer, awg_module, dig_module, config, virtual_gates_modules=
     # Add If statement
     enable_ifbranches_time_matching = False # Set flag that enables to match the execution time of all the IF branches
     instruction_label = config.instruction_name.unique("Loop Counter < Step Counter 1D")
-    if_statement = dig_sequence.add_if(instruction_label, 70+40, if_condition, enable_ifbranches_time_matching) # 100 ns needed for the loop counter to be updated before condition
+    if_statement = dig_sequence.add_if(instruction_label, measure_if_start_delay, if_condition, enable_ifbranches_time_matching)
 
     # Program IF branch
     if_sequence = if_statement.if_branch.sequence
@@ -797,7 +880,7 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
     vf_1d = awg_registers[config.vf_1d_name]
     # slew_time = awg_registers[config.slew_time_name]
     sweep_direction = awg_registers[config.sweep_direction_name]
-    neg_counter = awg_registers[config.neg_counter_name]
+    ramp_direction_1d = awg_registers[config.ramp_direction_1d_name]
     # awg_debug = awg_registers[config.awg_debug_name]
 
     # Dig registers
@@ -813,7 +896,7 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
     vf_1d_read = vf_1d.read()
     # slew_time_read = slew_time.read()
     sweep_direction_read = sweep_direction.read()
-    neg_counter_read = neg_counter.read()
+    ramp_direction_1d_read = ramp_direction_1d.read()
     # awg_debug_read = awg_debug.read()
     voltage_channel_1d_read = voltage_channel_1d.read()
     loop_counter_read = loop_counter_1d.read()
@@ -823,7 +906,7 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
     logger.info("Vi 1D: {}".format(vi_1d_read))
     logger.info("Vf 1D: {}".format(vf_1d_read))
     # logger.info("Slew Time: {}".format(slew_time_read))
-    logger.info("Neg counter: {}".format(neg_counter_read))
+    logger.info("Ramp direction 1D: {}".format(ramp_direction_1d_read))
     logger.info("Init Voltage Ch{}: {}".format(config.AWG_channel_1d, voltage_channel_1d_read))
     # logger.info("AWG Debug: {}".format(awg_debug_read))
     logger.info("Step counter: {}".format(step_counter_1d_read))
@@ -831,20 +914,21 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
     # logger.info("AWG Debug: {}".format(awg_debug_read))
     logger.info("DIG Debug: {}".format(dig_debug_read))
 
-    if config.use_QD_emulator:
-        conversion_factor = 2**-12
-    else:
-        conversion_factor = float(config.fullscale)/(2.**15 -1)
+    # Parameters of the measurement, computed once for the acquisition loop
+    plan = make_run_plan(config)
+    conversion_factor = plan.conversion_factor
+    acquisition_points_per_cycle = plan.points_per_cycle
+    acquisition_points = plan.acquisition_points
 
     buffer = np.array([])
     if average_data:
-        averaged_data = np.empty(config.num_steps_1d)
+        averaged_data = np.empty(plan.num_cycles)
         averaged_data[:] = np.nan
     else:
-        measured_data = np.empty(config.acquisition_points)
+        measured_data = np.empty(acquisition_points)
         measured_data[:] = np.nan
     averaged_data_index = 0 # first empty slot in the averaged_data array
-    x = np.linspace(config.vi_1d, config.vf_1d_internal, config.num_steps_1d)
+    x = plan.axes[0]
     readPoints = 0
     old_readPoints = 0
     timeout_counter = 0
@@ -856,9 +940,9 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
     else:
         level = logging.DEBUG
     start_time = time.time()
-    cycles_per_segment, num_segments = calc_num_cycles_per_segment(config.num_cycles, config.acquisition_points_per_cycle, config.use_QD_emulator)
+    cycles_per_segment, num_segments = plan.cycles_per_segment, plan.num_segments
     segments_measured = 0
-    logger.info("Number of cycles: {}".format(config.num_cycles))
+    logger.info("Number of cycles: {}".format(plan.num_cycles))
     logger.info("Cycles per segment: {}".format(cycles_per_segment))
     logger.info("Number of segments: {}".format(num_segments))
 
@@ -889,9 +973,6 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
 
         graph_widget.resize(800, 800)
         win.show()
-
-        # Start plotting
-        app = QtWidgets.QApplication.instance()
         config.win = win
     else:
         fig = plt.figure()
@@ -900,8 +981,8 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
             line1, = ax.plot(x[:averaged_data_index], averaged_data[:averaged_data_index], 'r-') # Returns a tuple of line objects, thus the comma
         else:
             line1, = ax.plot(x[:readPoints], measured_data[:readPoints], 'r-')
-        ax.autoscale()
-        ax.relim()
+        ax.set_xlim(np.min(x), np.max(x))
+        live_line = BlittedLine(ax, line1) # only the line is redrawn, the y limits grow when the data leaves them
 
         # Add button to turn autoscale on/off on the figure
         ax_autoscale_toggle = plt.axes([0.75, 0.95, 0.2, 0.04])
@@ -920,12 +1001,9 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
 
         # Modify the autoscale function to check if autoscaling is enabled
         def autoscale(event):
+            live_line.autoscale = autoscale_enabled[0]
             if autoscale_enabled[0]:
-                ax.autoscale(enable=True)
-                ax.relim()
-                plt.draw()
-            elif not autoscale_enabled[0]:
-                ax.autoscale(enable=False) 
+                live_line.limits_set = False # fit the y limits to the next data
 
         button_autoscale_toggle.on_clicked(autoscale)
 
@@ -940,117 +1018,111 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
 
         config.win = None # return None if not using pyqtgraph
 
-    while (readPoints < config.acquisition_points or hvi_done.read() == 0) and not stop_event.is_set():
-        t = time.time() - start_time
+    if not average_data:
+        # The raw trace is drawn at screen resolution, each cycle is shown at the voltage of its step
+        decimator = MinMaxDecimator(acquisition_points)
 
-        # Live plotting
-        if plot_pyqtgraph and PYQTGRAPH_INSTALLED:
-            if average_data:
-                trace.setData(x[:averaged_data_index], averaged_data[:averaged_data_index])
-            else:
-                trace.setData(x[:readPoints], measured_data[:readPoints])
+    def draw_live_plot():
+        if average_data:
+            x_view = x[:averaged_data_index]
+            y_view = averaged_data[:averaged_data_index]
         else:
-            if average_data:
-                line1.set_xdata(x[:averaged_data_index])
-                line1.set_ydata(averaged_data[:averaged_data_index])
-            else:
-                line1.set_xdata(x[:readPoints])
-                line1.set_ydata(measured_data[:readPoints])
-            ax.relim()
-            ax.autoscale(enable=None)
-            plt.draw()
-
-        QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 10)
-
-        # if t > next_print:
-        voltage_channel_1d_read = voltage_channel_1d.read()
-        sweep_direction_read = sweep_direction.read()
-        # awg_debug_read = awg_debug.read()
-        loop_counter_read = loop_counter_1d.read()
-        dig_debug_read = dig_debug.read()
-
-        logger.log(level, "Voltage Ch{}: {} | Sweep direction: {}".format(config.AWG_channel_1d, voltage_channel_1d_read, sweep_direction_read))
-        logger.log(level, "Loop counter: {} | DIG Debug: {}".format(loop_counter_read, dig_debug_read))
-        logger.log(level, "Read points: {}".format(readPoints))
-        next_print = next_print + config.print_interval
-
-        # TODO: Add timeout for measurement, can be trigged by accident for slow measurements for the moment
-        # if readPoints == old_readPoints and readPoints > 0: # Check for measurement timeout only after the measurement has started
-        #     timeout_counter = timeout_counter + 1
-        #     if timeout_counter > round(config.max_time/config.print_interval):
-        #         config.logger.debug("Timeout during measurement")
-        #         break
-        # old_readPoints = readPoints
-        if countdown: print("Progress: {}%, Measurement time: {:.01f}".format(round(readPoints/config.acquisition_points*100), t), end='\r')
-
-        ready_pts = dig_module.instrument.DAQcounterRead(DAQ_channel)
-        acquisition_points_per_cycle = config.acquisition_points_per_cycle
-        if ready_pts > 0:
-            data = dig_module.instrument.DAQread(DAQ_channel, ready_pts, timeout) # return a Numpy array
-            if not average_data:
-                measured_data[readPoints:readPoints+ready_pts] = data*conversion_factor
-            else:
-                # Add buffer before data
-                if buffer.size > 0:
-                    data = np.append(buffer, data)
-                    buffer = np.array([])
-                if data.size >= acquisition_points_per_cycle:
-                    # Find the number of points that fill the buffer and average them directly
-                    nb_filled_buffers = data.size // acquisition_points_per_cycle
-                    averaged_data[averaged_data_index:averaged_data_index+nb_filled_buffers] = np.mean(data[:nb_filled_buffers*acquisition_points_per_cycle].reshape((nb_filled_buffers, acquisition_points_per_cycle)), axis=1)*conversion_factor
-                    averaged_data_index = averaged_data_index + nb_filled_buffers
-
-                    # Move the remaining data to the buffer
-                    buffer = data[nb_filled_buffers*acquisition_points_per_cycle:]
-                else:
-                    # Move data to buffer
-                    buffer = data
-
-            readPoints = readPoints + ready_pts
-            config.logger.debug("{}/{} points read on ch{}".format(readPoints, config.acquisition_points, DAQ_channel))
-
+            decimator.update(measured_data, readPoints)
+            index, y_view = decimator.view()
+            x_view = x[index//acquisition_points_per_cycle]
+        if plot_pyqtgraph and PYQTGRAPH_INSTALLED:
+            trace.setData(x_view, y_view)
         else:
-            config.logger.debug("Checking if a full segment of data has been measured.")
-            # Check if a complete segment of data has been measured
-            num_cycles_seg_read = num_cycles_seg.read()
-            num_cycles_since_config_read = num_cycles_since_config.read()
-            config.logger.debug("Number of cycles since config / in segment: {} / {}".format(num_cycles_since_config_read, num_cycles_seg_read))
-            if num_cycles_since_config_read >= num_cycles_seg_read:
-                segments_measured = segments_measured + 1
-                config.logger.info("Segment {} of {} measured.".format(segments_measured, num_segments))
-                if segments_measured == num_segments - 1: # if we are measuring the second last segment
-                    # Calculate the number of cycles for the last segment
-                    remaining_cycles = config.num_cycles - cycles_per_segment*(num_segments - 1)
-                    config.logger.info("Last segment will have {} cycles.".format(remaining_cycles))
-                    configure_digitizer(config, dig_module, num_cycles_override=remaining_cycles)
+            live_line.set_data(x_view, y_view)
+
+    # The plot is redrawn by a timer at a fixed rate while the acquisition loop runs in a worker thread
+    refresher = LivePlotRefresher(draw_live_plot, fps=config.live_plot_fps)
+
+    def acquisition_loop():
+        # Only stores the new data, the live plot is redrawn from the GUI thread
+        nonlocal t, next_print, readPoints, buffer, averaged_data_index, segments_measured
+        while (readPoints < acquisition_points or hvi_done.read() == 0) and not stop_event.is_set():
+            t = time.time() - start_time
+
+            # if t > next_print:
+            voltage_channel_1d_read = voltage_channel_1d.read()
+            sweep_direction_read = sweep_direction.read()
+            # awg_debug_read = awg_debug.read()
+            loop_counter_read = loop_counter_1d.read()
+            dig_debug_read = dig_debug.read()
+
+            logger.log(level, "Voltage Ch{}: {} | Sweep direction: {}".format(config.AWG_channel_1d, voltage_channel_1d_read, sweep_direction_read))
+            logger.log(level, "Loop counter: {} | DIG Debug: {}".format(loop_counter_read, dig_debug_read))
+            logger.log(level, "Read points: {}".format(readPoints))
+            next_print = next_print + config.print_interval
+
+            # TODO: Add timeout for measurement, can be trigged by accident for slow measurements for the moment
+            # if readPoints == old_readPoints and readPoints > 0: # Check for measurement timeout only after the measurement has started
+            #     timeout_counter = timeout_counter + 1
+            #     if timeout_counter > round(config.max_time/config.print_interval):
+            #         config.logger.debug("Timeout during measurement")
+            #         break
+            # old_readPoints = readPoints
+            if countdown: print("Progress: {}%, Measurement time: {:.01f}".format(round(readPoints/acquisition_points*100), t), end='\r')
+
+            ready_pts = dig_module.instrument.DAQcounterRead(DAQ_channel)
+            if ready_pts > 0:
+                data = dig_module.instrument.DAQread(DAQ_channel, ready_pts, timeout) # return a Numpy array
+                if not average_data:
+                    measured_data[readPoints:readPoints+ready_pts] = data*conversion_factor
                 else:
-                    configure_digitizer(config, dig_module)
+                    # Add buffer before data
+                    if buffer.size > 0:
+                        data = np.append(buffer, data)
+                        buffer = np.array([])
+                    if data.size >= acquisition_points_per_cycle:
+                        # Find the number of points that fill the buffer and average them directly
+                        nb_filled_buffers = data.size // acquisition_points_per_cycle
+                        averaged_data[averaged_data_index:averaged_data_index+nb_filled_buffers] = np.mean(data[:nb_filled_buffers*acquisition_points_per_cycle].reshape((nb_filled_buffers, acquisition_points_per_cycle)), axis=1)*conversion_factor
+                        averaged_data_index = averaged_data_index + nb_filled_buffers
+
+                        # Move the remaining data to the buffer
+                        buffer = data[nb_filled_buffers*acquisition_points_per_cycle:]
+                    else:
+                        # Move data to buffer
+                        buffer = data
+
+                readPoints = readPoints + ready_pts
+                config.logger.debug("{}/{} points read on ch{}".format(readPoints, acquisition_points, DAQ_channel))
 
-                # Reset the number of cycles read since config
-                num_cycles_since_config.write(0)
-                config.logger.debug("Num cycles since config register reset to 0.")
+            else:
+                config.logger.debug("Checking if a full segment of data has been measured.")
+                # Check if a complete segment of data has been measured
+                num_cycles_seg_read = num_cycles_seg.read()
+                num_cycles_since_config_read = num_cycles_since_config.read()
+                config.logger.debug("Number of cycles since config / in segment: {} / {}".format(num_cycles_since_config_read, num_cycles_seg_read))
+                if num_cycles_since_config_read >= num_cycles_seg_read:
+                    segments_measured = segments_measured + 1
+                    config.logger.info("Segment {} of {} measured.".format(segments_measured, num_segments))
+                    if segments_measured == num_segments - 1: # if we are measuring the second last segment
+                        # Calculate the number of cycles for the last segment
+                        remaining_cycles = plan.num_cycles - cycles_per_segment*(num_segments - 1)
+                        config.logger.info("Last segment will have {} cycles.".format(remaining_cycles))
+                        configure_digitizer(config, dig_module, num_cycles_override=remaining_cycles)
+                    else:
+                        configure_digitizer(config, dig_module)
+
+                    # Reset the number of cycles read since config
+                    num_cycles_since_config.write(0)
+                    config.logger.debug("Num cycles since config register reset to 0.")
+
+    refresher.run(acquisition_loop)
 
     if countdown: print("")
 
     # Final live plot update
-    if not (plot_pyqtgraph and PYQTGRAPH_INSTALLED):
-        if average_data:
-            line1.set_xdata(x[:averaged_data_index])
-            line1.set_ydata(averaged_data[:averaged_data_index])
-        else:
-            line1.set_xdata(x[:readPoints])
-            line1.set_ydata(measured_data[:readPoints])
-        ax.relim()
-        ax.autoscale(enable=None)
-        plt.draw()
-
-    QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 10)
+    refresher.stop()
 
     vi_1d_read = vi_1d.read()
     vf_1d_read = vf_1d.read()
     # slew_time_read = slew_time.read()
     sweep_direction_read = sweep_direction.read()
-    neg_counter_read = neg_counter.read()
+    ramp_direction_1d_read = ramp_direction_1d.read()
     # awg_debug_read = awg_debug.read()
     voltage_channel_1d_read = voltage_channel_1d.read()
     loop_counter_read = loop_counter_1d.read()
@@ -1060,7 +1132,7 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
     logger.info("Vi 1D: {}".format(vi_1d_read))
     logger.info("Vf 1D: {}".format(vf_1d_read))
     # logger.info("Slew Time: {}".format(slew_time_read))
-    logger.info("Neg counter: {}".format(neg_counter_read))
+    logger.info("Ramp direction 1D: {}".format(ramp_direction_1d_read))
     logger.info("Init Voltage Ch{}: {}".format(config.AWG_channel_1d, voltage_channel_1d_read))
     logger.info("Step counter: {}".format(step_counter_1d_read))
     logger.info("Loop counter: {}".format(loop_counter_read))
@@ -1074,10 +1146,10 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
     else:
         logger.info("HVI execution not completed...")
 
-    if readPoints < config.acquisition_points:
-        config.logger.warning("MISSING DATA! Measured only {}/{} points.".format(readPoints, config.acquisition_points))
+    if readPoints < acquisition_points:
+        config.logger.warning("MISSING DATA! Measured only {}/{} points.".format(readPoints, acquisition_points))
     else:
-        config.logger.info("Measured {}/{} points".format(readPoints, config.acquisition_points))
+        config.logger.info("Measured {}/{} points".format(readPoints, acquisition_points))
 
     config.logger.info("Measurement done in {:.04f}s".format(t))
 
@@ -1086,10 +1158,188 @@ def interact_with_hvi(hvi, awg_module: Module, dig_module: Module, DAQ_channel:
     else:
         return measured_data
 
+def measure_trace(hvi, dig_module: Module, DAQ_channel: int, config, max_time=5, timeout=1000, repeated_sweep=False)-> np.ndarray:
+    """
+    Read one averaged trace of a running 1D sweep, without plotting or logging the registers. Used to measure traces back to back.
+    When the sweep is repeated by the HVI (see prepare_hvi_sequence), the digitizer must be armed for the trace before the call (see arm_next_trace).
+
+    Parameters
+    ----------
+    hvi : kthvi.Hvi
+        Running HVI sequence of the 1D sweeper.
+    dig_module : Module
+        Digitizer module used for the measurement.
+    DAQ_channel : int
+        Digitizer channel to read.
+    config : ApplicationConfig1D
+        Configuration of the HVI program.
+    max_time : float, optional
+        Maximum time allowed between two data acquisitions in seconds, by default 5.
+    timeout : int, optional
+        Maximum time allowed for each DAQread in milliseconds, by default 1000.
+    repeated_sweep : bool, optional
+        The HVI repeats the sweep and waits at the end of each trace until the digitizer is armed for the next one, by default False.
+        The function returns once the trace is read instead of waiting for the end of the HVI.
+
+    Returns
+    -------
+    np.ndarray
+        Averaged trace of num_steps_1d points, NaN for the points that weren't measured.
+    """
+    dig_registers = hvi.sync_sequence.scopes[dig_module.engine_name].registers
+    hvi_done = dig_registers[config.hvi_done_name]
+    num_cycles_seg = dig_registers[config.num_cycles_seg_name]
+    num_cycles_since_config = dig_registers[config.num_cycles_since_config_name]
+
+    plan = make_run_plan(config)
+    points_per_cycle = plan.points_per_cycle
+    averaged_data = np.empty(plan.num_cycles)
+    averaged_data[:] = np.nan
+    averaged_data_index = 0
+    buffer = np.array([])
+    readPoints = 0
+    segments_measured = 0
+    last_data_time = time.time()
+
+    while readPoints < plan.acquisition_points or (not repeated_sweep and hvi_done.read() == 0):
+        ready_pts = dig_module.instrument.DAQcounterRead(DAQ_channel)
+        if ready_pts > 0:
+            last_data_time = time.time()
+            data = dig_module.instrument.DAQread(DAQ_channel, ready_pts, timeout)
+            if buffer.size > 0:
+                data = np.append(buffer, data)
+            nb_filled_buffers = data.size // points_per_cycle
+            if nb_filled_buffers > 0:
+                averaged_data[averaged_data_index:averaged_data_index+nb_filled_buffers] = np.mean(data[:nb_filled_buffers*points_per_cycle].reshape((nb_filled_buffers, points_per_cycle)), axis=1)*plan.conversion_factor
+                averaged_data_index = averaged_data_index + nb_filled_buffers
+            buffer = data[nb_filled_buffers*points_per_cycle:]
+            readPoints = readPoints + ready_pts
+
+        elif num_cycles_since_config.read() >= num_cycles_seg.read():
+            # Configure the digitizer for the next segment
+            segments_measured = segments_measured + 1
+            if segments_measured < plan.num_segments:
+                if segments_measured == plan.num_segments - 1:
+                    remaining_cycles = plan.num_cycles - plan.cycles_per_segment*(plan.num_segments - 1)
+                    configure_digitizer(config, dig_module, num_cycles_override=remaining_cycles)
+                    # A repeated sweep must also wait at the end of the last segment, until the next trace is armed
+                    num_cycles_since_config.write(plan.cycles_per_segment - remaining_cycles if repeated_sweep else 0)
+                else:
+                    configure_digitizer(config, dig_module)
+                    num_cycles_since_config.write(0)
+
+        elif time.time() - last_data_time > max_time:
+            config.logger.warning("Timeout during trace measurement. Measured only {}/{} points.".format(readPoints, plan.acquisition_points))
+            break
+
+    return averaged_data
+
+def arm_next_trace(hvi, dig_module: Module, config):
+    """
+    Arm the digitizer for the next trace of a repeated 1D sweep and let the HVI start it (see prepare_hvi_sequence).
+    The HVI waits at the end of each trace, so the next trace can be armed as soon as the previous one is read.
+
+    Parameters
+    ----------
+    hvi : kthvi.Hvi
+        Running HVI sequence of the repeated 1D sweep.
+    dig_module : Module
+        Digitizer module used for the measurement.
+    config : ApplicationConfig1D
+        Configuration of the HVI program.
+    """
+    configure_digitizer(config, dig_module, configure_channels=False)
+    hvi.sync_sequence.scopes[dig_module.engine_name].registers[config.num_cycles_since_config_name].write(0)
+
 #%%
 # Main Program
 ######################################
 
+def prepare_hvi_sequence(sequencer: kthvi.Sequencer, config, awg_module: Module, dig_module: Module, export_sequence=False, num_traces=None)-> kthvi.Hvi:
+    """
+    Program, compile and load the HVI sequence of the 1D sweeper. The sequence can then be run many times, the sweep is changed by updating the registers.
+
+    Parameters
+    ----------
+    sequencer : kthvi.Sequencer
+        HVI sequence definition.
+    config : ApplicationConfig1D
+        Configuration of the HVI program.
+    awg_module : Module
+        AWG module used for the sweep.
+    dig_module : Module
+        Digitizer module used for the measurement.
+    export_sequence : bool, optional
+        Export the HVI to a text file, by default False.
+    num_traces : int, optional
+        Repeat the sweep num_traces times in each run, by default None (single sweep). Used by the video mode,
+        the HVI waits at the end of each trace until the PC arms the digitizer (see arm_next_trace).
+        The number of traces can be changed through the initial value of the Num Traces 1D register.
+
+    Returns
+    -------
+    kthvi.Hvi
+        Compiled HVI sequence loaded to the hardware.
+    """
+    define_awg_registers_1d(sequencer, awg_module, config) # Define registers within the scope of the outmost sync sequence
+    define_dig_registers_1d(sequencer, dig_module, config)
+
+    instruction_label = config.instruction_name.unique("Initialize registers")
+    sync_block = sequencer.sync_sequence.add_sync_multi_sequence_block(instruction_label, 30)
+    initialize_awg_registers_1d(sync_block, awg_module, config)
+    initialize_dig_registers_1d(sync_block, dig_module, config)
+
+    if num_traces is None:
+        sweeper_1d(sequencer, awg_module, dig_module, config)
+    else:
+        dig_registers = sequencer.sync_sequence.scopes[dig_module.engine_name].registers
+        trace_counter_1d = dig_registers.add(config.trace_counter_1d_name, kthvi.RegisterSize.SHORT)
+        trace_counter_1d.initial_value = 0
+        num_traces_1d = dig_registers.add(config.num_traces_1d_name, kthvi.RegisterSize.SHORT)
+        num_traces_1d.initial_value = num_traces
+
+        # Configure Sync While Condition
+        sync_while_condition = kthvi.Condition.register_comparison(trace_counter_1d, kthvi.ComparisonOperator.LESS_THAN, num_traces_1d)
+        instruction_label = config.instruction_name.unique("While Trace counter 1D < Num traces 1D")
+        trace_sync_while_loop = sequencer.sync_sequence.add_sync_while(instruction_label, 320, sync_while_condition)
+
+        # Add a sync block
+        instruction_label = config.instruction_name.unique("Trace 1D")
+        sync_block = trace_sync_while_loop.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+        dig_sequence = sync_block.sequences[dig_module.engine_name]
+
+        instruction_label = config.instruction_name.unique("Trace counter 1D += 1")
+        instruction = dig_sequence.add_instruction(instruction_label, 10, dig_sequence.instruction_set.add.id)
+        instruction.set_parameter(dig_sequence.instruction_set.add.destination.id, trace_counter_1d)
+        instruction.set_parameter(dig_sequence.instruction_set.add.left_operand.id, trace_counter_1d)
+        instruction.set_parameter(dig_sequence.instruction_set.add.right_operand.id, 1)
+
+        sweeper_1d(trace_sync_while_loop, awg_module, dig_module, config)
+    set_hvi_done(sequencer, dig_module, config)
+
+    if export_sequence:
+        # Export the programmed sequence to text
+        export_hvi_sequences(sequencer, os.path.join(os.path.dirname(os.path.realpath(__file__)), r".\Sweeper1D_KS2201A.txt"))
+
+    ########################################
+    # Compile, Load to HW
+    ########################################
+    try:
+        config.logger.info("Compiling HVI sequence...")
+        hvi = sequencer.compile()
+        config.logger.info('Compilation completed successfully!')
+    except kthvi.CompilationFailed as err:
+        config.logger.exception('Compilation failed! {}'.format(err))
+        raise
+
+    config.logger.info("This HVI needs to reserve {} PXI trigger resources to execute".format(len(hvi.compile_status.sync_resources)))
+
+    # Load HVI to HW: load sequences, configure actions/triggers/events, lock resources, etc.
+    hvi.load_to_hw()
+    config.logger.info("HVI Loaded to HW")
+
+    return hvi
+
 def run_experiment(verbose=False, plot_pyqtgraph=False):
     """Function to run a 1D sweep with HVI.
 
@@ -1149,37 +1399,8 @@ def run_experiment(verbose=False, plot_pyqtgraph=False):
         # Create sequencer object
         sequencer = kthvi.Sequencer("MySequencer", my_system)
         
-        # Program the HVI sequence
-        define_awg_registers_1d(sequencer, awg_module, config) # Define registers within the scope of the outmost sync sequence
-        define_dig_registers_1d(sequencer, digitizer_module, config)
-
-        instruction_label = config.instruction_name.unique("Initialize registers")
-        sync_block = sequencer.sync_sequence.add_sync_multi_sequence_block(instruction_label, 30)
-        initialize_awg_registers_1d(sync_block, awg_module, config)
-        initialize_dig_registers_1d(sync_block, digitizer_module, config)
-        
-        sweeper_1d(sequencer, awg_module, digitizer_module, config)
-        set_hvi_done(sequencer, digitizer_module, config)
-        
-        # Export the programmed sequence to text
-        export_hvi_sequences(sequencer, os.path.join(os.path.dirname(os.path.realpath(__file__)), r".\Sweeper1D_KS2201A.txt"))
-        
-        ########################################
-        # Compile, Load to HW, Run HVI Sequence
-        ########################################
-        try:
-            config.logger.info("Compiling HVI sequence...")
-            hvi = sequencer.compile()
-            config.logger.info('Compilation completed successfully!')
-        except kthvi.CompilationFailed as err:
-            config.logger.exception('Compilation failed! {}'.format(err))
-            raise
-
-        config.logger.info("This HVI needs to reserve {} PXI trigger resources to execute".format(len(hvi.compile_status.sync_resources)))
-
-        # Load HVI to HW: load sequences, configure actions/triggers/events, lock resources, etc.
-        hvi.load_to_hw()
-        config.logger.info("HVI Loaded to HW")
+        # Program, compile and load the HVI sequence
+        hvi = prepare_hvi_sequence(sequencer, config, awg_module, digitizer_module, export_sequence=True)
 
         # Send the cross-capacitance matrix to the FPGA
         if config.use_virtual_gates:
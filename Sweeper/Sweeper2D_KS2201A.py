@@ -5,7 +5,6 @@ import matplotlib.pyplot as plt
 import os
 import gc
 import yaml
-import shutil
 import inspect
 try:
     import pyqtgraph as pqt
@@ -25,14 +24,18 @@ try:
 except ImportError:
     import keysight_hvi as kthvi
 from Sweeper1D_KS2201A import sweeper_1d, initialize_awg_registers_1d, initialize_dig_registers_1d, ApplicationConfig1D, \
-                                define_awg_registers_1d, define_dig_registers_1d, update_awg_registers_1d, update_dig_registers_1d
+                                define_awg_registers_1d, define_dig_registers_1d, update_awg_registers_1d, update_dig_registers_1d, \
+                                update_vg_voltage_registers_1d
 from KS2201A_lib import ModuleDescriptor, Module, open_modules, configure_awg, configure_digitizer, \
-                        calc_step_counter, program_step_to_target_voltage, export_hvi_sequences, \
+                        calc_step_counter, program_step_to_target_voltage, program_ramp_direction, calc_sweep_direction, export_hvi_sequences, \
                         load_awg, load_digitizer, send_CC_matrix, define_system, set_voltages_to_zero, \
                         read_channel_voltage, verify_sweep_parameters_1d, verify_sweep_parameters_2d, \
-                        set_hvi_done, initialize_logging, calc_num_cycles_per_segment, update_vg_registers 
+                        set_hvi_done, initialize_logging, update_vg_registers, make_run_plan, \
+                        snapshot_config, classify_config_change, CONFIG_CHANGE_REGISTERS, CONFIG_CHANGE_RECOMPILE
                         
 from file_save_system import create_save_filename
+from point_tables import split_point_table, split_point_list_2d, sweep_voltages
+from live_plotting import LivePlotRefresher, ColourScaleTracker
 
 #%% Config
 class ApplicationConfig2D(ApplicationConfig1D):
@@ -67,6 +70,8 @@ class ApplicationConfig2D(ApplicationConfig1D):
         self.loop_counter_2d_name = "Loop Counter 2D"
         self.ramp_counter_2d_name = "Ramp Counter 2D"
         self.awg_loop_counter_2d_name = "AWG Loop Counter 2D"
+        self.sweep_direction_2d_name = "Sweep Direction 2D" # signed voltage increment of the 2D sweep, set by the PC
+        self.ramp_direction_2d_name = "Ramp Direction 2D" # +1 or -1, set by HVI before ramps with an unknown starting voltage
 
         self.num_cycles_seg_name = "Num Cycles per segment"
         self.num_cycles_since_config_name = "Num Cycles since config"
@@ -183,34 +188,9 @@ class ApplicationConfig2D(ApplicationConfig1D):
         if config.use_virtual_gates:
             config.vg_module_descriptor_list = sorted([module_descriptor for module_descriptor in module_descriptors if "AWG" in module_descriptor.engine_name and module_descriptor.card_num_VG > 0], key=lambda module_descriptor: module_descriptor.card_num_VG)
 
-        # Update yaml file with verified_num_steps_1d
-        with open(yaml_file, 'r+') as file:
-            lines = file.readlines()
-            for i, line in enumerate(lines):
-                if "verified_num_steps_1d" in line:
-                    split_line = line.split(":")
-                    split_value = split_line[1].split(" ") # verified_num_steps_1d = split_value[1]
-
-                    # Recombine the split line
-                    split_value[1] = str(config.num_steps_1d)
-                    split_line[1] = " ".join(split_value)
-                    lines[i] = ":".join(split_line)
-
-                if "verified_num_steps_2d" in line:
-                    split_line = line.split(":")
-                    split_value = split_line[1].split(" ") # verified_num_steps_2d = split_value[1]
-
-                    # Recombine the split line
-                    split_value[1] = str(config.num_steps_2d)
-                    split_line[1] = " ".join(split_value)
-                    lines[i] = ":".join(split_line)
-
-            # Write the updated lines to the file
-            file.seek(0)
-            file.writelines(lines)
-
-        # Add YAML config filename to config
+        # Add YAML config filename and content to config, the file itself is never modified
         config.yaml_file = yaml_file
+        config.yaml_data = data
 
         return config
     
@@ -280,6 +260,11 @@ def define_awg_registers_2d(sequencer, awg_module, config):
     ramp_counter_2d.initial_value = ramp_counter_2d_value
     config.logger.info("Ramp counter 2d: {}".format(ramp_counter_2d_value))
 
+    sweep_direction_2d = sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.sweep_direction_2d_name, kthvi.RegisterSize.SHORT)
+    sweep_direction_2d.initial_value = calc_sweep_direction(awg_module, config.vi_2d_internal, config.vf_2d_internal, dV=config.dV)
+    sequencer.sync_sequence.scopes[awg_engine_name].registers.add(config.ramp_direction_2d_name, kthvi.RegisterSize.SHORT)
+    config.logger.info("Sweep direction 2d: {}".format(sweep_direction_2d.initial_value))
+
 def define_dig_registers_2d(sequencer, dig_module, config):
     """
     Update the 2D sweep digitizer registers of the module's HVI engine in the scope of the global sync sequence.
@@ -328,22 +313,44 @@ def update_awg_registers_2d(hvi, awg_module, config, module_dict):
     vf_2d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.vf_2d_name]
     vf_2d.initial_value = awg_module.instrument.voltsToInt(config.vf_2d_internal)
 
-    if config.use_virtual_gates:
-        main_awg_module = module_dict[config.main_awg_engine_name]
-        v_1d, v_1d_int = read_channel_voltage(config.AWG_channel_1d, main_awg_module, HZ=False)
-        vg_v_1d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.vg_voltage_1d_name.format(config.AWG_channel_1d)]
-        vg_v_1d.initial_value = v_1d_int
-
-        # Update the voltage register on the vg modules
-        for vg_module_descriptor in config.vg_module_descriptor_list:
-            vg_v_1d = hvi.sync_sequence.scopes[vg_module_descriptor.engine_name].registers[config.vg_voltage_1d_name.format(config.AWG_channel_1d)]
-            vg_v_1d.initial_value = v_1d_int
-
+    update_vg_voltage_registers_2d(hvi, awg_module, config, module_dict)
 
     awg_loop_counter_2d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.awg_loop_counter_2d_name]
     awg_loop_counter_2d.initial_value = 0
     ramp_counter_2d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.ramp_counter_2d_name]
     ramp_counter_2d.initial_value = calc_step_counter(config.vi_2d_internal, config.vf_2d_internal, 2, dV=config.dV)
+    sweep_direction_2d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.sweep_direction_2d_name]
+    sweep_direction_2d.initial_value = calc_sweep_direction(awg_module, config.vi_2d_internal, config.vf_2d_internal, dV=config.dV)
+
+def update_vg_voltage_registers_2d(hvi, awg_module, config, module_dict):
+    """
+    Update the virtual gates registers of the 2D sweep holding the 1D voltage read on the hardware.
+    The voltage can change between two runs without any change of the config, so these registers are updated before each run.
+
+    Parameters
+    ----------
+    hvi : kthvi.Hvi
+        HVI object.
+    awg_module : Module
+        AWG module object of the 2D sweep.
+    config : ApplicationConfig2D
+        Configuration of the HVI program.
+    module_dict : dict
+        Dictionary containing all the modules used in the HVI program.
+    """
+    if not config.use_virtual_gates:
+        return
+    awg_engine_name = awg_module.engine_name
+
+    main_awg_module = module_dict[config.main_awg_engine_name]
+    v_1d, v_1d_int = read_channel_voltage(config.AWG_channel_1d, main_awg_module, HZ=False)
+    vg_v_1d = hvi.sync_sequence.scopes[awg_engine_name].registers[config.vg_voltage_1d_name.format(config.AWG_channel_1d)]
+    vg_v_1d.initial_value = v_1d_int
+
+    # Update the voltage register on the vg modules
+    for vg_module_descriptor in config.vg_module_descriptor_list:
+        vg_v_1d = hvi.sync_sequence.scopes[vg_module_descriptor.engine_name].registers[config.vg_voltage_1d_name.format(config.AWG_channel_1d)]
+        vg_v_1d.initial_value = v_1d_int
 
 def update_dig_registers_2d(hvi, dig_module, config):
     """
@@ -394,7 +401,25 @@ def initialize_awg_registers_2d(sync_block, secondary_awg_module, config):
         readFpgaReg.set_parameter(secondary_awg_sequence.instruction_set.fpga_register_read.fpga_register.id, fpga_voltage)
 
     
-def sweeper_2d(sequencer, config, awg_module: Module, dig_module: Module, secondary_awg_module: Module, virtual_gates_modules=[]):
+def stop_qd_emulator(dig_sequence, config):
+    """
+    Add the instruction stopping the QD emulator at the end of the HVI sequence.
+
+    Parameters
+    ----------
+    dig_sequence : kthvi.Sequence object
+        Digitizer sequence of the last sync block.
+    config : ApplicationConfig2D class
+        Experiment configuration.
+    """
+    instruction_label = config.instruction_name.unique("Write reg_HLS_start = 0")
+    writeMemoryMap = dig_sequence.add_instruction(instruction_label, 30, dig_sequence.instruction_set.fpga_array_write.id)
+    fpga_memory_map_DIG = dig_sequence.engine.fpga_sandboxes[config.M3xxxA_sandbox].fpga_memory_maps[config.MemoryEngine_QD_emulator_name]
+    writeMemoryMap.set_parameter(dig_sequence.instruction_set.fpga_array_write.fpga_memory_map.id, fpga_memory_map_DIG)
+    writeMemoryMap.set_parameter(dig_sequence.instruction_set.fpga_array_write.fpga_memory_map_offset.id, 0)
+    writeMemoryMap.set_parameter(dig_sequence.instruction_set.fpga_array_write.value.id, 0)
+
+def sweeper_2d(sequencer, config, awg_module: Module, dig_module: Module, secondary_awg_module: Module, virtual_gates_modules=[], stop_QD_emulator=True):
     """    
     This method programs the HVI sequence for a 2D voltage sweep.
     Different HVI statements are encapsulated as much as possible in separated SW methods to help users visualize
@@ -414,6 +439,8 @@ def sweeper_2d(sequencer, config, awg_module: Module, dig_module: Module, second
         Secondary AWG module used for the 2D sweep.
     virtual_gates_modules : list of Module objects, optional
         List of modules used for the virtual gates excluding the awg_module and secondary_awg_module, by default [].
+    stop_QD_emulator : bool, optional
+        Stop the QD emulator at the end of the 2D sweep, by default True. False when the 2D sweep is repeated by a 3D sweep, which stops the emulator once after its loop.
     """    
 
     awg_engine_name = awg_module.engine_name
@@ -424,40 +451,59 @@ def sweeper_2d(sequencer, config, awg_module: Module, dig_module: Module, second
     secondary_awg_registers = sequencer.sync_sequence.scopes[secondary_awg_engine_name].registers
     voltage_channel_2d = secondary_awg_registers[config.voltage_2d_name.format(config.AWG_channel_2d)] 
     vi_2d = secondary_awg_registers[config.vi_2d_name]
-    vf_2d = secondary_awg_registers[config.vf_2d_name]
     awg_loop_counter_2d = secondary_awg_registers[config.awg_loop_counter_2d_name]
     ramp_counter_2d = secondary_awg_registers[config.ramp_counter_2d_name]
+    sweep_direction_2d = secondary_awg_registers[config.sweep_direction_2d_name]
+    ramp_direction_2d = secondary_awg_registers[config.ramp_direction_2d_name]
 
     dig_registers = sequencer.sync_sequence.scopes[dig_engine_name].registers
     loop_counter_2d = dig_registers[config.loop_counter_2d_name]
     step_counter_2d = dig_registers[config.step_counter_2d_name]
     
     ###########################################################################
-    
+
+    # The direction of the ramp to Vi 2D is decided once before the ramp (unknown starting voltage)
+    instruction_label = config.instruction_name.unique("Ramp direction Vi 2D")
+    sync_block = sequencer.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    program_ramp_direction(sequencer, secondary_awg_module, sync_block.sequences[secondary_awg_engine_name], config, voltage_channel_2d, vi_2d, ramp_direction_2d)
+    if config.use_virtual_gates and config.main_awg_engine_name != config.secondary_awg_engine_name:
+        vg_awg_registers = sequencer.sync_sequence.scopes[awg_engine_name].registers
+        voltage_channel = vg_awg_registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
+        program_ramp_direction(sequencer, awg_module, sync_block.sequences[awg_engine_name], config, voltage_channel, vg_awg_registers[config.vi_2d_name], vg_awg_registers[config.ramp_direction_2d_name])
+    for virtual_gate_module in virtual_gates_modules:
+        vg_awg_registers = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers
+        voltage_channel = vg_awg_registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
+        program_ramp_direction(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, voltage_channel, vg_awg_registers[config.vi_2d_name], vg_awg_registers[config.ramp_direction_2d_name])
+
+    # Start delays of the loop instructions around the step, subtracted from the wait to keep the slew rate
+    sync_while_start_delay = 320
+    sync_block_start_delay = 260
+    loop_overhead = sync_while_start_delay + sync_block_start_delay
+
     # Configure Sync While Condition
     sync_while_condition = kthvi.Condition.register_comparison(voltage_channel_2d, kthvi.ComparisonOperator.NOT_EQUAL_TO, vi_2d)
     instruction_label = config.instruction_name.unique("While Voltage Chx != Vi 2D")
-    sync_while_init = sequencer.sync_sequence.add_sync_while(instruction_label, 320, sync_while_condition)
+    sync_while_init = sequencer.sync_sequence.add_sync_while(instruction_label, sync_while_start_delay, sync_while_condition)
 
     # Add a sync block
     instruction_label = config.instruction_name.unique("Go to Vi 2D")
-    sync_block = sync_while_init.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    sync_block = sync_while_init.sync_sequence.add_sync_multi_sequence_block(instruction_label, sync_block_start_delay)
     awg_sequence = sync_block.sequences[awg_engine_name]
     secondary_awg_sequence = sync_block.sequences[secondary_awg_engine_name]
 
     voltage_channel = sequencer.sync_sequence.scopes[secondary_awg_engine_name].registers[config.voltage_2d_name.format(config.AWG_channel_2d)]
-    program_step_to_target_voltage(sequencer, secondary_awg_module, secondary_awg_sequence, config, config.AWG_channel_2d, voltage_channel, vi_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=True)
+    program_step_to_target_voltage(sequencer, secondary_awg_module, secondary_awg_sequence, config, config.AWG_channel_2d, voltage_channel, ramp_direction_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=True, loop_overhead=loop_overhead)
     # If virtual gates are used, update the swept voltage on the other modules
     # If the 2D sweep is done with two AWG modules, update the voltage register on the other module used for sweeping
     if config.use_virtual_gates and config.main_awg_engine_name != config.secondary_awg_engine_name:
         voltage_channel = sequencer.sync_sequence.scopes[awg_module.engine_name].registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
-        vi_2d = sequencer.sync_sequence.scopes[awg_module.engine_name].registers[config.vi_2d_name]
-        program_step_to_target_voltage(sequencer, awg_module, awg_sequence, config, config.AWG_channel_2d, voltage_channel, vi_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=False, source_VG_module=secondary_awg_module)
+        vg_ramp_direction_2d = sequencer.sync_sequence.scopes[awg_module.engine_name].registers[config.ramp_direction_2d_name]
+        program_step_to_target_voltage(sequencer, awg_module, awg_sequence, config, config.AWG_channel_2d, voltage_channel, vg_ramp_direction_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=False, source_VG_module=secondary_awg_module, loop_overhead=loop_overhead)
     # Update the voltage register on the other modules
     for virtual_gate_module in virtual_gates_modules:
         voltage_channel = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
-        vi_2d = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers[config.vi_2d_name]
-        program_step_to_target_voltage(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, config.AWG_channel_2d, voltage_channel, vi_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=False, source_VG_module=secondary_awg_module)
+        vg_ramp_direction_2d = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers[config.ramp_direction_2d_name]
+        program_step_to_target_voltage(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, config.AWG_channel_2d, voltage_channel, vg_ramp_direction_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=False, source_VG_module=secondary_awg_module, loop_overhead=loop_overhead)
 
     if config.use_virtual_gates and (awg_engine_name != secondary_awg_engine_name):
         sweeper_1d(sequencer, awg_module, dig_module, config, virtual_gates_modules=[secondary_awg_module]+virtual_gates_modules)
@@ -478,38 +524,54 @@ def sweeper_2d(sequencer, config, awg_module: Module, dig_module: Module, second
     instruction = dig_sequence.add_instruction(instruction_label, 10, dig_sequence.instruction_set.assign.id)
     instruction.set_parameter(dig_sequence.instruction_set.assign.destination.id, loop_counter_2d)
     instruction.set_parameter(dig_sequence.instruction_set.assign.source.id, 0)
+
+    # Decide the direction of the 2D voltage ramps on the virtual gates modules (unknown starting voltage)
+    if config.use_virtual_gates and config.main_awg_engine_name != secondary_awg_engine_name:
+        vg_awg_registers = sequencer.sync_sequence.scopes[awg_engine_name].registers
+        voltage_channel = vg_awg_registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
+        program_ramp_direction(sequencer, awg_module, sync_block.sequences[awg_engine_name], config, voltage_channel, vg_awg_registers[config.vf_2d_name], vg_awg_registers[config.ramp_direction_2d_name])
+    for virtual_gate_module in virtual_gates_modules:
+        vg_awg_registers = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers
+        voltage_channel = vg_awg_registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
+        program_ramp_direction(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, voltage_channel, vg_awg_registers[config.vf_2d_name], vg_awg_registers[config.ramp_direction_2d_name])
     
+    # Start delays of the loop instructions around the step, subtracted from the wait to keep the slew rate
+    sync_while_start_delay = 90
+    sync_block_start_delay = 260
+    awg_loop_counter_start_delay = 10
+    loop_overhead = sync_while_start_delay + sync_block_start_delay + awg_loop_counter_start_delay
+
     # Configure Sync While Condition
     sync_while_condition = kthvi.Condition.register_comparison(loop_counter_2d, kthvi.ComparisonOperator.NOT_EQUAL_TO, step_counter_2d)
     instruction_label = config.instruction_name.unique("While LoopCounter 2D < Step 2D")
-    inner_sync_while_loop = outer_sync_while_loop.sync_sequence.add_sync_while(instruction_label, 90, sync_while_condition)
+    inner_sync_while_loop = outer_sync_while_loop.sync_sequence.add_sync_while(instruction_label, sync_while_start_delay, sync_while_condition)
 
     # Add a sync block
     instruction_label = config.instruction_name.unique("Step voltage 2D")
-    sync_block = inner_sync_while_loop.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    sync_block = inner_sync_while_loop.sync_sequence.add_sync_multi_sequence_block(instruction_label, sync_block_start_delay)
     awg_sequence = sync_block.sequences[awg_engine_name]
     secondary_awg_sequence = sync_block.sequences[secondary_awg_engine_name]
     dig_sequence = sync_block.sequences[dig_engine_name]
     
     voltage_channel = sequencer.sync_sequence.scopes[secondary_awg_engine_name].registers[config.voltage_2d_name.format(config.AWG_channel_2d)]
-    program_step_to_target_voltage(sequencer, secondary_awg_module, secondary_awg_sequence, config, config.AWG_channel_2d, voltage_channel, vf_2d, config.slew_rate_2d, use_dV_from_config = True, output_voltage=True)
+    program_step_to_target_voltage(sequencer, secondary_awg_module, secondary_awg_sequence, config, config.AWG_channel_2d, voltage_channel, sweep_direction_2d, config.slew_rate_2d, use_dV_from_config = True, output_voltage=True, loop_overhead=loop_overhead)
     # If virtual gates are used, update the swept voltage on the other modules
     # If the 2D sweep is done with two AWG modules, update the voltage register on the other module used for sweeping
     if config.use_virtual_gates and config.main_awg_engine_name != secondary_awg_engine_name:
         voltage_channel = sequencer.sync_sequence.scopes[awg_module.engine_name].registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
         vg_awg_registers = sequencer.sync_sequence.scopes[awg_module.engine_name].registers
-        vg_vf_2d = vg_awg_registers[config.vf_2d_name]
-        program_step_to_target_voltage(sequencer, awg_module, awg_sequence, config, config.AWG_channel_2d, voltage_channel, vg_vf_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=False, source_VG_module=secondary_awg_module)
+        vg_ramp_direction_2d = vg_awg_registers[config.ramp_direction_2d_name]
+        program_step_to_target_voltage(sequencer, awg_module, awg_sequence, config, config.AWG_channel_2d, voltage_channel, vg_ramp_direction_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=False, source_VG_module=secondary_awg_module, loop_overhead=loop_overhead)
     # Update the voltage register on the other modules
     for virtual_gate_module in virtual_gates_modules:
         voltage_channel = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers[config.vg_voltage_2d_name.format(config.AWG_channel_2d)]
         vg_awg_registers = sequencer.sync_sequence.scopes[virtual_gate_module.engine_name].registers
-        vg_vf_2d = vg_awg_registers[config.vf_2d_name]
-        program_step_to_target_voltage(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, config.AWG_channel_2d, voltage_channel, vg_vf_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=False, source_VG_module=secondary_awg_module)
+        vg_ramp_direction_2d = vg_awg_registers[config.ramp_direction_2d_name]
+        program_step_to_target_voltage(sequencer, virtual_gate_module, sync_block.sequences[virtual_gate_module.engine_name], config, config.AWG_channel_2d, voltage_channel, vg_ramp_direction_2d, config.slew_rate_2d, use_dV_from_config=False, output_voltage=False, source_VG_module=secondary_awg_module, loop_overhead=loop_overhead)
 
     # Increment AWG loop counter
     instruction_label = config.instruction_name.unique("AWG loop counter 2D += 1")
-    instruction = secondary_awg_sequence.add_instruction(instruction_label, 10, secondary_awg_sequence.instruction_set.add.id)
+    instruction = secondary_awg_sequence.add_instruction(instruction_label, awg_loop_counter_start_delay, secondary_awg_sequence.instruction_set.add.id)
     instruction.set_parameter(secondary_awg_sequence.instruction_set.add.destination.id, awg_loop_counter_2d)
     instruction.set_parameter(secondary_awg_sequence.instruction_set.add.left_operand.id, awg_loop_counter_2d)
     instruction.set_parameter(secondary_awg_sequence.instruction_set.add.right_operand.id, 1)
@@ -537,15 +599,11 @@ def sweeper_2d(sequencer, config, awg_module: Module, dig_module: Module, second
     instruction.set_parameter(secondary_awg_sequence.instruction_set.assign.source.id, 0)
 
     # Stop emulator at the end of the sequence
-    if config.use_QD_emulator and not config.hardware_simulated:
-        writeMemoryMap = dig_sequence.add_instruction("Write reg_HLS_start = 0", 30, dig_sequence.instruction_set.fpga_array_write.id)
-        fpga_memory_map_DIG = dig_sequence.engine.fpga_sandboxes[config.M3xxxA_sandbox].fpga_memory_maps[config.MemoryEngine_QD_emulator_name]
-        writeMemoryMap.set_parameter(dig_sequence.instruction_set.fpga_array_write.fpga_memory_map.id, fpga_memory_map_DIG)
-        writeMemoryMap.set_parameter(dig_sequence.instruction_set.fpga_array_write.fpga_memory_map_offset.id, 0)
-        writeMemoryMap.set_parameter(dig_sequence.instruction_set.fpga_array_write.value.id, 0)
+    if stop_QD_emulator and config.use_QD_emulator and not config.hardware_simulated:
+        stop_qd_emulator(dig_sequence, config)
     
 
-def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : Module, hvi: kthvi.Hvi, channel_list: list, max_time: float, timeout=1000, countdown=True, live_plotting=True, average_data=False, save_data=False, header="", savepath="default_Sweeper2D_datafile.txt", plot_pyqtgraph=False)-> np.ndarray:
+def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : Module, hvi: kthvi.Hvi, channel_list: list, max_time: float, timeout=1000, countdown=True, live_plotting=True, average_data=False, save_data=False, header="", savepath="default_Sweeper2D_datafile.txt", plot_pyqtgraph=False, line_callback=None, return_averages=False)-> np.ndarray:
     """
     Measure the data from the selected digitizer channel in the config.
 
@@ -579,11 +637,18 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
         Path of the text file where the data is saved, by default "default_Sweeper2D_datafile.txt".
     plot_pyqtgraph : bool, optional
         Choose whether to plot the data using pyqtgraph or not, by default False. If False, matplotlib is used.
+    line_callback : callable, optional
+        Function called with the averaged data of the completed lines and the number of completed lines each time new lines of the 2D sweep are measured, by default None. 
+        The measurement is stopped if the function returns True. Only used when average_data is True.
+    return_averages : bool, optional
+        Also return the data averaged over each cycle, by default False. Without average_data, the cycles are averaged while the raw data is read.
 
     Returns
     -------
     np.ndarray
         Data array from the digitizer channel.
+    np.ndarray
+        Data averaged over each cycle, one row per channel. Only returned if return_averages is True.
     """
     awg_engine_name = awg_module.engine_name
     dig_engine_name = dig_module.engine_name
@@ -615,7 +680,7 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
     vf_2d = secondary_awg_registers[config.vf_2d_name]
     # slew_time = awg_registers[config.slew_time_name]
     sweep_direction = awg_registers[config.sweep_direction_name]
-    neg_counter = awg_registers[config.neg_counter_name]
+    ramp_direction_1d = awg_registers[config.ramp_direction_1d_name]
     awg_loop_counter_1d = awg_registers[config.awg_loop_counter_1d_name]
     ramp_counter_1d = awg_registers[config.ramp_counter_1d_name]
     awg_loop_counter_2d = secondary_awg_registers[config.awg_loop_counter_2d_name]
@@ -641,7 +706,7 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
     vf_2d_read = vf_2d.read()
     # slew_time_read = slew_time.read()
     sweep_direction_read = sweep_direction.read()
-    neg_counter_read = neg_counter.read()
+    ramp_direction_1d_read = ramp_direction_1d.read()
     # awg_debug_read = awg_debug.read()
     voltage_channel_1d_read = voltage_channel_1d.read()
     voltage_channel_2d_read = voltage_channel_2d.read()
@@ -656,7 +721,7 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
     config.logger.debug("Vi 2D: {}".format(vi_2d_read))
     config.logger.debug("Vf 2D: {}".format(vf_2d_read))
     # config.logger.debug("Slew Time: {}".format(slew_time_read))
-    config.logger.debug("Neg counter: {}".format(neg_counter_read))
+    config.logger.debug("Ramp direction 1D: {}".format(ramp_direction_1d_read))
     config.logger.debug("Init Voltage Ch{}: {}".format(config.AWG_channel_1d, voltage_channel_1d_read))
     config.logger.debug("Init Voltage Ch{}: {}".format(config.AWG_channel_2d, voltage_channel_2d_read))
     # config.logger.debug("AWG Debug: {}".format(awg_debug_read))
@@ -666,35 +731,41 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
     config.logger.debug("VG Voltage 1D ({}): {}".format(config.secondary_awg_engine_name, vg_voltage_1d_read))
     config.logger.debug("VG Voltage 2D ({}): {}".format(config.main_awg_engine_name, vg_voltage_2d_read))
 
-    if config.use_QD_emulator:
-        conversion_factor = 2**-12
-    else:
-        conversion_factor = float(config.fullscale)/(2.**15 -1)
-  
+    # Parameters of the measurement, computed once for the acquisition loop
+    plan = make_run_plan(config)
+    conversion_factor = plan.conversion_factor
+    points_per_cycle = plan.points_per_cycle
+    num_steps_2d, num_steps_1d = plan.data_shape
+    v2_axis, v1_axis = plan.axes
+
     # Initialize data array
-    max_points = config.acquisition_points_per_cycle*config.num_cycles
+    max_points = plan.acquisition_points
     if average_data:
         buffer = []
         for i, ch in enumerate(channel_list):
             buffer.append(np.array([]))
-        averaged_data = np.empty((len(channel_list), config.num_cycles))
+        averaged_data = np.empty((len(channel_list), plan.num_cycles))
         averaged_data[:] = np.nan
 
         averaged_data_index = [0]*len(channel_list) # first empty slot in the averaged_data array
 
         # Axis arrays to be saved in the text file as 1D arrays
-        x_array = np.tile(np.linspace(config.vi_1d, config.vf_1d, config.num_steps_1d), config.num_steps_2d)
-        y_array = np.repeat(np.linspace(config.vi_2d, config.vf_2d, config.num_steps_2d), config.num_steps_1d)
-        time_array = np.empty(config.num_cycles)
+        x_array = np.tile(v1_axis, num_steps_2d)
+        y_array = np.repeat(v2_axis, num_steps_1d)
+        time_array = np.empty(plan.num_cycles)
         time_array[:] = np.nan
     else:
         measured_data = np.empty((len(channel_list), max_points))
         measured_data[:] = np.nan
-        x_array = np.tile(np.repeat(np.linspace(config.vi_1d, config.vf_1d, config.num_steps_1d), config.acquisition_points_per_cycle), config.num_steps_2d)
-        y_array = np.repeat(np.repeat(np.linspace(config.vi_2d, config.vf_2d, config.num_steps_2d), config.acquisition_points_per_cycle), config.num_steps_1d)
-        trace_time_array = np.tile(np.linspace(0, config.integration_time, config.acquisition_points_per_cycle), config.num_cycles)
+        x_array = np.tile(np.repeat(v1_axis, points_per_cycle), num_steps_2d)
+        y_array = np.repeat(np.repeat(v2_axis, points_per_cycle), num_steps_1d)
+        trace_time_array = np.tile(np.linspace(0, plan.integration_time, points_per_cycle), plan.num_cycles)
         time_array = np.empty(max_points)
         time_array[:] = np.nan
+        if return_averages:
+            averaged_data = np.empty((len(channel_list), plan.num_cycles))
+            averaged_data[:] = np.nan
+            averaged_data_index = [0]*len(channel_list) # first cycle not averaged yet
 
     old_readPoints = [0]*len(channel_list)
     readPoints = [0]*len(channel_list)
@@ -705,9 +776,10 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
     t = 0
     log_interval = 0.3
     next_log = 0
-    cycles_per_segment, num_segments = calc_num_cycles_per_segment(config.num_cycles, config.acquisition_points_per_cycle, config.use_QD_emulator)
+    cycles_per_segment, num_segments = plan.cycles_per_segment, plan.num_segments
     segments_measured = 0
-    config.logger.info("Number of cycles: {}".format(config.num_cycles))
+    lines_reported = 0 # number of completed lines sent to line_callback
+    config.logger.info("Number of cycles: {}".format(plan.num_cycles))
     config.logger.info("Cycles per segment: {}".format(cycles_per_segment))
     config.logger.info("Number of segments: {}".format(num_segments))
 
@@ -736,7 +808,7 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
             p1.addItem(img)
             p1.setLabel('bottom', 'X Axis Label')  # x-axis
             p1.setLabel('left', 'Y Axis Label')  # y-axis
-            img.setImage(graph_data.reshape((config.num_steps_2d, config.num_steps_1d)))
+            img.setImage(graph_data.reshape((num_steps_2d, num_steps_1d)))
             img.setRect(QtCore.QRectF(config.vi_1d, config.vf_2d, config.vf_1d-config.vi_1d, config.vf_2d-config.vi_2d))
 
             # Contrast/color control
@@ -765,13 +837,10 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
             
             graph_widget.resize(800, 800)
             win.show()
-
-            # Start plotting
-            app = QtWidgets.QApplication.instance()
         else:
             plt.figure("Live plot")
             plt.clf() # avoid multiple colorbar
-            graph = plt.imshow(graph_data.reshape((config.num_steps_2d, config.num_steps_1d)), extent=[config.vi_1d, config.vf_1d, config.vi_2d, config.vf_2d], aspect='auto', origin='lower')
+            graph = plt.imshow(graph_data.reshape((num_steps_2d, num_steps_1d)), extent=[config.vi_1d, config.vf_1d, config.vi_2d, config.vf_2d], aspect='auto', origin='lower')
             plt.xlabel("Voltage Ch{} [V]".format(config.AWG_channel_1d))
             plt.ylabel("Voltage Ch{} [V]".format(config.AWG_channel_2d))
             cbar = plt.colorbar()
@@ -787,6 +856,28 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
                 stop_event.set()
             button_stop.on_clicked(stop)
 
+        # The colour limits are updated from the points averaged since the last refresh only
+        colour_scale = ColourScaleTracker(percentiles=config.colour_percentiles)
+        plotted_points = [0] # use a list to allow the inner function to modify it
+
+        def draw_live_plot():
+            new_points = averaged_data_index[0]
+            limits_changed = colour_scale.update(graph_data[plotted_points[0]:new_points])
+            plotted_points[0] = new_points
+            if plot_pyqtgraph and PYQTGRAPH_INSTALLED:
+                img.setImage(graph_data.reshape((num_steps_2d, num_steps_1d)), autoLevels=False)
+                if limits_changed:
+                    hist.setLevels(*colour_scale.limits())
+            else:
+                graph.set_data(graph_data.reshape((num_steps_2d, num_steps_1d)))
+                # Update colorbar
+                if limits_changed:
+                    graph.set_clim(*colour_scale.limits())
+                graph.figure.canvas.draw_idle()
+
+        # The plot is redrawn by a timer at a fixed rate while the acquisition loop runs in a worker thread
+        refresher = LivePlotRefresher(draw_live_plot, fps=config.live_plot_fps)
+
     # Prepare file to save data
     if save_data:
         with open(savepath, "w") as f:
@@ -795,145 +886,158 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
     for i, ch in enumerate(channel_list):
         config.logger.debug("{}/{} points read on ch{}".format(readPoints[i], max_points, ch))
     ready_pts = 0
-    while (not all(data_all_read) or hvi_done.read() == 0) and not stop_event.is_set():
-        t = time.time() - start_time
+    def acquisition_loop():
+        # Only stores the new data, the live plot is redrawn from the GUI thread
+        nonlocal t, next_log, timeout_counter, ready_pts, segments_measured, lines_reported, saved_data_index
+        while (not all(data_all_read) or hvi_done.read() == 0) and not stop_event.is_set():
+            t = time.time() - start_time
+
+            if t > next_log:
+                voltage_channel_1d_read = voltage_channel_1d.read()
+                voltage_channel_2d_read = voltage_channel_2d.read()
+                vg_voltage_1d_read = vg_voltage_1d.read()
+                vg_voltage_2d_read = vg_voltage_2d.read()
+                config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_1d, voltage_channel_1d_read))
+                config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_2d, voltage_channel_2d_read))
+                config.logger.debug("AWG loop counter 1D: {}/{}".format(awg_loop_counter_1d.read(), ramp_counter_1d.read()))
+                config.logger.debug("AWG loop counter 2D: {}/{}".format(awg_loop_counter_2d.read(), ramp_counter_2d.read()))
+                config.logger.debug("DIG loop counter: {}/{}".format(loop_counter_1d.read(), step_counter_1d.read()))
+                config.logger.debug("DIG Debug: {}".format(dig_debug.read()))
+                config.logger.debug("VG Voltage 1D ({}): {}".format(config.secondary_awg_engine_name, vg_voltage_1d_read))
+                config.logger.debug("VG Voltage 2D ({}): {}".format(config.main_awg_engine_name, vg_voltage_2d_read))
+                for i, ch in enumerate(channel_list):
+                    config.logger.debug("{}/{} points read on ch{}".format(readPoints[i], max_points, ch))
+                config.logger.debug("Ready points: {:.02f}M pts".format(ready_pts/1e6))
+                next_log = next_log + log_interval
+
+                for i, ch in enumerate(channel_list):
+                    if readPoints[i] == old_readPoints[i] and readPoints[i] > 0: # Check for measurement timeout only after the measurement has started
+                        timeout_counter[i] = timeout_counter[i] + 1
+                        if timeout_counter[i] > round(max_time/log_interval):
+                            config.logger.info("Timeout during measurement")
+                            stop_event.set()
+                    old_readPoints[i] = readPoints[i]
 
-        if live_plotting and average_data:
-            if plot_pyqtgraph and PYQTGRAPH_INSTALLED:
-                img.setImage(graph_data.reshape((config.num_steps_2d, config.num_steps_1d)))
-                app.processEvents()
-            else:
-                graph.set_data(graph_data.reshape((config.num_steps_2d, config.num_steps_1d)))
-                # Update colorbar
-                graph.set_clim(vmin=np.nanmin(graph_data), vmax=np.nanmax(graph_data))
-                plt.draw()
-                QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 20)
-
-        if t > next_log:
-            voltage_channel_1d_read = voltage_channel_1d.read()
-            voltage_channel_2d_read = voltage_channel_2d.read()
-            vg_voltage_1d_read = vg_voltage_1d.read()
-            vg_voltage_2d_read = vg_voltage_2d.read()
-            config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_1d, voltage_channel_1d_read))
-            config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_2d, voltage_channel_2d_read))
-            config.logger.debug("AWG loop counter 1D: {}/{}".format(awg_loop_counter_1d.read(), ramp_counter_1d.read()))
-            config.logger.debug("AWG loop counter 2D: {}/{}".format(awg_loop_counter_2d.read(), ramp_counter_2d.read()))
-            config.logger.debug("DIG loop counter: {}/{}".format(loop_counter_1d.read(), step_counter_1d.read()))
-            config.logger.debug("DIG Debug: {}".format(dig_debug.read()))
-            config.logger.debug("VG Voltage 1D ({}): {}".format(config.secondary_awg_engine_name, vg_voltage_1d_read))
-            config.logger.debug("VG Voltage 2D ({}): {}".format(config.main_awg_engine_name, vg_voltage_2d_read))
             for i, ch in enumerate(channel_list):
-                config.logger.debug("{}/{} points read on ch{}".format(readPoints[i], max_points, ch))
-            config.logger.debug("Ready points: {:.02f}M pts".format(ready_pts/1e6))
-            next_log = next_log + log_interval
+                ready_pts = dig_module.instrument.DAQcounterRead(ch)
+                if ready_pts > 0:
+                    timeout_counter = [0]*len(channel_list)
+                    data = dig_module.instrument.DAQread(ch, ready_pts, timeout) # return a Numpy array
+                    try:
+                        if average_data:
+                            # Add buffer before data
+                            if buffer[i].size > 0:
+                                data = np.append(buffer[i], data)
+                                buffer[i] = np.array([])
+                            if data.size >= points_per_cycle:
+                                # Find the number of points that fill the buffer and average them directly
+                                nb_filled_buffers = data.size // points_per_cycle
+                                averaged_data[i][averaged_data_index[i]:averaged_data_index[i]+nb_filled_buffers] = np.mean(data[:nb_filled_buffers*points_per_cycle].reshape((nb_filled_buffers, points_per_cycle)), axis=1)*conversion_factor
+                            
+                                if i == 0:
+                                    time_array[averaged_data_index[i]:averaged_data_index[i]+nb_filled_buffers] = time.time()
 
-            for i, ch in enumerate(channel_list):
-                if readPoints[i] == old_readPoints[i] and readPoints[i] > 0: # Check for measurement timeout only after the measurement has started
-                    timeout_counter[i] = timeout_counter[i] + 1
-                    if timeout_counter[i] > round(max_time/log_interval):
-                        config.logger.info("Timeout during measurement")
-                        stop_event.set()
-                old_readPoints[i] = readPoints[i]
+                                averaged_data_index[i] = averaged_data_index[i] + nb_filled_buffers
 
-        for i, ch in enumerate(channel_list):
-            ready_pts = dig_module.instrument.DAQcounterRead(ch)
-            if ready_pts > 0:
-                timeout_counter = [0]*len(channel_list)
-                data = dig_module.instrument.DAQread(ch, ready_pts, timeout) # return a Numpy array
-                try:
-                    if average_data:
-                        # Add buffer before data
-                        if buffer[i].size > 0:
-                            data = np.append(buffer[i], data)
-                            buffer[i] = np.array([])
-                        if data.size >= config.acquisition_points_per_cycle:
-                            # Find the number of points that fill the buffer and average them directly
-                            nb_filled_buffers = data.size // config.acquisition_points_per_cycle
-                            averaged_data[i][averaged_data_index[i]:averaged_data_index[i]+nb_filled_buffers] = np.mean(data[:nb_filled_buffers*config.acquisition_points_per_cycle].reshape((nb_filled_buffers, config.acquisition_points_per_cycle)), axis=1)*conversion_factor
-                            
-                            if i == 0:
-                                time_array[averaged_data_index[i]:averaged_data_index[i]+nb_filled_buffers] = time.time()
+                                # Move the remaining data to the buffer
+                                buffer[i] = data[nb_filled_buffers*points_per_cycle:]
 
-                            averaged_data_index[i] = averaged_data_index[i] + nb_filled_buffers
+                            else:
+                                # Move data to buffer
+                                buffer[i] = data
 
-                            # Move the remaining data to the buffer
-                            buffer[i] = data[nb_filled_buffers*config.acquisition_points_per_cycle:]
+                        else:
+                            measured_data[i][readPoints[i]:readPoints[i]+ready_pts] = data*conversion_factor
+                            if i == 0:
+                                time_array[readPoints[i]:readPoints[i]+ready_pts] = time.time()
+
+                    except:
+                        config.logger.debug("Was expecting {} pts and measured {}.".format(ready_pts, len(data)))
+                        raise
+                    readPoints[i] = readPoints[i] + ready_pts
+                    if return_averages and not average_data:
+                        # The cycles completed by this read are averaged once, so the final diagram doesn't average the raw data again
+                        completed_cycles = readPoints[i]//points_per_cycle
+                        if completed_cycles > averaged_data_index[i]:
+                            cycles = measured_data[i][averaged_data_index[i]*points_per_cycle:completed_cycles*points_per_cycle]
+                            averaged_data[i][averaged_data_index[i]:completed_cycles] = np.mean(cycles.reshape((-1, points_per_cycle)), axis=1)
+                            averaged_data_index[i] = completed_cycles
+                    # Reset old_readPoints if measurement is complete to avoid timeout
+                    if readPoints[i] == max_points:
+                        old_readPoints[i] = 0
+
+                    progress_string = "Progress: "
+                    if countdown:
+                        for i, ch in enumerate(channel_list):
+                            progress_string = progress_string + "ch{}={}%|".format(ch, round(readPoints[i]/max_points*100)) 
+                        progress_string = progress_string[:-1] # remove last "|"
+                        print(progress_string, end='\r')
 
+                else:
+                    # Check if a complete segment of data has been measured
+                    num_cycles_seg_read = num_cycles_seg.read()
+                    num_cycles_since_config_read = num_cycles_since_config.read()
+                    if num_cycles_since_config_read >= num_cycles_seg_read:
+                        config.logger.debug("Number of cycles since config / in segment: {} / {}".format(num_cycles_since_config_read, num_cycles_seg_read))
+                        segments_measured = segments_measured + 1
+                        config.logger.debug("Segment {} of {} measured.".format(segments_measured, num_segments))
+                        if segments_measured == num_segments:
+                            config.logger.debug("All segments measured. Not configuring the digitizer for the next segment.")
+                            pass # Do nothing if the last segment is already measured
+                        elif segments_measured == num_segments - 1: # if we are measuring the second last segment
+                            # Calculate the number of cycles for the last segment
+                            remaining_cycles = plan.num_cycles - cycles_per_segment*(num_segments - 1)
+                            config.logger.debug("Configuring the digitizer for the last segment of {} cycles.".format(remaining_cycles))
+                            configure_digitizer(config, dig_module, num_cycles_override=remaining_cycles)
                         else:
-                            # Move data to buffer
-                            buffer[i] = data
+                            config.logger.debug("Configuring the digitizer for the next full segment of {} cycles.".format(cycles_per_segment))
+                            configure_digitizer(config, dig_module)
+
+                        # Reset the number of cycles read since config
+                        num_cycles_since_config.write(0)
+                        config.logger.debug("Resetting 'Num cycles since config' register to 0.")
+
+                if readPoints[i] >= max_points:
+                    data_all_read[i] = True
+
+            # Send the new completed lines, the last one is returned with the full data
+            if line_callback is not None and average_data:
+                lines_completed = min(averaged_data_index)//num_steps_1d
+                if lines_reported < lines_completed < num_steps_2d:
+                    lines_reported = lines_completed
+                    if line_callback(averaged_data[:, :lines_completed*num_steps_1d], lines_completed):
+                        config.logger.info("Measurement stopped after {}/{} lines".format(lines_completed, num_steps_2d))
+                        stop_event.set()
 
-                    else:
-                        measured_data[i][readPoints[i]:readPoints[i]+ready_pts] = data*conversion_factor
-                        if i == 0:
-                            time_array[readPoints[i]:readPoints[i]+ready_pts] = time.time()
-
-                except:
-                    config.logger.debug("Was expecting {} pts and measured {}.".format(ready_pts, len(data)))
-                    raise
-                readPoints[i] = readPoints[i] + ready_pts
-                # Reset old_readPoints if measurement is complete to avoid timeout
-                if readPoints[i] == max_points:
-                    old_readPoints[i] = 0
-
-                progress_string = "Progress: "
-                if countdown:
-                    for i, ch in enumerate(channel_list):
-                        progress_string = progress_string + "ch{}={}%|".format(ch, round(readPoints[i]/max_points*100)) 
-                    progress_string = progress_string[:-1] # remove last "|"
-                    print(progress_string, end='\r')
+            if save_data:
+                if average_data:
+                    array_to_save = averaged_data
+                else:
+                    array_to_save = measured_data
 
-            else:
-                # Check if a complete segment of data has been measured
-                num_cycles_seg_read = num_cycles_seg.read()
-                num_cycles_since_config_read = num_cycles_since_config.read()
-                if num_cycles_since_config_read >= num_cycles_seg_read:
-                    config.logger.debug("Number of cycles since config / in segment: {} / {}".format(num_cycles_since_config_read, num_cycles_seg_read))
-                    segments_measured = segments_measured + 1
-                    config.logger.debug("Segment {} of {} measured.".format(segments_measured, num_segments))
-                    if segments_measured == num_segments:
-                        config.logger.debug("All segments measured. Not configuring the digitizer for the next segment.")
-                        pass # Do nothing if the last segment is already measured
-                    elif segments_measured == num_segments - 1: # if we are measuring the second last segment
-                        # Calculate the number of cycles for the last segment
-                        remaining_cycles = config.num_cycles - cycles_per_segment*(num_segments - 1)
-                        config.logger.debug("Configuring the digitizer for the last segment of {} cycles.".format(remaining_cycles))
-                        configure_digitizer(config, dig_module, num_cycles_override=remaining_cycles)
+                for i, ch in enumerate(channel_list):
+                    if i == 0:
+                        smallest_array_size = np.count_nonzero(~np.isnan(array_to_save[i]))
                     else:
-                        config.logger.debug("Configuring the digitizer for the next full segment of {} cycles.".format(cycles_per_segment))
-                        configure_digitizer(config, dig_module)
-
-                    # Reset the number of cycles read since config
-                    num_cycles_since_config.write(0)
-                    config.logger.debug("Resetting 'Num cycles since config' register to 0.")
-
-            if readPoints[i] >= max_points:
-                data_all_read[i] = True
-
-        if save_data:
-            if average_data:
-                array_to_save = averaged_data
-            else:
-                array_to_save = measured_data
-
-            for i, ch in enumerate(channel_list):
-                if i == 0:
-                    smallest_array_size = np.count_nonzero(~np.isnan(array_to_save[i]))
-                else:
-                    smallest_array_size = min(smallest_array_size, np.count_nonzero(~np.isnan(array_to_save[i])))
+                        smallest_array_size = min(smallest_array_size, np.count_nonzero(~np.isnan(array_to_save[i])))
         
-            if average_data:
-                with open(savepath, "a") as f:
-                    np.savetxt(f, np.vstack((y_array[saved_data_index:smallest_array_size], x_array[saved_data_index:smallest_array_size], array_to_save[:, saved_data_index:smallest_array_size], time_array[saved_data_index:smallest_array_size])).T, comments="#") # comments="#" for compatibility with readfile from pyHegel
-            else:
-                with open(savepath, "a") as f:
-                    np.savetxt(f, np.vstack((y_array[saved_data_index:smallest_array_size], x_array[saved_data_index:smallest_array_size], trace_time_array[saved_data_index:smallest_array_size], array_to_save[:, saved_data_index:smallest_array_size], time_array[saved_data_index:smallest_array_size])).T, comments="#")
+                if average_data:
+                    with open(savepath, "a") as f:
+                        np.savetxt(f, np.vstack((y_array[saved_data_index:smallest_array_size], x_array[saved_data_index:smallest_array_size], array_to_save[:, saved_data_index:smallest_array_size], time_array[saved_data_index:smallest_array_size])).T, comments="#") # comments="#" for compatibility with readfile from pyHegel
+                else:
+                    with open(savepath, "a") as f:
+                        np.savetxt(f, np.vstack((y_array[saved_data_index:smallest_array_size], x_array[saved_data_index:smallest_array_size], trace_time_array[saved_data_index:smallest_array_size], array_to_save[:, saved_data_index:smallest_array_size], time_array[saved_data_index:smallest_array_size])).T, comments="#")
 
-            saved_data_index = smallest_array_size
+                saved_data_index = smallest_array_size
+
+    if live_plotting and average_data:
+        refresher.run(acquisition_loop)
+    else:
+        acquisition_loop()
 
     if countdown: print("")
-    config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_1d, voltage_channel_1d_read))
-    config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_2d, voltage_channel_2d_read))
+    config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_1d, voltage_channel_1d.read()))
+    config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_2d, voltage_channel_2d.read()))
     config.logger.debug("AWG loop counter 1D: {}/{}".format(awg_loop_counter_1d.read(), ramp_counter_1d.read()))
     config.logger.debug("AWG loop counter 2D: {}/{}".format(awg_loop_counter_2d.read(), ramp_counter_2d.read()))
     config.logger.debug("DIG loop counter: {}/{}".format(loop_counter_1d.read(), step_counter_1d.read()))
@@ -950,28 +1054,21 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
         config.logger.info("HVI execution not completed...")
 
     for i, ch in enumerate(channel_list):
-        if readPoints[i] < config.acquisition_points:
-            config.logger.warning("MISSING DATA! Measured only {}/{} points.".format(readPoints[i], config.acquisition_points))
+        if readPoints[i] < max_points:
+            config.logger.warning("MISSING DATA! Measured only {}/{} points.".format(readPoints[i], max_points))
 
         # Save NaNs for the missing points to preserve the data array's dimensions
-        if average_data:
-            array_to_save = averaged_data[saved_data_index:]
-        else:
-            array_to_save = measured_data[saved_data_index:]
-        with open(savepath, "a") as f:
-            np.savetxt(f, array_to_save.T, comments="#") # comments="#" for compatibility with readfile from pyHegel
+        if save_data:
+            if average_data:
+                array_to_save = averaged_data[saved_data_index:]
+            else:
+                array_to_save = measured_data[saved_data_index:]
+            with open(savepath, "a") as f:
+                np.savetxt(f, array_to_save.T, comments="#") # comments="#" for compatibility with readfile from pyHegel
 
     if live_plotting and average_data:
-        if plot_pyqtgraph and PYQTGRAPH_INSTALLED:
-            img.setImage(graph_data.reshape((config.num_steps_2d, config.num_steps_1d)))
-            app.processEvents()
-        else:
-            # Final live plot update
-            graph.set_data(graph_data.reshape((config.num_steps_2d, config.num_steps_1d)))
-            # Update colorbar
-            graph.set_clim(vmin=np.nanmin(graph_data), vmax=np.nanmax(graph_data))
-            plt.draw()
-            QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 20)
+        # Final live plot update
+        refresher.stop()
 
         config.logger.info("Measurement done in {:.04f}s".format(t))
 
@@ -980,7 +1077,11 @@ def measure_data(config: ApplicationConfig2D, awg_module: Module, dig_module : M
             config.win = win # save the object to keep the window open
         else:
             config.win = None
+        if return_averages:
+            return averaged_data, averaged_data
         return averaged_data
+    elif return_averages:
+        return measured_data, averaged_data
     else:
         return measured_data
 
@@ -1014,6 +1115,8 @@ def prepare_hvi_sequence(sequencer: kthvi.Sequencer, config: ApplicationConfig2D
     kthvi.Hvi object
         Compiled HVI sequence.
     """
+    start_time = time.time()
+
     # Define registers within the scope of the outmost sync sequence
     define_awg_registers_1d(sequencer, awg_module, config)
     define_dig_registers_1d(sequencer, dig_module, config)
@@ -1060,9 +1163,13 @@ def prepare_hvi_sequence(sequencer: kthvi.Sequencer, config: ApplicationConfig2D
     hvi.load_to_hw()
     config.logger.info("HVI Loaded to HW")
 
+    # Keep track of the config compiled in the HVI to choose how to apply the next changes (see apply_config_changes)
+    config.hvi_compile_time = time.time() - start_time
+    config.hvi_config = snapshot_config(config)
+
     return hvi
 
-def run_hvi(config: ApplicationConfig2D, awg_module: Module, dig_module: Module, hvi: kthvi.Hvi, channel_list: list, max_time: float, countdown=True, live_plotting=True, average_data = False, save_data=False, header="", savepath="default_Sweeper2D_datafile.txt", plot_pyqtgraph=False)-> np.ndarray:
+def run_hvi(config: ApplicationConfig2D, awg_module: Module, dig_module: Module, hvi: kthvi.Hvi, channel_list: list, max_time: float, countdown=True, live_plotting=True, average_data = False, save_data=False, header="", savepath="default_Sweeper2D_datafile.txt", plot_pyqtgraph=False, line_callback=None, return_averages=False, telemetry=None, frame_index=0)-> np.ndarray:
     """
     Run the compiled HVI sequence and return the data. One or four arrays are returned depending if all channels are measured or not.
 
@@ -1096,22 +1203,41 @@ def run_hvi(config: ApplicationConfig2D, awg_module: Module, dig_module: Module,
         Directory where the data is saved, by default "default_Sweeper2D_datafile.txt".
     plot_pyqtgraph : bool, optional
         Choose whether to plot the data with pyqtgraph or not, by default False. If False, the data is plotted with matplotlib.
+    line_callback : callable, optional
+        Function called with the completed lines of the 2D sweep (see measure_data), by default None.
+    return_averages : bool, optional
+        Also return the data averaged over each cycle during the acquisition (see measure_data), by default False.
+    telemetry : FrameTelemetry, optional
+        Records the hvi_start and hvi_run durations of the frame (see video_mode_lib), by default None.
+    frame_index : int, optional
+        Index of the frame recorded in the telemetry, by default 0.
 
     Returns
     -------
     One or four np.ndarray
         Data array or arrays from the experiment.
+    np.ndarray
+        Data averaged over each cycle. Only returned if return_averages is True.
     """
     # Execute HVI in non-blocking mode
     # This mode allows SW execution to interact with HVI execution
     config.logger.info("HVI Running...")
+    start_time = time.time()
     hvi.run(hvi.no_wait)
+    started_time = time.time()
 
     try:
         if not config.hardware_simulated:
-            data = measure_data(config, awg_module, dig_module, hvi, channel_list=channel_list, max_time=max_time, countdown=countdown, live_plotting=live_plotting, average_data=average_data, save_data=save_data, header=header, savepath=savepath, plot_pyqtgraph=plot_pyqtgraph)
+            data = measure_data(config, awg_module, dig_module, hvi, channel_list=channel_list, max_time=max_time, countdown=countdown, live_plotting=live_plotting, average_data=average_data, save_data=save_data, header=header, savepath=savepath, plot_pyqtgraph=plot_pyqtgraph, line_callback=line_callback, return_averages=return_averages)
+        elif return_averages:
+            data = np.array([]), np.array([])
         else:
             data =  np.array([])
+
+        # measure_data returns once the HVI is done and all its data is read
+        if telemetry is not None:
+            telemetry.record(frame_index, "hvi_start", started_time - start_time)
+            telemetry.record(frame_index, "hvi_run", time.time() - start_time)
             
         # Stopping the HVI program
         hvi.stop()
@@ -1163,8 +1289,112 @@ def prepare_first_diagram(config, module_dict: dict, awg_module: Module, dig_mod
     hvi = prepare_hvi_sequence(sequencer, config, awg_module, dig_module, secondary_awg_module, export_sequence=export_sequence, virtual_gates_modules=virtual_gates_modules)
     
     return hvi
+
+def update_hvi_registers(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.Hvi):
+    """
+    Update the 1D and 2D sweep registers of the compiled HVI sequence and keep track of the config applied to the HVI.
+
+    Parameters
+    ----------
+    config : ApplicationConfig2D class
+        Experiment configuration.
+    module_dict : dict
+        Dictionary of the opened modules.
+    hvi : kthvi.Hvi object
+        Compiled HVI sequence.
+    """
+    awg_module = module_dict[config.main_awg_engine_name]
+    dig_module = module_dict[config.main_dig_engine_name]
+    secondary_awg_module = module_dict[config.secondary_awg_engine_name]
+
+    update_awg_registers_1d(hvi, awg_module, config, module_dict)
+    update_dig_registers_1d(hvi, dig_module, config)
+    update_awg_registers_2d(hvi, secondary_awg_module, config, module_dict)
+    update_dig_registers_2d(hvi, dig_module, config)
+
+    config.hvi_config = snapshot_config(config)
+
+def update_vg_voltage_registers(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.Hvi):
+    """
+    Update the virtual gates registers holding the voltages read on the hardware. Must be called before each run
+    that doesn't call update_hvi_registers, the voltages can change between two runs without any change of the config.
+
+    Parameters
+    ----------
+    config : ApplicationConfig2D class
+        Experiment configuration.
+    module_dict : dict
+        Dictionary of the opened modules.
+    hvi : kthvi.Hvi object
+        Compiled HVI sequence.
+    """
+    update_vg_voltage_registers_1d(hvi, module_dict[config.main_awg_engine_name], config, module_dict)
+    update_vg_voltage_registers_2d(hvi, module_dict[config.secondary_awg_engine_name], config, module_dict)
+
+def apply_config_changes(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.Hvi, virtual_gates_modules=[], export_sequence=False)-> kthvi.Hvi:
+    """
+    Apply the changes made to the config since the HVI sequence was compiled using the cheapest path:
+    reconfigure the DAQ only (done by measure_diagram), update the registers or recompile the HVI sequence.
+
+    Parameters
+    ----------
+    config : ApplicationConfig2D class
+        Experiment configuration.
+    module_dict : dict
+        Dictionary of the opened modules.
+    hvi : kthvi.Hvi object
+        Compiled HVI sequence.
+    virtual_gates_modules : list of Module objects, optional
+        List of modules used for the virtual gates excluding the awg_module and secondary_awg_module, by default [].
+    export_sequence : bool, optional
+        Export the HVI sequence to a text file if it is recompiled, by default False.
+
+    Returns
+    -------
+    kthvi.Hvi object
+        HVI sequence to use for the next measurements. It is a new object if the sequence was recompiled.
+
+    Raises
+    ------
+    ValueError
+        If the modules or their firmware changed. The modules must be opened again with open_modules.
+    """
+    action, changed_fields = classify_config_change(getattr(config, "hvi_config", None), config)
+    compile_time = getattr(config, "hvi_compile_time", None)
+
+    if action == CONFIG_CHANGE_RECOMPILE:
+        config.logger.info("Recompiling the HVI sequence because {} changed.".format(", ".join(changed_fields)))
+        firmware_fields = [field for field in changed_fields if field not in ("AWG_channel_1d", "AWG_channel_2d", "slew_rate_1d", "slew_rate_2d", "dV", "use_QD_emulator")]
+        if firmware_fields:
+            raise ValueError("{} changed. The modules must be opened again with open_modules.".format(", ".join(firmware_fields)))
+
+        dig_module = module_dict[config.main_dig_engine_name]
+        if "use_QD_emulator" in changed_fields:
+            dig_module.firmware_to_load = config.QD_emulator_firmware if config.use_QD_emulator else config.M3100A_default_firmware
+            load_digitizer(config, dig_module)
+
+        hvi.release_hw()
+        config.logger.info("Releasing HW...")
+        hvi = prepare_first_diagram(config, module_dict, module_dict[config.main_awg_engine_name], dig_module, module_dict[config.secondary_awg_engine_name], virtual_gates_modules, export_sequence=export_sequence)
+        if config.use_virtual_gates:
+            update_vg_registers(config, module_dict, hvi)
+        config.logger.info("HVI sequence recompiled in {:.1f} s.".format(config.hvi_compile_time))
+
+    elif action == CONFIG_CHANGE_REGISTERS:
+        start_time = time.time()
+        update_hvi_registers(config, module_dict, hvi)
+        update_time = time.time() - start_time
+        if compile_time is not None:
+            config.logger.info("Updating the registers because {} changed, saved {:.1f} s of recompilation.".format(", ".join(changed_fields) or "the registers were never updated", compile_time - update_time))
+
+    else:
+        if compile_time is not None:
+            reason = "{} changed".format(", ".join(changed_fields)) if changed_fields else "nothing changed"
+            config.logger.info("Only reconfiguring the DAQ because {}, saved {:.1f} s of recompilation.".format(reason, compile_time))
+
+    return hvi
   
-def measure_diagram(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.Hvi, channel_list, max_time=20, countdown=True, live_plotting=True, average_data=False, nb_averaging=1, save_data=False, header="", plot_pyqtgraph=False)-> np.ndarray:
+def measure_diagram(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.Hvi, channel_list, max_time=20, countdown=True, live_plotting=True, average_data=False, nb_averaging=1, save_data=False, header="", plot_pyqtgraph=False, return_averages=False)-> np.ndarray:
     """
     Update the registers of the compiled HVI sequence and configure the modules before launching the next measurement.
 
@@ -1196,11 +1426,15 @@ def measure_diagram(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.H
         Header of the text file where the data is saved, by default "".
     plot_pyqtgraph : bool, optional
         Choose whether to plot the data with pyqtgraph or not, by default False. If False, the data is plotted with matplotlib.
+    return_averages : bool, optional
+        Also return the data averaged over each cycle during the acquisition, by default False. Used to plot the raw data without averaging it again (see plot_diagram).
 
     Returns
     -------
     1D np.ndarray
         Data of the stability diagram
+    np.ndarray
+        Data of the stability diagram averaged over each cycle. Only returned if return_averages is True.
     """
     # Get database_folder and save_filename from config
     database_folder = config.database_folder
@@ -1209,13 +1443,10 @@ def measure_diagram(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.H
     savepath = os.path.join(day_folder, filename_incr)
     yaml_config_filename = "{}_config.yaml".format(filename_incr[:-4])
     config_savepath = os.path.join(day_folder, yaml_config_filename)
-
-    src_dir = config.yaml_file
-    shutil.copy(src_dir, config_savepath)
+    config.to_yaml(config_savepath)
 
     awg_module = module_dict[config.main_awg_engine_name]
     dig_module = module_dict[config.main_dig_engine_name]
-    secondary_awg_module = module_dict[config.secondary_awg_engine_name]
 
     # Prepare awg module dict
     awg_module_dict = module_dict.copy()
@@ -1224,10 +1455,13 @@ def measure_diagram(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.H
         if isinstance(module.instrument, keysightSD1.SD_AIN):
             awg_module_dict.pop(engine_name)
 
-    update_awg_registers_1d(hvi, awg_module, config, module_dict)
-    update_dig_registers_1d(hvi, dig_module, config)
-    update_awg_registers_2d(hvi, secondary_awg_module, config, module_dict)
-    update_dig_registers_2d(hvi, dig_module, config)
+    action, changed_fields = classify_config_change(getattr(config, "hvi_config", None), config)
+    if action == CONFIG_CHANGE_RECOMPILE:
+        raise ValueError("{} changed since the HVI sequence was compiled. Use apply_config_changes before measure_diagram.".format(", ".join(changed_fields)))
+    elif action == CONFIG_CHANGE_REGISTERS:
+        update_hvi_registers(config, module_dict, hvi)
+    else:
+        update_vg_voltage_registers(config, module_dict, hvi)
 
     if average_data and nb_averaging > 1 and live_plotting:
         averaging_index = 0
@@ -1253,7 +1487,9 @@ def measure_diagram(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.H
         for engine_name, module in awg_module_dict.items():
             configure_awg(config, module)
     
-        data = run_hvi(config, awg_module, dig_module, hvi, channel_list=channel_list, max_time=max_time, countdown=countdown, live_plotting=live_plotting, average_data=average_data, save_data=save_data, header=header, savepath=savepath, plot_pyqtgraph=plot_pyqtgraph)
+        data = run_hvi(config, awg_module, dig_module, hvi, channel_list=channel_list, max_time=max_time, countdown=countdown, live_plotting=live_plotting, average_data=average_data, save_data=save_data, header=header, savepath=savepath, plot_pyqtgraph=plot_pyqtgraph, return_averages=return_averages)
+        if return_averages:
+            data, averaged_data = data
         if average_data:
             nb_points = config.num_cycles
         else:
@@ -1267,17 +1503,16 @@ def measure_diagram(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.H
                 config.logger.info("Measured only {}/{} points for ch{}. Restarting previous measurement because of timeout.".format(true_len, nb_points, ch))
         
         if redo_measurement:
-            update_awg_registers_1d(hvi, awg_module, config, module_dict)
-            update_dig_registers_1d(hvi, dig_module, config)
-            update_awg_registers_2d(hvi, secondary_awg_module, config, module_dict)
-            update_dig_registers_2d(hvi, dig_module, config)
+            update_hvi_registers(config, module_dict, hvi)
 
             # Configure modules
             configure_digitizer(config, dig_module)
             for engine_name, module in awg_module_dict.items():
                 configure_awg(config, module)
 
-            data = run_hvi(config, awg_module, dig_module, hvi, channel_list=channel_list, max_time=max_time, countdown=countdown, live_plotting=live_plotting, average_data=average_data, save_data=save_data, header=header, savepath="{}_timeout.txt".format(savepath[:-4]), plot_pyqtgraph=plot_pyqtgraph)
+            data = run_hvi(config, awg_module, dig_module, hvi, channel_list=channel_list, max_time=max_time, countdown=countdown, live_plotting=live_plotting, average_data=average_data, save_data=save_data, header=header, savepath="{}_timeout.txt".format(savepath[:-4]), plot_pyqtgraph=plot_pyqtgraph, return_averages=return_averages)
+            if return_averages:
+                data, averaged_data = data
     
         if average_data and nb_averaging > 1 and live_plotting:
             plt.figure("Live averaging")
@@ -1296,47 +1531,175 @@ def measure_diagram(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.H
             header = header + "\nAveraged over {} measurements".format(nb_averaging)
             np.savetxt(f, averaged_measurement, header=header, comments="#") # comments="#" for compatibility with readfile from pyHegel
 
+    if return_averages:
+        return data, averaged_data
+    return data
 
+def measure_point_table(config: ApplicationConfig2D, module_dict: dict, hvi: kthvi.Hvi, channel_list, table_1d=None, table_2d=None, points_2d=None, max_time=20, countdown=True, return_voltages=False)-> np.ndarray:
+    """
+    Measure a table of voltages instead of a uniform grid. The table is split into runs of evenly spaced voltages (see point_tables.py)
+    and each run is measured by the compiled 2D sweep, only updating its registers. The averaged data is returned in the order of the table.
+    Each run is verified like a regular sweep, and the voltages actually measured are logged and can be returned since the
+    hardware steps by whole AWG increments.
+
+    Parameters
+    ----------
+    config : ApplicationConfig2D class
+        Experiment configuration. The sweep parameters are restored after the measurement.
+    module_dict : dict
+        Dictionary of the opened modules.
+    hvi : kthvi.Hvi object
+        Compiled HVI sequence.
+    channel_list : list
+        List of channels to measure.
+    table_1d : array_like, optional
+        Voltages of the 1D axis, used with table_2d to measure a non-uniform grid, by default None.
+    table_2d : array_like, optional
+        Voltages of the 2D axis, used with table_1d to measure a non-uniform grid, by default None.
+    points_2d : array_like, optional
+        Array of shape (N, 2) with the 1D and 2D voltages of each point to measure (sparse sampling), by default None.
+    max_time : int, optional
+        Maximum time allowed between two data acquisition in seconds, by default 20.
+    countdown : bool, optional
+        Prints a countdown during the experiment, by default True.
+    return_voltages : bool, optional
+        Also return the voltages actually measured, by default False.
+
+    Returns
+    -------
+    data : np.ndarray
+        Averaged data of shape (channels, len(table_2d), len(table_1d)) for a grid or (channels, N) for a list of points.
+    voltages : tuple of np.ndarray or np.ndarray
+        Only if return_voltages is True. Measured voltages in the order of the table: (voltages_1d, voltages_2d) for a grid or
+        an array of shape (N, 2) for a list of points.
+
+    Raises
+    ------
+    ValueError
+        If neither a list of points nor the tables of both axes are given, or if a run of the table can't be measured by the sweep (see verify_sweep_parameters_1d).
+    """
+    if points_2d is not None:
+        # One line of the 2D sweep per run
+        requested_points = np.asarray(points_2d, dtype=float).reshape((-1, 2))
+        data = np.full((len(channel_list), requested_points.shape[0]), np.nan)
+        voltages = np.full(requested_points.shape, np.nan)
+        blocks = [(vi_1d, vf_1d, num_steps_1d, v_2d, v_2d, 1, indices, None) for vi_1d, vf_1d, num_steps_1d, v_2d, indices in split_point_list_2d(points_2d, dV=config.dV)]
+    elif table_1d is not None and table_2d is not None:
+        # One 2D sweep per pair of runs
+        data = np.full((len(channel_list), np.size(table_2d), np.size(table_1d)), np.nan)
+        requested_1d, requested_2d = np.asarray(table_1d, dtype=float).flatten(), np.asarray(table_2d, dtype=float).flatten()
+        voltages_1d, voltages_2d = np.full(requested_1d.shape, np.nan), np.full(requested_2d.shape, np.nan)
+        runs_1d = split_point_table(table_1d, dV=config.dV)
+        runs_2d = split_point_table(table_2d, dV=config.dV)
+        blocks = [(vi_1d, vf_1d, num_steps_1d, vi_2d, vf_2d, num_steps_2d, indices_1d, indices_2d) for vi_2d, vf_2d, num_steps_2d, indices_2d in runs_2d for vi_1d, vf_1d, num_steps_1d, indices_1d in runs_1d]
+    else:
+        raise ValueError("Give either points_2d or both table_1d and table_2d.")
+
+    awg_module = module_dict[config.main_awg_engine_name]
+    dig_module = module_dict[config.main_dig_engine_name]
+
+    sweep_parameters = (config.vi_1d, config.vf_1d, config.num_steps_1d, config.vi_2d, config.vf_2d, config.num_steps_2d)
+    nb_points = sum(block[2]*block[5] for block in blocks)
+    config.logger.info("Measuring {} points in {} hardware sweeps.".format(nb_points, len(blocks)))
+    try:
+        for block_index, (vi_1d, vf_1d, num_steps_1d, vi_2d, vf_2d, num_steps_2d, indices_1d, indices_2d) in enumerate(blocks):
+            config.vi_1d, config.vf_1d, config.num_steps_1d = vi_1d, vf_1d, num_steps_1d
+            config.vi_2d, config.vf_2d, config.num_steps_2d = vi_2d, vf_2d, num_steps_2d
+
+            # The runs are measured by the regular sweep, a run of a single voltage doesn't need any verification
+            if num_steps_1d > 1:
+                verify_sweep_parameters_1d(config)
+            if num_steps_2d > 1:
+                verify_sweep_parameters_2d(config)
+            measured_1d = sweep_voltages(vi_1d, vf_1d, num_steps_1d, dV=config.dV)
+            measured_2d = sweep_voltages(vi_2d, vf_2d, num_steps_2d, dV=config.dV)
+            for index_1d, table_indices_1d in enumerate(indices_1d):
+                if indices_2d is None:
+                    voltages[table_indices_1d] = (measured_1d[index_1d], measured_2d[0])
+                else:
+                    voltages_1d[table_indices_1d] = measured_1d[index_1d]
+            if indices_2d is not None:
+                for index_2d, table_indices_2d in enumerate(indices_2d):
+                    voltages_2d[table_indices_2d] = measured_2d[index_2d]
+
+            update_hvi_registers(config, module_dict, hvi)
+
+            # Configure modules, the channels and AWGs keep their settings between the runs and the DAQs are only armed again
+            configure_digitizer(config, dig_module, configure_channels=block_index == 0)
+            if block_index == 0:
+                for engine_name, module in module_dict.items():
+                    if not isinstance(module.instrument, keysightSD1.SD_AIN):
+                        configure_awg(config, module)
+
+            block_data = run_hvi(config, awg_module, dig_module, hvi, channel_list=channel_list, max_time=max_time, countdown=countdown, live_plotting=False, average_data=True)
+            if block_data is None:
+                # run_hvi already released the HVI, the next blocks can't be measured
+                raise Exception("Measurement of the block Vi 1D={}, Vf 1D={}, Vi 2D={}, Vf 2D={} failed.".format(vi_1d, vf_1d, vi_2d, vf_2d))
+            if np.size(block_data) == 0:
+                continue # simulated hardware
+            block_data = np.asarray(block_data).reshape((len(channel_list), num_steps_2d, num_steps_1d))
+
+            # Put the measured points back in the order of the table (duplicated voltages get the same value)
+            for index_1d, table_indices_1d in enumerate(indices_1d):
+                if indices_2d is None:
+                    data[:, table_indices_1d] = block_data[:, 0, index_1d][:, None]
+                else:
+                    for index_2d, table_indices_2d in enumerate(indices_2d):
+                        data[:, table_indices_2d[:, None], table_indices_1d[None, :]] = block_data[:, index_2d, index_1d][:, None, None]
+    finally:
+        config.vi_1d, config.vf_1d, config.num_steps_1d, config.vi_2d, config.vf_2d, config.num_steps_2d = sweep_parameters
+
+    if points_2d is not None:
+        max_difference = np.max(np.abs(voltages - requested_points), initial=0)
+        voltages_measured = voltages
+    else:
+        max_difference = max(np.max(np.abs(voltages_1d - requested_1d), initial=0), np.max(np.abs(voltages_2d - requested_2d), initial=0))
+        voltages_measured = (voltages_1d, voltages_2d)
+    config.logger.info("Largest difference between the requested and measured voltages: {:.3g} V".format(max_difference))
+
+    if return_voltages:
+        return data, voltages_measured
     return data
 
-def plot_diagram(config: ApplicationConfig2D, data: np.ndarray, channel_list: list, is_averaged=False):
+def plot_diagram(config: ApplicationConfig2D, averaged_data: np.ndarray, channel_list: list)-> np.ndarray:
     """
-    Plot the stability diagram.
+    Plot the stability diagrams of all the channels in one figure with shared axes.
+    The grid of the sweep is uniform, so each diagram is drawn as an image instead of a mesh.
 
     Parameters
     ----------
     config : ApplicationConfigPnF class
         Experiment configuration.
-    data : 1D np.ndarray
-        Data of the stability diagram
+    averaged_data : np.ndarray
+        Data of the stability diagram averaged over each cycle during the acquisition, one row per channel (see measure_diagram with return_averages).
     channel_list : list
         List of channels to measure.
-    is_averaged : bool, optional
-        Specify if the data is averaged or not, by default False.
+
+    Returns
+    -------
+    np.ndarray
+        Diagrams of shape (number of channels, num_steps_2d, num_steps_1d), views of averaged_data.
     """
+    diagrams = np.reshape(averaged_data, (len(channel_list), config.num_steps_2d, config.num_steps_1d))
 
+    # The pixels are centered on the voltages of the sweep like pcolormesh with shading="auto"
+    extent = []
+    for vi, vf, num_steps in ((config.vi_1d, config.vf_1d, config.num_steps_1d), (config.vi_2d, config.vf_2d, config.num_steps_2d)):
+        half_step = (vf - vi)/(2*(num_steps - 1)) if num_steps > 1 else 1e-3
+        extent.extend([vi - half_step, vf + half_step])
+
+    fig, axes = plt.subplots(1, len(channel_list), sharex=True, sharey=True, squeeze=False, figsize=(5*len(channel_list), 4))
     for i, ch in enumerate(channel_list):
-        graph_data = data[i]
-        if is_averaged == False:
-            averaged_data = graph_data.reshape((config.num_cycles, config.acquisition_points_per_cycle))
-            averaged_data = np.mean(averaged_data, axis=1)
-        else:
-            averaged_data = graph_data
-
-        reshaped_data = averaged_data.reshape((config.num_steps_2d, config.num_steps_1d))
-        x = np.linspace(config.vi_1d, config.vf_1d, config.num_steps_1d)
-        y = np.linspace(config.vi_2d, config.vf_2d, config.num_steps_2d)
-        xv, yv = np.meshgrid(x, y)
-
-        # Plot 2D data
-        plt.figure()
-        plt.pcolormesh(xv,yv,reshaped_data,cmap="viridis",shading="auto")
-        plt.xlabel("Vg1 (V)")
-        plt.ylabel("Vg2 (V)")
-        cbar = plt.colorbar()
+        ax = axes[0, i]
+        image = ax.imshow(diagrams[i], cmap="viridis", extent=extent, aspect="auto", origin="lower", interpolation="nearest")
+        ax.set_xlabel("Vg1 (V)")
+        ax.set_title("Digitizer channel {}".format(ch))
+        cbar = fig.colorbar(image, ax=ax)
         cbar.set_label("Nb of electrons", rotation=90)
-        plt.title("Digitizer channel {}".format(ch))
-        plt.draw()
+    axes[0, 0].set_ylabel("Vg2 (V)")
+    plt.draw()
+
+    return diagrams
 
 
 def run_experiment(countdown=True, plot_pyqtgraph=False):
@@ -1425,8 +1788,8 @@ def run_experiment(countdown=True, plot_pyqtgraph=False):
 
         average = True
         channel_list=[1]
-        data = measure_diagram(config, module_dict, hvi, channel_list, max_time=config.max_time, countdown=countdown, live_plotting=True, average_data=average, save_data=True, header="test"+"\nshape=({},{})".format(config.num_steps_2d, config.num_steps_1d), plot_pyqtgraph=plot_pyqtgraph)
-        plot_diagram(config, data, channel_list, is_averaged=average)
+        data, averaged_data = measure_diagram(config, module_dict, hvi, channel_list, max_time=config.max_time, countdown=countdown, live_plotting=True, average_data=average, save_data=True, header="test"+"\nshape=({},{})".format(config.num_steps_2d, config.num_steps_1d), plot_pyqtgraph=plot_pyqtgraph, return_averages=True)
+        plot_diagram(config, averaged_data, channel_list)
 
         if config.hardware_simulated:
             config.logger.info("Simulation completed successfully")
@@ -1440,10 +1803,11 @@ def run_experiment(countdown=True, plot_pyqtgraph=False):
                 config.vf_1d = 1+0.1*(i-1)
                 config.vi_2d = 0+0.1*(i-1)
                 config.vf_2d = 1+0.1*(i-1)
+                hvi = apply_config_changes(config, module_dict, hvi, virtual_gates_modules)
                 if config.use_virtual_gates: update_vg_registers(config, module_dict, hvi)
                 average = True
-                data = measure_diagram(config, module_dict, hvi, channel_list, max_time=config.max_time, countdown=countdown, live_plotting=True, average_data=average, save_data=True, header="test"+"\nshape=({},{})".format(config.num_steps_2d, config.num_steps_1d), plot_pyqtgraph=plot_pyqtgraph)
-                plot_diagram(config, data, channel_list, is_averaged=average)
+                data, averaged_data = measure_diagram(config, module_dict, hvi, channel_list, max_time=config.max_time, countdown=countdown, live_plotting=True, average_data=average, save_data=True, header="test"+"\nshape=({},{})".format(config.num_steps_2d, config.num_steps_1d), plot_pyqtgraph=plot_pyqtgraph, return_averages=True)
+                plot_diagram(config, averaged_data, channel_list)
 
             # Save data if needed
             # save_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "Logs", "Sweeper2D", "QD_diagram_VG")
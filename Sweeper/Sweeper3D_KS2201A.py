@@ -0,0 +1,877 @@
+import sys
+import numpy as np
+import time
+import matplotlib.pyplot as plt
+import os
+import yaml
+from matplotlib.widgets import Button
+from threading import Event
+sys.path.append(r'C:\Program Files (x86)\Keysight\SD1\Libraries\Python')
+import keysightSD1
+try:
+    import keysight_tse as kthvi
+except ImportError:
+    import keysight_hvi as kthvi
+from Sweeper1D_KS2201A import initialize_awg_registers_1d, initialize_dig_registers_1d, \
+                                define_awg_registers_1d, define_dig_registers_1d, update_awg_registers_1d, update_dig_registers_1d
+from Sweeper2D_KS2201A import ApplicationConfig2D, sweeper_2d, stop_qd_emulator, initialize_awg_registers_2d, \
+                                define_awg_registers_2d, define_dig_registers_2d, update_awg_registers_2d, update_dig_registers_2d
+from KS2201A_lib import ModuleDescriptor, Module, open_modules, configure_awg, configure_digitizer, \
+                        calc_step_counter, program_step_to_target_voltage, program_ramp_direction, calc_sweep_direction, export_hvi_sequences, \
+                        load_awg, load_digitizer, define_system, verify_sweep_parameters_3d, \
+                        set_hvi_done, initialize_logging, make_run_plan
+
+from file_save_system import create_save_filename
+from live_plotting import LivePlotRefresher, ColourScaleTracker
+
+#%% Config
+class ApplicationConfig3D(ApplicationConfig2D):
+    " Defines module descriptors, configuration options and names of HVI engines, actions, triggers"
+    def __init__(self, log_dir, chassis_list, module_descriptors, vi_1d, vf_1d, num_steps_1d, vi_2d, vf_2d, num_steps_2d, AWG_channel_1d=1, slew_rate_1d=1, AWG_channel_2d=2, slew_rate_2d=1, integration_time = 10000, prescaler=4, dV=45.7778e-6,
+                 loadBitstream=False, load_digitizer_channel_config = False, use_QD_emulator = False, QD_emulator_Cm=0.2, use_virtual_gates=False, hardware_simulated=False, start_logging=True,
+                 vi_3d=0, vf_3d=0, num_steps_3d=1, AWG_channel_3d=3, slew_rate_3d=1):
+        # The 3D parameters are placed after the 2D ones so ApplicationConfig2D.from_yaml can create the object
+
+        if start_logging:
+            day_folder, _ = create_save_filename(log_dir, "Sweeper3D")
+            self.logger, self.console_handler, self.file_handler = initialize_logging(day_folder, "Sweeper3D")
+
+        """
+        Defines the experiment parameters
+        """
+        # 3D sweep parameters (defined first since num_cycles depends on them)
+        self.AWG_channel_3d = AWG_channel_3d
+        self.vi_3d = vi_3d
+        self.vf_3d = vf_3d
+        self.slew_rate_3d = slew_rate_3d # [V/s]
+        self.num_steps_3d = num_steps_3d
+
+        # 1D and 2D sweep parameters
+        ApplicationConfig2D.__init__(self, log_dir, chassis_list, module_descriptors, vi_1d, vf_1d, num_steps_1d, vi_2d, vf_2d, num_steps_2d, AWG_channel_1d, slew_rate_1d, AWG_channel_2d, slew_rate_2d, integration_time, prescaler, dV,
+                                     loadBitstream, load_digitizer_channel_config, use_QD_emulator, QD_emulator_Cm, use_virtual_gates, hardware_simulated, start_logging=False)
+
+        """
+        Define names of HVI engines, actions, registers
+        """
+        # HVI engine names to be used in this application
+        self.tertiary_awg_engine_name = None
+
+        # HVI register names to be used within the scope of each HVI engine
+        self.vi_3d_name = "Vi 3D"
+        self.vf_3d_name = "Vf 3D"
+        self.voltage_3d_name = "Voltage 3D (Ch{})"
+
+        self.step_counter_3d_name = "Step Counter 3D"
+        self.loop_counter_3d_name = "Loop Counter 3D"
+        self.ramp_counter_3d_name = "Ramp Counter 3D"
+        self.awg_loop_counter_3d_name = "AWG Loop Counter 3D"
+        self.sweep_direction_3d_name = "Sweep Direction 3D" # signed voltage increment of the 3D sweep, set by the PC
+        self.ramp_direction_3d_name = "Ramp Direction 3D" # +1 or -1, set by HVI before ramps with an unknown starting voltage
+
+    @classmethod
+    def from_yaml(cls, yaml_file, logger=None):
+        with open(yaml_file, 'r') as file:
+            data = yaml.safe_load(file)
+        config_data = data["ApplicationConfig"]
+
+        if config_data["use_virtual_gates"]:
+            raise ValueError("Virtual gates are not supported by the 3D sweeper.")
+
+        # Create the config with the 1D and 2D parameters
+        config = super(ApplicationConfig3D, cls).from_yaml(yaml_file, logger)
+
+        config.vi_3d = config_data["vi_3d"]
+        config.vf_3d = config_data["vf_3d"]
+        config.num_steps_3d = config_data["num_steps_3d"]
+        config.AWG_channel_3d = config_data["AWG_channel_3d"]
+        config.slew_rate_3d = config_data["slew_rate_3d"]
+
+        # The 3D sweep is done with the third AWG module if there is one, otherwise with the secondary AWG module
+        if "third_awg_descriptor" in data:
+            tertiary_awg_descriptor = ModuleDescriptor.from_dict(data["third_awg_descriptor"])
+            if tertiary_awg_descriptor.engine_name not in [module_descriptor.engine_name for module_descriptor in config.module_descriptors]:
+                config.module_descriptors.append(tertiary_awg_descriptor)
+            config.tertiary_awg_engine_name = tertiary_awg_descriptor.engine_name
+        else:
+            config.tertiary_awg_engine_name = config.secondary_awg_engine_name
+
+        sweep_channels = [(config.main_awg_engine_name, config.AWG_channel_1d), (config.secondary_awg_engine_name, config.AWG_channel_2d), (config.tertiary_awg_engine_name, config.AWG_channel_3d)]
+        if len(set(sweep_channels)) != len(sweep_channels):
+            raise ValueError("The 1D, 2D and 3D sweeps must use different AWG channels. Got {}.".format(sweep_channels))
+
+        warnings = verify_sweep_parameters_3d(config, silence_warnings=True, auto_fix=True)
+        config.logger.info("3D sweep parameters warnings: {}".format(warnings))
+
+        return config
+
+    @property
+    def vi_3d_internal(self):
+        # Divide by 2 since AWG is outputing twice the voltage on HZ loads
+        return self.vi_3d/2.0
+    @property
+    def vf_3d_internal(self):
+        # Divide by 2 since AWG is outputing twice the voltage on HZ loads
+        return self.vf_3d/2.0
+
+    @property
+    def num_cycles(self):
+        return self.num_steps_1d*self.num_steps_2d*self.num_steps_3d
+
+    @property
+    def data_shape(self):
+        # Shape of one measured channel once reshaped, the slowest axis first
+        return (self.num_steps_3d, self.num_steps_2d, self.num_steps_1d)
+
+    def __str__(self):
+        return  ApplicationConfig2D.__str__(self) + "\n" \
+                "ApplicationConfig3D: vi_3d={}, vf_3d={}, num_steps_3d={}, AWG_channel_3d={}, slew_rate_3d={}".format(
+                self.vi_3d, self.vf_3d, self.num_steps_3d, self.AWG_channel_3d, self.slew_rate_3d)
+
+#%% 2nd Level: Functions to Define, Program, Execute HVI
+########################################################
+
+def define_awg_registers_3d(sequencer, awg_module, config):
+    """
+    Define the 3D sweep AWG registers for the module's HVI engine in the scope of the global sync sequence.
+
+    Parameters
+    ----------
+    sequencer : kthvi.Sequencer object
+        HVI sequence definition.
+    awg_module : Module
+        AWG module object used for the 3D sweep.
+    config : ApplicationConfig3D
+        Configuration of the HVI program.
+    """
+    awg_engine_name = awg_module.engine_name
+    awg_registers = sequencer.sync_sequence.scopes[awg_engine_name].registers
+
+    # voltage 3D
+    awg_registers.add(config.voltage_3d_name.format(config.AWG_channel_3d), kthvi.RegisterSize.SHORT)
+
+    vi_3d = awg_registers.add(config.vi_3d_name, kthvi.RegisterSize.SHORT)
+    vi_3d.initial_value = awg_module.instrument.voltsToInt(config.vi_3d_internal)
+    vf_3d = awg_registers.add(config.vf_3d_name, kthvi.RegisterSize.SHORT)
+    vf_3d.initial_value = awg_module.instrument.voltsToInt(config.vf_3d_internal)
+
+    config.logger.info("Vi 3d: {}={}".format(config.vi_3d_internal, awg_module.instrument.voltsToInt(config.vi_3d_internal)))
+    config.logger.info("Vf 3d: {}={}".format(config.vf_3d_internal, awg_module.instrument.voltsToInt(config.vf_3d_internal)))
+    config.logger.info("Num steps 3d: {}".format(config.num_steps_3d))
+
+    awg_loop_counter_3d = awg_registers.add(config.awg_loop_counter_3d_name, kthvi.RegisterSize.SHORT)
+    awg_loop_counter_3d.initial_value = 0
+    ramp_counter_3d = awg_registers.add(config.ramp_counter_3d_name, kthvi.RegisterSize.SHORT)
+    ramp_counter_3d_value = calc_step_counter(config.vi_3d_internal, config.vf_3d_internal, 2, dV=config.dV)
+    ramp_counter_3d.initial_value = ramp_counter_3d_value
+    config.logger.info("Ramp counter 3d: {}".format(ramp_counter_3d_value))
+
+    sweep_direction_3d = awg_registers.add(config.sweep_direction_3d_name, kthvi.RegisterSize.SHORT)
+    sweep_direction_3d.initial_value = calc_sweep_direction(awg_module, config.vi_3d_internal, config.vf_3d_internal, dV=config.dV)
+    awg_registers.add(config.ramp_direction_3d_name, kthvi.RegisterSize.SHORT)
+
+def define_dig_registers_3d(sequencer, dig_module, config):
+    """
+    Define the 3D sweep digitizer registers for the module's HVI engine in the scope of the global sync sequence.
+
+    Parameters
+    ----------
+    sequencer : kthvi.Sequencer object
+        HVI sequence definition.
+    dig_module : Module
+        Digitizer module object.
+    config : ApplicationConfig3D
+        Configuration of the HVI program.
+    """
+    dig_engine_name = dig_module.engine_name
+
+    loop_counter_3d = sequencer.sync_sequence.scopes[dig_engine_name].registers.add(config.loop_counter_3d_name, kthvi.RegisterSize.SHORT)
+    loop_counter_3d.initial_value = 0
+
+    step_counter_3d = sequencer.sync_sequence.scopes[dig_engine_name].registers.add(config.step_counter_3d_name, kthvi.RegisterSize.SHORT)
+    step_counter_3d.initial_value = calc_step_counter(config.vi_3d_internal, config.vf_3d_internal, config.num_steps_3d, dV=config.dV)
+    config.logger.info("Step counter 3d: {}".format(step_counter_3d.initial_value))
+
+def update_awg_registers_3d(hvi, awg_module, config):
+    """
+    Update the 3D sweep AWG registers of the module's HVI engine in the scope of the global sync sequence.
+
+    Parameters
+    ----------
+    hvi : kthvi.Hvi
+        HVI object.
+    awg_module : Module
+        AWG module object used for the 3D sweep.
+    config : ApplicationConfig3D
+        Configuration of the HVI program.
+    """
+    awg_registers = hvi.sync_sequence.scopes[awg_module.engine_name].registers
+
+    awg_registers[config.vi_3d_name].initial_value = awg_module.instrument.voltsToInt(config.vi_3d_internal)
+    awg_registers[config.vf_3d_name].initial_value = awg_module.instrument.voltsToInt(config.vf_3d_internal)
+    awg_registers[config.awg_loop_counter_3d_name].initial_value = 0
+    awg_registers[config.ramp_counter_3d_name].initial_value = calc_step_counter(config.vi_3d_internal, config.vf_3d_internal, 2, dV=config.dV)
+    awg_registers[config.sweep_direction_3d_name].initial_value = calc_sweep_direction(awg_module, config.vi_3d_internal, config.vf_3d_internal, dV=config.dV)
+
+def update_dig_registers_3d(hvi, dig_module, config):
+    """
+    Update the 3D sweep digitizer registers of the module's HVI engine in the scope of the global sync sequence.
+
+    Parameters
+    ----------
+    hvi : kthvi.Hvi
+        HVI object.
+    dig_module : Module
+        Digitizer module object.
+    config : ApplicationConfig3D
+        Configuration of the HVI program.
+    """
+    dig_registers = hvi.sync_sequence.scopes[dig_module.engine_name].registers
+
+    dig_registers[config.loop_counter_3d_name].initial_value = 0
+    dig_registers[config.step_counter_3d_name].initial_value = calc_step_counter(config.vi_3d_internal, config.vf_3d_internal, config.num_steps_3d, dV=config.dV)
+
+def initialize_awg_registers_3d(sync_block, tertiary_awg_module, config):
+    """
+    Initialize the 3D voltage register with the value taken from the FPGA memory
+    """
+    tertiary_awg_sequence = sync_block.sequences[tertiary_awg_module.engine_name]
+    voltage_channel_3d = tertiary_awg_sequence.scope.registers[config.voltage_3d_name.format(config.AWG_channel_3d)]
+
+    if not config.hardware_simulated:
+        # Read FPGA Register Voltage 3D before sweep
+        instruction_label = config.instruction_name.unique("Read FPGA Register Bank Voltage_Chx (3D)")
+        readFpgaReg = tertiary_awg_sequence.add_instruction(instruction_label, 100, tertiary_awg_sequence.instruction_set.fpga_register_read.id)
+        readFpgaReg.set_parameter(tertiary_awg_sequence.instruction_set.fpga_register_read.destination.id, voltage_channel_3d)
+        fpga_voltage_channel_name = config.fpga_voltage_chx_name.format(config.AWG_channel_3d)
+        fpga_voltage = tertiary_awg_sequence.engine.fpga_sandboxes[config.M3xxxA_sandbox].fpga_registers[fpga_voltage_channel_name]
+        readFpgaReg.set_parameter(tertiary_awg_sequence.instruction_set.fpga_register_read.fpga_register.id, fpga_voltage)
+
+def sweeper_3d(sequencer, config, awg_module: Module, dig_module: Module, secondary_awg_module: Module, tertiary_awg_module: Module):
+    """
+    This method programs the HVI sequence for a 3D voltage sweep: a stack of 2D diagrams, one for each step of the 3D voltage.
+    The 3D voltage is stepped by an outer hardware loop so the whole stack is measured without any PC round trip.
+
+    Parameters
+    ----------
+    sequencer : kthvi.Sequencer object
+        HVI sequence definition.
+    config : ApplicationConfig3D class
+        Experiment configuration.
+    awg_module : Module object
+        AWG module used for the 1D sweep.
+    dig_module : Module object
+        Digitizer module used for the measurement.
+    secondary_awg_module : Module object
+        Secondary AWG module used for the 2D sweep.
+    tertiary_awg_module : Module object
+        AWG module used for the 3D sweep.
+    """
+    dig_engine_name = dig_module.engine_name
+    tertiary_awg_engine_name = tertiary_awg_module.engine_name
+
+    # Get register values
+    tertiary_awg_registers = sequencer.sync_sequence.scopes[tertiary_awg_engine_name].registers
+    voltage_channel_3d = tertiary_awg_registers[config.voltage_3d_name.format(config.AWG_channel_3d)]
+    vi_3d = tertiary_awg_registers[config.vi_3d_name]
+    awg_loop_counter_3d = tertiary_awg_registers[config.awg_loop_counter_3d_name]
+    ramp_counter_3d = tertiary_awg_registers[config.ramp_counter_3d_name]
+    sweep_direction_3d = tertiary_awg_registers[config.sweep_direction_3d_name]
+    ramp_direction_3d = tertiary_awg_registers[config.ramp_direction_3d_name]
+
+    dig_registers = sequencer.sync_sequence.scopes[dig_engine_name].registers
+    loop_counter_3d = dig_registers[config.loop_counter_3d_name]
+    step_counter_3d = dig_registers[config.step_counter_3d_name]
+
+    ###########################################################################
+
+    # The direction of the ramp to Vi 3D is decided once before the ramp (unknown starting voltage)
+    instruction_label = config.instruction_name.unique("Ramp direction Vi 3D")
+    sync_block = sequencer.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    program_ramp_direction(sequencer, tertiary_awg_module, sync_block.sequences[tertiary_awg_engine_name], config, voltage_channel_3d, vi_3d, ramp_direction_3d)
+
+    # Start delays of the loop instructions around the step, subtracted from the wait to keep the slew rate
+    sync_while_start_delay = 320
+    sync_block_start_delay = 260
+    loop_overhead = sync_while_start_delay + sync_block_start_delay
+
+    # Configure Sync While Condition
+    sync_while_condition = kthvi.Condition.register_comparison(voltage_channel_3d, kthvi.ComparisonOperator.NOT_EQUAL_TO, vi_3d)
+    instruction_label = config.instruction_name.unique("While Voltage Chx != Vi 3D")
+    sync_while_init = sequencer.sync_sequence.add_sync_while(instruction_label, sync_while_start_delay, sync_while_condition)
+
+    # Add a sync block
+    instruction_label = config.instruction_name.unique("Go to Vi 3D")
+    sync_block = sync_while_init.sync_sequence.add_sync_multi_sequence_block(instruction_label, sync_block_start_delay)
+    program_step_to_target_voltage(sequencer, tertiary_awg_module, sync_block.sequences[tertiary_awg_engine_name], config, config.AWG_channel_3d, voltage_channel_3d, ramp_direction_3d, config.slew_rate_3d, use_dV_from_config=False, output_voltage=True, loop_overhead=loop_overhead)
+
+    # First diagram at Vi 3D
+    sweeper_2d(sequencer, config, awg_module, dig_module, secondary_awg_module, stop_QD_emulator=False)
+
+    # Configure Sync While Condition
+    sync_while_condition = kthvi.Condition.register_comparison(awg_loop_counter_3d, kthvi.ComparisonOperator.LESS_THAN, ramp_counter_3d)
+    instruction_label = config.instruction_name.unique("While AWG loop counter 3D < ramp counter 3D")
+    outer_sync_while_loop = sequencer.sync_sequence.add_sync_while(instruction_label, 320, sync_while_condition)
+
+    # Add a sync block
+    instruction_label = config.instruction_name.unique("Loop 3D")
+    sync_block = outer_sync_while_loop.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    dig_sequence = sync_block.sequences[dig_engine_name]
+
+    instruction_label = config.instruction_name.unique("LoopCounter 3D = 0")
+    instruction = dig_sequence.add_instruction(instruction_label, 10, dig_sequence.instruction_set.assign.id)
+    instruction.set_parameter(dig_sequence.instruction_set.assign.destination.id, loop_counter_3d)
+    instruction.set_parameter(dig_sequence.instruction_set.assign.source.id, 0)
+
+    # Start delays of the loop instructions around the step, subtracted from the wait to keep the slew rate
+    sync_while_start_delay = 90
+    sync_block_start_delay = 260
+    awg_loop_counter_start_delay = 10
+    loop_overhead = sync_while_start_delay + sync_block_start_delay + awg_loop_counter_start_delay
+
+    # Configure Sync While Condition
+    sync_while_condition = kthvi.Condition.register_comparison(loop_counter_3d, kthvi.ComparisonOperator.NOT_EQUAL_TO, step_counter_3d)
+    instruction_label = config.instruction_name.unique("While LoopCounter 3D < Step 3D")
+    inner_sync_while_loop = outer_sync_while_loop.sync_sequence.add_sync_while(instruction_label, sync_while_start_delay, sync_while_condition)
+
+    # Add a sync block
+    instruction_label = config.instruction_name.unique("Step voltage 3D")
+    sync_block = inner_sync_while_loop.sync_sequence.add_sync_multi_sequence_block(instruction_label, sync_block_start_delay)
+    tertiary_awg_sequence = sync_block.sequences[tertiary_awg_engine_name]
+    dig_sequence = sync_block.sequences[dig_engine_name]
+
+    program_step_to_target_voltage(sequencer, tertiary_awg_module, tertiary_awg_sequence, config, config.AWG_channel_3d, voltage_channel_3d, sweep_direction_3d, config.slew_rate_3d, use_dV_from_config=True, output_voltage=True, loop_overhead=loop_overhead)
+
+    # Increment AWG loop counter
+    instruction_label = config.instruction_name.unique("AWG loop counter 3D += 1")
+    instruction = tertiary_awg_sequence.add_instruction(instruction_label, awg_loop_counter_start_delay, tertiary_awg_sequence.instruction_set.add.id)
+    instruction.set_parameter(tertiary_awg_sequence.instruction_set.add.destination.id, awg_loop_counter_3d)
+    instruction.set_parameter(tertiary_awg_sequence.instruction_set.add.left_operand.id, awg_loop_counter_3d)
+    instruction.set_parameter(tertiary_awg_sequence.instruction_set.add.right_operand.id, 1)
+
+    instruction_label = config.instruction_name.unique("Loop Counter 3D += 1")
+    instruction = dig_sequence.add_instruction(instruction_label, 200, dig_sequence.instruction_set.add.id)
+    instruction.set_parameter(dig_sequence.instruction_set.add.destination.id, loop_counter_3d)
+    instruction.set_parameter(dig_sequence.instruction_set.add.left_operand.id, loop_counter_3d)
+    instruction.set_parameter(dig_sequence.instruction_set.add.right_operand.id, 1)
+
+    # Next diagram of the stack, the 2D sweep goes back to Vi 2D and Vi 1D by itself
+    sweeper_2d(outer_sync_while_loop, config, awg_module, dig_module, secondary_awg_module, stop_QD_emulator=False)
+
+    # Add a sync block
+    instruction_label = config.instruction_name.unique("Reset AWG loop counter 3D")
+    sync_block = sequencer.sync_sequence.add_sync_multi_sequence_block(instruction_label, 260)
+    tertiary_awg_sequence = sync_block.sequences[tertiary_awg_engine_name]
+
+    instruction_label = config.instruction_name.unique("AWG loop counter 3D = 0")
+    instruction = tertiary_awg_sequence.add_instruction(instruction_label, 10, tertiary_awg_sequence.instruction_set.assign.id)
+    instruction.set_parameter(tertiary_awg_sequence.instruction_set.assign.destination.id, awg_loop_counter_3d)
+    instruction.set_parameter(tertiary_awg_sequence.instruction_set.assign.source.id, 0)
+
+    # Stop emulator once at the end of the stack of diagrams
+    if config.use_QD_emulator and not config.hardware_simulated:
+        stop_qd_emulator(sync_block.sequences[dig_engine_name], config)
+
+def reshape_nd_data(config: ApplicationConfig3D, data: np.ndarray, is_averaged=False) -> np.ndarray:
+    """
+    Reshape the data measured by the digitizer to one axis per swept voltage.
+
+    Parameters
+    ----------
+    config : ApplicationConfig3D class
+        Experiment configuration.
+    data : np.ndarray
+        Data array returned by measure_data, one row per digitizer channel.
+    is_averaged : bool, optional
+        Specify if the data is averaged or not, by default False. If not, the last axis is the trace time.
+
+    Returns
+    -------
+    np.ndarray
+        Data array of shape (channels, num_steps_3d, num_steps_2d, num_steps_1d) or (channels, num_steps_3d, num_steps_2d, num_steps_1d, points per cycle).
+    """
+    data = np.asarray(data)
+    shape = (data.shape[0],) + config.data_shape
+    if not is_averaged:
+        shape = shape + (config.acquisition_points_per_cycle,)
+    return data.reshape(shape)
+
+def measure_data(config: ApplicationConfig3D, dig_module: Module, hvi: kthvi.Hvi, channel_list: list, max_time: float, timeout=1000, countdown=True, live_plotting=True, average_data=False, save_data=False, header="", savepath="default_Sweeper3D_datafile.txt", plan=None)-> np.ndarray:
+    """
+    Measure the data from the selected digitizer channels while the 3D sweep is running.
+    The digitizer is reconfigured between segments (see make_run_plan) since a stack of diagrams usually exceeds the size of one acquisition.
+
+    Parameters
+    ----------
+    config : ApplicationConfig3D class
+        Experiment configuration.
+    dig_module : Module object
+        Digitizer module used for the measurement.
+    hvi : kthvi.Hvi object
+        Compiled HVI sequence.
+    channel_list : list
+        List of digitizer channels to measure.
+    max_time : float
+        Maximum time allowed between two data acquisition in seconds.
+    timeout : int, optional
+        Maximum time allowed for the data acquisition in milliseconds, by default 1000.
+    countdown : bool, optional
+        Show measurement countdown in the console, by default True.
+    live_plotting : bool, optional
+        Choose whether to plot the diagram being measured or not, by default True. Only available with average_data.
+    average_data : bool, optional
+        Choose whether to average the points measured in a cycle or not, by default False.
+    save_data : bool, optional
+        Choose whether to save the data in a text file or not, by default False.
+    header : str, optional
+        Header of the text file where the data is saved, by default "".
+    savepath : str, optional
+        Path of the text file where the data is saved, by default "default_Sweeper3D_datafile.txt".
+    plan : RunPlan, optional
+        Parameters of the measurement used to configure the digitizer for the first segment (see make_run_plan), by default None to compute them from the config.
+
+    Returns
+    -------
+    np.ndarray
+        Data array from the digitizer channels, one row per channel.
+    """
+    dig_engine_name = dig_module.engine_name
+    tertiary_awg_registers = hvi.sync_sequence.scopes[config.tertiary_awg_engine_name].registers
+    voltage_channel_3d = tertiary_awg_registers[config.voltage_3d_name.format(config.AWG_channel_3d)]
+    awg_loop_counter_3d = tertiary_awg_registers[config.awg_loop_counter_3d_name]
+    ramp_counter_3d = tertiary_awg_registers[config.ramp_counter_3d_name]
+
+    dig_registers = hvi.sync_sequence.scopes[dig_engine_name].registers
+    hvi_done = dig_registers[config.hvi_done_name]
+    num_cycles_seg = dig_registers[config.num_cycles_seg_name]
+    num_cycles_since_config = dig_registers[config.num_cycles_since_config_name]
+
+    # Append header with data array shape and column names
+    header += "\nreadback numpy shape for line part: {}, {}, {}\n".format(config.num_steps_3d, config.num_steps_2d, config.num_steps_1d)
+    axes_list = ["Voltage 3D", "Voltage 2D", "Voltage 1D"]
+    if not average_data:
+        axes_list.append("Trace time")
+    for ch in channel_list:
+        axes_list.append("Digitizer Ch{}".format(ch))
+    axes_list.append("time")
+    header += "\t".join(axes_list)
+
+    # Parameters of the measurement, computed once for the acquisition loop
+    if plan is None:
+        plan = make_run_plan(config)
+    conversion_factor = plan.conversion_factor
+    cycle_points = plan.points_per_cycle
+    acquisition_points = plan.acquisition_points
+    num_steps_3d, num_steps_2d, num_steps_1d = plan.data_shape
+
+    # Axis arrays, the 3D voltage is the slowest axis
+    v3, v2, v1 = plan.axes
+    if average_data:
+        points_per_cycle = 1
+        nb_points = plan.num_cycles
+        axes_arrays = [np.repeat(v3, num_steps_2d*num_steps_1d), np.tile(np.repeat(v2, num_steps_1d), num_steps_3d), np.tile(v1, num_steps_2d*num_steps_3d)]
+        buffer = [np.array([]) for ch in channel_list]
+    else:
+        points_per_cycle = cycle_points
+        nb_points = acquisition_points
+        axes_arrays = [np.repeat(v3, num_steps_2d*num_steps_1d*points_per_cycle), np.tile(np.repeat(v2, num_steps_1d*points_per_cycle), num_steps_3d), np.tile(np.repeat(v1, points_per_cycle), num_steps_2d*num_steps_3d),
+                       np.tile(np.linspace(0, plan.integration_time, points_per_cycle), plan.num_cycles)]
+    measured_data = np.empty((len(channel_list), nb_points))
+    measured_data[:] = np.nan
+    time_array = np.empty(nb_points)
+    time_array[:] = np.nan
+    data_index = [0]*len(channel_list) # first empty slot in the measured_data array
+
+    readPoints = [0]*len(channel_list)
+    old_readPoints = [0]*len(channel_list)
+    timeout_counter = [0]*len(channel_list)
+    data_all_read = [False]*len(channel_list)
+    saved_data_index = 0
+    start_time = time.time()
+    t = 0
+    log_interval = 0.3
+    next_log = 0
+    cycles_per_segment, num_segments = plan.cycles_per_segment, plan.num_segments
+    segments_measured = 0
+    config.logger.info("Number of cycles: {}".format(plan.num_cycles))
+    config.logger.info("Cycles per segment: {}".format(cycles_per_segment))
+    config.logger.info("Number of segments: {}".format(num_segments))
+
+    stop_event = Event()
+    stop_event.clear()
+
+    live_plotting = live_plotting and average_data
+    if live_plotting:
+        # Plot the diagram being measured
+        diagram_size = num_steps_2d*num_steps_1d
+        plt.figure("Live plot 3D")
+        plt.clf() # avoid multiple colorbar
+        graph = plt.imshow(measured_data[0][:diagram_size].reshape((num_steps_2d, num_steps_1d)), extent=[config.vi_1d, config.vf_1d, config.vi_2d, config.vf_2d], aspect='auto', origin='lower')
+        plt.xlabel("Voltage Ch{} [V]".format(config.AWG_channel_1d))
+        plt.ylabel("Voltage Ch{} [V]".format(config.AWG_channel_2d))
+        cbar = plt.colorbar()
+        cbar.set_label("Signal", rotation=90)
+        plt.draw()
+
+        ax_stop = plt.axes([0.65, 0.95, 0.1, 0.04])
+        button_stop = Button(ax_stop, 'Stop')
+        def stop(event):
+            hvi.stop()
+            stop_event.set()
+        button_stop.on_clicked(stop)
+
+        colour_scale = ColourScaleTracker(percentiles=config.colour_percentiles)
+        plotted = [0, 0] # diagram shown and number of points used by the colour scale, use a list to allow the inner function to modify it
+
+        def draw_live_plot():
+            # Show the diagram of the 3D step being measured
+            diagram_index = min(data_index[0] // diagram_size, num_steps_3d-1)
+            if diagram_index != plotted[0]:
+                colour_scale.reset()
+                plotted[0] = diagram_index
+                plotted[1] = diagram_index*diagram_size
+            graph_data = measured_data[0][diagram_index*diagram_size:(diagram_index+1)*diagram_size]
+            graph.set_data(graph_data.reshape((num_steps_2d, num_steps_1d)))
+            # The colour limits are updated from the points measured since the last refresh only
+            new_points = min(data_index[0], (diagram_index+1)*diagram_size)
+            if colour_scale.update(measured_data[0][plotted[1]:new_points]):
+                graph.set_clim(*colour_scale.limits())
+            plotted[1] = new_points
+            graph.axes.set_title("Voltage Ch{} = {:.04f} V".format(config.AWG_channel_3d, v3[diagram_index]))
+            graph.figure.canvas.draw_idle()
+
+        # The plot is redrawn by a timer at a fixed rate while the acquisition loop runs in a worker thread
+        refresher = LivePlotRefresher(draw_live_plot, fps=config.live_plot_fps)
+
+    if save_data:
+        with open(savepath, "w") as f:
+            np.savetxt(f, np.array([]), header=header, comments="#") # comments="#" for compatibility with readfile from pyHegel
+
+    def acquisition_loop():
+        # Only stores the new data, the live plot is redrawn from the GUI thread
+        nonlocal t, next_log, timeout_counter, segments_measured, saved_data_index
+        while (not all(data_all_read) or hvi_done.read() == 0) and not stop_event.is_set():
+            t = time.time() - start_time
+
+            if t > next_log:
+                config.logger.debug("Voltage Ch{}: {}".format(config.AWG_channel_3d, voltage_channel_3d.read()))
+                config.logger.debug("AWG loop counter 3D: {}/{}".format(awg_loop_counter_3d.read(), ramp_counter_3d.read()))
+                for i, ch in enumerate(channel_list):
+                    config.logger.debug("{}/{} points read on ch{}".format(readPoints[i], acquisition_points, ch))
+                next_log = next_log + log_interval
+
+                for i, ch in enumerate(channel_list):
+                    if readPoints[i] == old_readPoints[i] and readPoints[i] > 0: # Check for measurement timeout only after the measurement has started
+                        timeout_counter[i] = timeout_counter[i] + 1
+                        if timeout_counter[i] > round(max_time/log_interval):
+                            config.logger.info("Timeout during measurement")
+                            stop_event.set()
+                    old_readPoints[i] = readPoints[i]
+
+            for i, ch in enumerate(channel_list):
+                ready_pts = dig_module.instrument.DAQcounterRead(ch)
+                if ready_pts > 0:
+                    timeout_counter = [0]*len(channel_list)
+                    data = dig_module.instrument.DAQread(ch, ready_pts, timeout) # return a Numpy array
+                    readPoints[i] = readPoints[i] + data.size
+                    if average_data:
+                        # Add buffer before data and average the complete cycles
+                        data = np.append(buffer[i], data)
+                        nb_filled_buffers = data.size // cycle_points
+                        buffer[i] = data[nb_filled_buffers*cycle_points:]
+                        data = np.mean(data[:nb_filled_buffers*cycle_points].reshape((nb_filled_buffers, cycle_points)), axis=1)
+                    new_index = min(data_index[i]+data.size, nb_points)
+                    measured_data[i][data_index[i]:new_index] = data[:new_index-data_index[i]]*conversion_factor
+                    if i == 0:
+                        time_array[data_index[i]:new_index] = time.time()
+                    data_index[i] = new_index
+
+                    if countdown:
+                        progress_string = "Progress: " + "|".join("ch{}={}%".format(ch_num, round(readPoints[j]/acquisition_points*100)) for j, ch_num in enumerate(channel_list))
+                        print(progress_string, end='\r')
+
+                else:
+                    # Check if a complete segment of data has been measured
+                    num_cycles_seg_read = num_cycles_seg.read()
+                    num_cycles_since_config_read = num_cycles_since_config.read()
+                    if num_cycles_since_config_read >= num_cycles_seg_read:
+                        segments_measured = segments_measured + 1
+                        config.logger.debug("Segment {} of {} measured.".format(segments_measured, num_segments))
+                        if segments_measured < num_segments:
+                            # The last segment can be shorter than the others
+                            next_segment_cycles = min(cycles_per_segment, plan.num_cycles - cycles_per_segment*segments_measured)
+                            config.logger.debug("Configuring the digitizer for the next segment of {} cycles.".format(next_segment_cycles))
+                            configure_digitizer(config, dig_module, num_cycles_override=next_segment_cycles)
+
+                        # Reset the number of cycles read since config
+                        num_cycles_since_config.write(0)
+
+                if readPoints[i] >= acquisition_points:
+                    data_all_read[i] = True
+
+            if save_data:
+                smallest_array_size = min(data_index)
+                if smallest_array_size > saved_data_index:
+                    columns = [axis_array[saved_data_index:smallest_array_size] for axis_array in axes_arrays]
+                    with open(savepath, "a") as f:
+                        np.savetxt(f, np.vstack(columns + [measured_data[:, saved_data_index:smallest_array_size], time_array[saved_data_index:smallest_array_size]]).T, comments="#") # comments="#" for compatibility with readfile from pyHegel
+                    saved_data_index = smallest_array_size
+
+    if live_plotting:
+        refresher.run(acquisition_loop)
+    else:
+        acquisition_loop()
+
+    if countdown: print("")
+    if live_plotting:
+        # Final live plot update
+        refresher.stop()
+
+    if stop_event.is_set():
+        config.logger.info("HVI execution stopped...")
+    elif hvi_done.read() == 1:
+        config.logger.info("HVI execution completed successfully!")
+    else:
+        config.logger.info("HVI execution not completed...")
+
+    for i, ch in enumerate(channel_list):
+        if readPoints[i] < acquisition_points:
+            config.logger.warning("MISSING DATA! Measured only {}/{} points on ch{}.".format(readPoints[i], acquisition_points, ch))
+    config.logger.info("Measurement done in {:.04f}s".format(t))
+
+    return measured_data
+
+#%%
+# Main Program
+######################################
+
+def prepare_hvi_sequence(sequencer: kthvi.Sequencer, config: ApplicationConfig3D, awg_module: Module, dig_module: Module, secondary_awg_module: Module, tertiary_awg_module: Module, export_sequence=False)-> kthvi.Hvi:
+    """
+    Prepare and compile the HVI sequence for the 3D sweeper. The sequence is then sent to the modules.
+
+    Parameters
+    ----------
+    sequencer : kthvi.Sequencer object
+        HVI sequence definition.
+    config : ApplicationConfig3D class
+        Experiment configuration.
+    awg_module : Module object
+        AWG module used for the 1D sweep.
+    dig_module : Module object
+        Digitizer module used for the measurement.
+    secondary_awg_module : Module object
+        Secondary AWG module used for the 2D sweep.
+    tertiary_awg_module : Module object
+        AWG module used for the 3D sweep.
+    export_sequence : bool, optional
+        Export the HVI to a text file, by default False.
+
+    Returns
+    -------
+    kthvi.Hvi object
+        Compiled HVI sequence.
+    """
+    # Define registers within the scope of the outmost sync sequence
+    define_awg_registers_1d(sequencer, awg_module, config)
+    define_dig_registers_1d(sequencer, dig_module, config)
+    define_awg_registers_2d(sequencer, awg_module, config)
+    define_dig_registers_2d(sequencer, dig_module, config)
+    define_dig_registers_3d(sequencer, dig_module, config)
+
+    instruction_label = config.instruction_name.unique("Initialize registers")
+    sync_block = sequencer.sync_sequence.add_sync_multi_sequence_block(instruction_label, 30)
+    initialize_awg_registers_1d(sync_block, awg_module, config)
+    initialize_dig_registers_1d(sync_block, dig_module, config)
+
+    if secondary_awg_module.engine_name != awg_module.engine_name:
+        define_awg_registers_1d(sequencer, secondary_awg_module, config)
+        define_awg_registers_2d(sequencer, secondary_awg_module, config)
+    initialize_awg_registers_2d(sync_block, secondary_awg_module, config)
+
+    if tertiary_awg_module.engine_name not in (awg_module.engine_name, secondary_awg_module.engine_name):
+        define_awg_registers_1d(sequencer, tertiary_awg_module, config) # ramp registers
+    define_awg_registers_3d(sequencer, tertiary_awg_module, config)
+    initialize_awg_registers_3d(sync_block, tertiary_awg_module, config)
+
+    sweeper_3d(sequencer, config, awg_module, dig_module, secondary_awg_module, tertiary_awg_module)
+    set_hvi_done(sequencer, dig_module, config)
+
+    if export_sequence:
+        # Export the programmed sequence to text
+        export_hvi_sequences(sequencer, os.path.join(os.path.dirname(os.path.realpath(__file__)), r".\Sweeper3D_KS2201A.txt"))
+
+    # Compile HVI sequences
+    try:
+        config.logger.info("Compiling HVI sequence...")
+        hvi = sequencer.compile()
+        config.logger.info('Compilation completed successfully!')
+    except kthvi.CompilationFailed:
+        config.logger.exception('Compilation failed!')
+        raise
+
+    config.logger.info("This HVI needs to reserve {} PXI trigger resources to execute".format(len(hvi.compile_status.sync_resources)))
+
+    # Load HVI to HW: load sequences, configure actions/triggers/events, lock resources, etc.
+    hvi.load_to_hw()
+    config.logger.info("HVI Loaded to HW")
+
+    return hvi
+
+def measure_stack(config: ApplicationConfig3D, module_dict: dict, hvi: kthvi.Hvi, channel_list, max_time=20, countdown=True, live_plotting=True, average_data=False, save_data=False, header="")-> np.ndarray:
+    """
+    Update the registers of the compiled HVI sequence, configure the modules and measure a stack of diagrams.
+
+    Parameters
+    ----------
+    config : ApplicationConfig3D class
+        Experiment configuration.
+    module_dict : dict
+        Dictionary of the opened modules.
+    hvi : kthvi.Hvi object
+        Compiled HVI sequence.
+    channel_list : list
+        List of channels to measure.
+    max_time : int, optional
+        Maximum time allowed between two data acquisition in seconds, by default 20.
+    countdown : bool, optional
+        Prints a countdown during the experiment, by default True.
+    live_plotting : bool, optional
+        Choose whether to plot the diagram being measured or not, by default True.
+    average_data : bool, optional
+        Choose whether to average the points measured in a cycle or not, by default False.
+    save_data : bool, optional
+        Choose whether to save the data in a text file or not, by default False.
+    header : str, optional
+        Header of the text file where the data is saved, by default "".
+
+    Returns
+    -------
+    np.ndarray
+        Data of the stack of diagrams reshaped by reshape_nd_data.
+    """
+    day_folder, filename_incr = create_save_filename(config.database_folder, config.save_filename)
+    savepath = os.path.join(day_folder, filename_incr)
+    config_savepath = os.path.join(day_folder, "{}_config.yaml".format(filename_incr[:-4]))
+    config.to_yaml(config_savepath)
+
+    awg_module = module_dict[config.main_awg_engine_name]
+    dig_module = module_dict[config.main_dig_engine_name]
+    secondary_awg_module = module_dict[config.secondary_awg_engine_name]
+    tertiary_awg_module = module_dict[config.tertiary_awg_engine_name]
+
+    update_awg_registers_1d(hvi, awg_module, config, module_dict)
+    update_dig_registers_1d(hvi, dig_module, config)
+    update_awg_registers_2d(hvi, secondary_awg_module, config, module_dict)
+    update_dig_registers_2d(hvi, dig_module, config)
+    update_awg_registers_3d(hvi, tertiary_awg_module, config)
+    update_dig_registers_3d(hvi, dig_module, config)
+
+    # Configure modules, the digitizer is configured for the first segment only
+    plan = make_run_plan(config)
+    configure_digitizer(config, dig_module, num_cycles_override=plan.cycles_per_segment)
+    for engine_name, module in module_dict.items():
+        if not isinstance(module.instrument, keysightSD1.SD_AIN):
+            configure_awg(config, module)
+
+    config.logger.info("HVI Running...")
+    hvi.run(hvi.no_wait)
+    try:
+        if not config.hardware_simulated:
+            data = measure_data(config, dig_module, hvi, channel_list, max_time, countdown=countdown, live_plotting=live_plotting, average_data=average_data, save_data=save_data, header=header, savepath=savepath, plan=plan)
+        else:
+            data = np.full((len(channel_list), plan.num_cycles if average_data else plan.acquisition_points), np.nan)
+    finally:
+        hvi.stop()
+        config.logger.info("HVI stopped")
+
+    return reshape_nd_data(config, data, is_averaged=average_data)
+
+def plot_stack(config: ApplicationConfig3D, data: np.ndarray, channel_list: list, is_averaged=False):
+    """
+    Plot the stack of diagrams, one subplot per 3D voltage.
+
+    Parameters
+    ----------
+    config : ApplicationConfig3D class
+        Experiment configuration.
+    data : np.ndarray
+        Data returned by measure_stack.
+    channel_list : list
+        List of measured channels.
+    is_averaged : bool, optional
+        Specify if the data is averaged or not, by default False.
+    """
+    if not is_averaged:
+        data = np.mean(data, axis=-1)
+    v3 = np.linspace(config.vi_3d, config.vf_3d, config.num_steps_3d)
+    nb_columns = int(np.ceil(np.sqrt(config.num_steps_3d)))
+    nb_rows = int(np.ceil(config.num_steps_3d/nb_columns))
+
+    for i, ch in enumerate(channel_list):
+        fig, axes = plt.subplots(nb_rows, nb_columns, sharex=True, sharey=True, squeeze=False, num="Digitizer channel {} (3D)".format(ch))
+        for index_3d, ax in enumerate(axes.flat):
+            if index_3d >= config.num_steps_3d:
+                ax.set_visible(False)
+                continue
+            ax.imshow(data[i][index_3d], extent=[config.vi_1d, config.vf_1d, config.vi_2d, config.vf_2d], aspect='auto', origin='lower', cmap="viridis")
+            ax.set_title("Ch{} = {:.04f} V".format(config.AWG_channel_3d, v3[index_3d]))
+        fig.supxlabel("Voltage Ch{} [V]".format(config.AWG_channel_1d))
+        fig.supylabel("Voltage Ch{} [V]".format(config.AWG_channel_2d))
+        plt.draw()
+
+def run_experiment(countdown=True):
+    """
+    Code example to measure a stack of stability diagrams.
+
+    Parameters
+    ----------
+    countdown : bool, optional
+        Prints a countdown during the experiment, by default True.
+    """
+    try:
+        # Load configuration file
+        config = ApplicationConfig3D.from_yaml(os.path.join(os.path.dirname(__file__), "experiment_config_Sweeper3D.yaml"))
+
+        # Open modules and load bitstreams
+        # Returns a dictionary of module objects whose keys are the HVI engine names
+        module_dict = open_modules(config)
+        awg_module = module_dict[config.main_awg_engine_name]
+        secondary_awg_module = module_dict[config.secondary_awg_engine_name]
+        tertiary_awg_module = module_dict[config.tertiary_awg_engine_name]
+        dig_module = module_dict[config.main_dig_engine_name]
+
+        for engine_name, module in module_dict.items():
+            if "AWG" in engine_name:
+                load_awg(config, module, reset_voltages=False)
+        load_digitizer(config, dig_module)
+
+        config.logger.info("Defining system...")
+        sequencer = define_system(config, module_dict)
+        hvi = prepare_hvi_sequence(sequencer, config, awg_module, dig_module, secondary_awg_module, tertiary_awg_module, export_sequence=True)
+
+        average = True
+        channel_list = [1]
+        data = measure_stack(config, module_dict, hvi, channel_list, max_time=config.max_time, countdown=countdown, live_plotting=True, average_data=average, save_data=True, header="test"+"\nshape=({},{},{})".format(*config.data_shape))
+        plot_stack(config, data, channel_list, is_averaged=average)
+
+    except Exception as error:
+        config.logger.exception(error)
+        # not raising, but the code stops after the finally block and the main block are executed
+
+    finally:
+        if "hvi" in globals() or "hvi" in locals():
+            if hvi.is_running():
+                hvi.stop()
+                config.logger.info("HVI stopped")
+            # Release HW resources once HVI execution is completed
+            hvi.release_hw()
+            config.logger.info("Releasing HW...")
+
+        # Close all modules at the end of the execution
+        if "module_dict" in globals() or "module_dict" in locals():
+            for engine_name in module_dict:
+                module_dict[engine_name].instrument.close()
+            config.logger.info("PXI modules closed")
+
+if __name__ == "__main__":
+    plt.ion()
+    run_experiment()
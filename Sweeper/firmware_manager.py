@@ -7,6 +7,7 @@ try:
 except ImportError:
     import keysight_hvi as kthvi
 import warnings
+import threading
 import yaml
 
 class Firmware():
@@ -220,6 +221,37 @@ class FirmwareVersionTracker():
             module.close()
             print("Module closed after module info is obtained")
 
+# Process-wide firmware catalogues, parsed once per database file and reparsed only when the file is modified
+_catalogue_cache = {} # structure: {path: (mtime, FirmwareVersionTracker)}
+_catalogue_lock = threading.Lock()
+
+def get_firmware_catalogue(yaml_file="firmware_database.yaml"):
+    """
+    Return the firmware database shared by the whole process. The YAML file is parsed on the first call
+    and the parsed database is reused until the modification time of the file changes.
+
+    Parameters
+    ----------
+    yaml_file : string, optional
+        Name of the firmware database file, relative to this file's folder. The default is "firmware_database.yaml".
+
+    Returns
+    -------
+    FirmwareVersionTracker
+        Firmware database. It is shared, so it shouldn't be modified with add_new_fw.
+    """
+    load_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), yaml_file)
+    mtime = os.path.getmtime(load_dir)
+    with _catalogue_lock: # video mode can create configs from another thread
+        cached = _catalogue_cache.get(load_dir)
+        if cached is None or cached[0] != mtime:
+            catalogue = FirmwareVersionTracker()
+            catalogue.load_database(yaml_file)
+            cached = (mtime, catalogue)
+            _catalogue_cache[load_dir] = cached
+
+    return cached[1]
+
 def get_uuid_from_k7z(k7z_file, model, chassis, slot):
     if model in ("M3100A", "M3102A"):
         module = keysightSD1.SD_AIN()
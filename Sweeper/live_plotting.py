@@ -0,0 +1,296 @@
+import time
+import threading
+import numpy as np
+try:
+    from pyqtgraph.Qt import QtCore, QtWidgets
+except ImportError:
+    from PyQt5 import QtCore, QtWidgets # can replace pyqtgraph
+
+class LivePlotRefresher:
+    """
+    Redraws a live plot at a fixed rate from a Qt timer while the acquisition loop runs in a worker thread (see run).
+    The acquisition loop only fills the data arrays, so a redraw never delays a DAQ read.
+    """
+    def __init__(self, draw, fps=10):
+        """
+        Parameters
+        ----------
+        draw : callable
+            Function without argument drawing the latest data. It reads the data arrays filled by the acquisition loop and must not modify them.
+            It is always called from the thread that created the refresher (GUI thread).
+        fps : float, optional
+            Number of refreshes per second, by default 10.
+        """
+        self.draw = draw
+        self.period = 1/fps
+        self.last_refresh = 0
+        self.num_refreshes = 0
+
+        # Without a Qt application (non-interactive matplotlib backends), the refreshes are rate-limited in run
+        self.app = QtWidgets.QApplication.instance()
+        if self.app is not None:
+            self.timer = QtCore.QTimer()
+            self.timer.timeout.connect(self.refresh)
+            self.timer.start(max(1, int(1000*self.period)))
+        else:
+            self.timer = None
+
+    def refresh(self):
+        self.draw()
+        self.last_refresh = time.time()
+        self.num_refreshes += 1
+
+    def run(self, acquire):
+        """
+        Run the acquisition loop in a worker thread and redraw the plot from this thread until the loop returns.
+
+        Parameters
+        ----------
+        acquire : callable
+            Acquisition loop without argument. It only stores the new data in the arrays read by draw.
+
+        Raises
+        ------
+        Exception
+            Any exception raised by the acquisition loop.
+        """
+        errors = []
+        def target():
+            try:
+                acquire()
+            except BaseException as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=target, name="Acquisition", daemon=True)
+        thread.start()
+        while thread.is_alive():
+            if self.timer is not None:
+                self.app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+                thread.join(0.005)
+            else:
+                if time.time() - self.last_refresh >= self.period:
+                    self.refresh()
+                thread.join(self.period)
+
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        "Stops the timer and draws the final data."
+        if self.timer is not None:
+            self.timer.stop()
+        self.refresh()
+        if self.app is not None:
+            self.app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+
+class BlittedLine:
+    "Line of a matplotlib live plot redrawn with blitting. The axes background is cached and the figure is only redrawn when the data leaves the y limits, the x limits are set by the caller."
+    def __init__(self, ax, line, margin=0.1):
+        """
+        Parameters
+        ----------
+        ax : matplotlib.axes.Axes
+            Axes of the line.
+        line : matplotlib.lines.Line2D
+            Line updated with the live data.
+        margin : float, optional
+            Fraction of the data range added on each side when the y limits are extended, by default 0.1.
+        """
+        self.ax = ax
+        self.line = line
+        self.canvas = ax.figure.canvas
+        self.margin = margin
+        self.autoscale = True # extend the y limits when the data leaves them
+        self.limits_set = False # the first data sets the y limits
+        self.background = None
+        self.line.set_animated(True) # drawn by the blitting only
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        # The background changes after each full redraw (resize, new limits, buttons)
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
+
+    def set_data(self, x, y):
+        self.line.set_data(x, y)
+        if self.autoscale and len(y) > 0 and self.extend_limits(y):
+            self.canvas.draw_idle()
+        elif self.background is None or not self.canvas.supports_blit:
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.line)
+            self.canvas.blit(self.ax.bbox)
+
+    def extend_limits(self, y):
+        "Extends the y limits to the data with a margin. Returns True if the limits changed."
+        low, high = np.nanmin(y), np.nanmax(y)
+        if not (np.isfinite(low) and np.isfinite(high)):
+            return False
+        lim_low, lim_high = self.ax.get_ylim()
+        if self.limits_set:
+            if lim_low <= low and high <= lim_high:
+                return False
+            low, high = min(low, lim_low), max(high, lim_high)
+
+        span = max(high - low, abs(high)*1e-3, 1e-12)*self.margin
+        self.ax.set_ylim(low - span, high + span)
+        self.limits_set = True
+        return True
+
+class ColourScaleTracker:
+    "Colour limits of a live image updated from the newly written pixels only. The limits are the running min/max or percentiles of a streaming histogram."
+    def __init__(self, percentiles=None, num_bins=1024):
+        """
+        Parameters
+        ----------
+        percentiles : tuple of float, optional
+            Lower and upper percentiles used as colour limits, for example (1, 99), by default None. If None, the running min/max are used.
+        num_bins : int, optional
+            Number of bins of the streaming histogram, by default 1024. Must be even since the bins are merged by pairs when the range grows.
+        """
+        if num_bins % 2 != 0:
+            raise ValueError("The number of bins must be even, not {}.".format(num_bins))
+        self.percentiles = percentiles
+        self.num_bins = num_bins
+        self.reset()
+
+    def reset(self):
+        "Forgets the previous pixels, for example when the image is moved to a new window"
+        self.vmin = None
+        self.vmax = None
+        self.counts = np.zeros(self.num_bins, dtype=np.int64)
+        self.range = None # (low, high) edges of the histogram
+
+    def update(self, new_values) -> bool:
+        """
+        Adds the newly written pixels.
+
+        Parameters
+        ----------
+        new_values : np.ndarray
+            Pixels written since the last update. NaNs are ignored.
+
+        Returns
+        -------
+        bool
+            True if the colour limits may have changed.
+        """
+        values = np.ravel(new_values)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return False
+        low, high = values.min(), values.max()
+
+        changed = self.vmin is None or low < self.vmin or high > self.vmax
+        if changed:
+            self.vmin = low if self.vmin is None else min(low, self.vmin)
+            self.vmax = high if self.vmax is None else max(high, self.vmax)
+
+        if self.percentiles is not None:
+            self.grow_histogram(low, high)
+            self.counts += np.histogram(values, bins=self.num_bins, range=self.range)[0]
+            changed = True # a percentile can move with any new pixel
+        return changed
+
+    def grow_histogram(self, low, high):
+        # The range is doubled until it contains the new values, merging the bins by pairs keeps the previous counts
+        if self.range is None:
+            span = max(high - low, abs(high)*1e-6, 1e-12)
+            self.range = (low, low + span)
+            return
+        range_low, range_high = self.range
+        while low < range_low or high > range_high:
+            span = range_high - range_low
+            if low < range_low:
+                merged = np.concatenate((np.zeros(self.num_bins, dtype=np.int64), self.counts))
+                range_low = range_low - span
+            else:
+                merged = np.concatenate((self.counts, np.zeros(self.num_bins, dtype=np.int64)))
+                range_high = range_high + span
+            self.counts = merged.reshape((self.num_bins, 2)).sum(axis=1)
+        self.range = (range_low, range_high)
+
+    def limits(self):
+        """
+        Returns
+        -------
+        tuple of float or None
+            (vmin, vmax) colour limits, None if no pixel was added.
+        """
+        if self.vmin is None:
+            return None
+        if self.percentiles is None:
+            return (self.vmin, self.vmax)
+
+        cumulative_counts = np.cumsum(self.counts)
+        edges = np.linspace(self.range[0], self.range[1], self.num_bins+1)
+        low_bin = np.searchsorted(cumulative_counts, cumulative_counts[-1]*self.percentiles[0]/100)
+        high_bin = np.searchsorted(cumulative_counts, cumulative_counts[-1]*self.percentiles[1]/100)
+        return (max(edges[low_bin], self.vmin), min(edges[min(high_bin+1, self.num_bins)], self.vmax))
+
+class MinMaxDecimator:
+    "Screen-resolution view of a long trace filled in order. Each bucket of consecutive points is drawn by its min and max so the peaks stay visible."
+    def __init__(self, num_points, num_buckets=2000):
+        """
+        Parameters
+        ----------
+        num_points : int
+            Number of points of the full trace.
+        num_buckets : int, optional
+            Maximum number of buckets of the view, by default 2000. The view has two points per bucket, about the width of a plot in pixels.
+        """
+        self.num_points = num_points
+        self.bucket_size = max(1, int(np.ceil(num_points/num_buckets)))
+        self.num_buckets = int(np.ceil(num_points/self.bucket_size))
+        self.complete_buckets = 0 # buckets whose points are all measured
+        self.filled_buckets = 0 # buckets with at least one point measured
+
+        # View buffers, each bucket is drawn at the index of its first point
+        self.view_index = np.repeat(np.arange(self.num_buckets)*self.bucket_size, 2)
+        self.view_values = np.full(2*self.num_buckets, np.nan)
+
+    def update(self, data, num_written):
+        """
+        Adds the points written since the last update. Only the new points and the last incomplete bucket are read.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Full trace being filled.
+        num_written : int
+            Number of points written at the start of data.
+        """
+        bucket_size = self.bucket_size
+        first = self.complete_buckets
+        last = min(num_written, self.num_points)//bucket_size # complete buckets of full size
+        if last > first:
+            blocks = data[first*bucket_size:last*bucket_size].reshape((last - first, bucket_size))
+            self.view_values[2*first:2*last:2] = np.min(blocks, axis=1)
+            self.view_values[2*first+1:2*last:2] = np.max(blocks, axis=1)
+            self.complete_buckets = last
+
+        # Last bucket, incomplete or shorter than the others
+        start = self.complete_buckets*bucket_size
+        if start < num_written and self.complete_buckets < self.num_buckets:
+            partial = data[start:num_written]
+            self.view_values[2*self.complete_buckets] = np.min(partial)
+            self.view_values[2*self.complete_buckets+1] = np.max(partial)
+            if num_written >= self.num_points:
+                self.complete_buckets += 1
+                self.filled_buckets = self.complete_buckets
+            else:
+                self.filled_buckets = self.complete_buckets + 1
+        else:
+            self.filled_buckets = self.complete_buckets
+
+    def view(self):
+        """
+        Returns
+        -------
+        index : np.ndarray
+            Index in the full trace of each point of the view.
+        values : np.ndarray
+            Min and max of each bucket measured so far, interleaved.
+        """
+        return self.view_index[:2*self.filled_buckets], self.view_values[:2*self.filled_buckets]
@@ -0,0 +1,114 @@
+import numpy as np
+
+def split_point_table(points, dV=45.7778e-6, HZ=True):
+    """
+    Splits a table of voltages into runs of evenly spaced voltages that can each be measured by a linear hardware sweep.
+    Non-uniform, sparse or adaptive tables are measured with a few linear sweeps instead of a dense uniform grid.
+
+    Parameters
+    ----------
+    points : array_like
+        Voltages to measure [V]. The order doesn't matter and duplicates are measured once.
+    dV : float, optional
+        Voltage increment of the AWG used by the HVI sweeps, by default 45.7778e-6.
+    HZ : bool, optional
+        The AWG is outputting twice the voltage on high impedance loads, by default True.
+
+    Returns
+    -------
+    list of tuple
+        One (vi, vf, num_steps, indices) tuple per run, where indices are the positions of the run's voltages in points.
+
+    Raises
+    ------
+    ValueError
+        If two voltages of the table are closer than the smallest voltage step of the AWG.
+    """
+    points = np.asarray(points, dtype=float).flatten()
+    if points.size == 0:
+        return []
+
+    min_step = 2*dV if HZ else dV # smallest voltage step seen at the output
+    values, inverse = np.unique(points, return_inverse=True)
+    if values.size > 1 and np.min(np.diff(values)) < min_step:
+        raise ValueError("Voltages of the table must be at least {} V apart.".format(min_step))
+
+    # Greedily extend each run while the voltage step stays the same (within one AWG step)
+    runs = []
+    start = 0
+    while start < values.size:
+        end = start + 1
+        if end < values.size:
+            step = values[end] - values[start]
+            while end + 1 < values.size and abs((values[end+1] - values[end]) - step) < min_step/2:
+                end += 1
+        else:
+            end = start
+        indices = [np.flatnonzero(inverse == i) for i in range(start, end+1)]
+        runs.append((values[start], values[end], end-start+1, indices))
+        start = end + 1
+
+    return runs
+
+def split_point_list_2d(points_2d, dV=45.7778e-6, HZ=True):
+    """
+    Splits a list of 2D points into lines of constant 2D voltage and each line into runs of evenly spaced 1D voltages.
+
+    Parameters
+    ----------
+    points_2d : array_like
+        Array of shape (N, 2) with the 1D and 2D voltages of each point [V].
+    dV : float, optional
+        Voltage increment of the AWG used by the HVI sweeps, by default 45.7778e-6.
+    HZ : bool, optional
+        The AWG is outputting twice the voltage on high impedance loads, by default True.
+
+    Returns
+    -------
+    list of tuple
+        One (vi_1d, vf_1d, num_steps_1d, v_2d, indices) tuple per run, where indices are the positions of the run's points in points_2d.
+    """
+    points_2d = np.asarray(points_2d, dtype=float).reshape((-1, 2))
+
+    runs = []
+    for v_2d in np.unique(points_2d[:, 1]):
+        line_indices = np.flatnonzero(points_2d[:, 1] == v_2d)
+        for vi_1d, vf_1d, num_steps_1d, indices in split_point_table(points_2d[line_indices, 0], dV=dV, HZ=HZ):
+            runs.append((vi_1d, vf_1d, num_steps_1d, v_2d, [line_indices[index] for index in indices]))
+
+    return runs
+
+def sweep_voltages(vi, vf, num_steps, dV=45.7778e-6, HZ=True):
+    """
+    Voltages output by a linear hardware sweep. The HVI steps by a whole number of AWG increments (see calc_sweep_counters),
+    so the voltages after vi can be slightly off the evenly spaced voltages between vi and vf.
+
+    Parameters
+    ----------
+    vi : float
+        Initial voltage [V].
+    vf : float
+        Final voltage [V].
+    num_steps : int
+        Number of measured voltages, including vi and vf.
+    dV : float, optional
+        Voltage increment of the AWG used by the HVI sweeps, by default 45.7778e-6.
+    HZ : bool, optional
+        The AWG is outputting twice the voltage on high impedance loads, by default True.
+
+    Returns
+    -------
+    np.ndarray
+        The num_steps voltages of the sweep [V].
+    """
+    if num_steps < 2:
+        return np.array([vi], dtype=float)
+    scale = 2 if HZ else 1
+    step_counter = int(abs(vf - vi)/scale/(num_steps - 1)/dV)
+    return vi + np.sign(vf - vi)*np.arange(num_steps)*step_counter*dV*scale
+
+if __name__ == "__main__":
+    # Example usage: dense sampling around 0.5 V, coarse sampling elsewhere
+    table = np.concatenate((np.linspace(0, 0.4, 5), np.linspace(0.45, 0.55, 11), np.linspace(0.6, 1, 5)))
+    for vi, vf, num_steps, indices in split_point_table(table):
+        print("{:.4f} V to {:.4f} V in {} steps".format(vi, vf, num_steps))
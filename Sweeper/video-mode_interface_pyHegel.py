@@ -1,99 +1,217 @@
 import sys
 import os
-from PyQt5.QtWidgets import QMainWindow, QApplication, QVBoxLayout
-from PyQt5.QtCore import QTimer, pyqtSignal, QThread
-from PyQt5.QtGui import QCloseEvent
+from PyQt5.QtWidgets import QMainWindow, QApplication, QVBoxLayout, QShortcut
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QThread
+from PyQt5.QtGui import QCloseEvent, QKeySequence
 from PyQt5 import uic
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import matplotlib.pyplot as plt
 import numpy as np
+try:
+    import pyqtgraph as pqt
+    from pyqtgraph.Qt import QtCore
+    PYQTGRAPH_INSTALLED = True
+except ImportError:
+    PYQTGRAPH_INSTALLED = False
 from Video_mode_UI.ui.video_mode_interface import Ui_MainWindow  # Import .py file generated by pyuic5
 from time import sleep, time
-from Sweeper2D_KS2201A import ApplicationConfig2D, prepare_first_diagram, measure_diagram
+from Sweeper2D_KS2201A import ApplicationConfig2D, prepare_first_diagram
+from video_mode_lib import VideoModeSession, FrameParameters, ParameterSnapshots, FrameQueue, TileCache, SessionRecorder, FrameTelemetry, make_averaging_policy, make_processing_chain
+from file_save_system import create_save_filename
+from live_plotting import ColourScaleTracker
 from KS2201A_lib import  open_modules, load_awg, load_digitizer, initialize_logging, stop_logging, release_all_modules, set_voltages_to_zero, update_vg_registers, send_CC_matrix
 import datetime
+import queue
 
 class WorkerThread(QThread):
-    sig_instrument = pyqtSignal(np.ndarray)
-
+    "Acquisition stage of the video mode: measures the frames back to back and passes them to the processing stage"
     def __init__(self, main_window, parent=None):
         super(WorkerThread, self).__init__(parent)
         self.main_window = main_window
         self.is_stopped = False
-        self.timeout = 40 # emulator can't run forever
         self.simulation_start_time = time()
+        self.abort_frame = False # stop the frame being measured, set by the UI
 
     def stop(self):
         self.is_stopped = True
 
+    def send_lines(self, data, lines_completed):
+        "Passes the lines measured so far to the processing stage. Returns True to stop the frame."
+        num_steps_1d = self.main_window.config.num_steps_1d
+        self.main_window.line_queue.put((self.frame_index, self.parameters.window, data[0].reshape((lines_completed, num_steps_1d)).copy()))
+
+        # The rest of the frame is wasted if the window was moved since the start of the frame
+        latest = self.main_window.snapshots.latest()
+        if latest.version != self.parameters.version and latest.window != self.parameters.window:
+            self.abort_frame = True
+        return self.abort_frame or self.is_stopped
+
     def run(self):
-        while True and not self.is_stopped and (time()-self.simulation_start_time) < self.timeout:
-            self.main_window.config.logger.info("loop time: {:.01f}".format(time()-self.simulation_start_time))
+        # The QD emulator stalls after running for a while (time related rather than the number of points measured, not measured yet),
+        # so the session is stopped after session_timeout seconds (None to run until stopped, e.g. without the emulator)
+        timeout = self.main_window.session_timeout
+        while not self.is_stopped and (timeout is None or (time()-self.simulation_start_time) < timeout):
+            self.main_window.config.logger.debug("loop time: {:.01f}".format(time()-self.simulation_start_time))
             start_time = time()
-            self.main_window.on_sweep_step_changed()
-            self.main_window.on_gate_step_changed()
-            self.main_window.on_zoom_step_changed()
 
-            # Check if vi, vf or gate changed
-            if (self.main_window.config.vi_1d != self.main_window.old_vi_1d) or (self.main_window.config.vf_1d != self.main_window.old_vf_1d) or (self.main_window.config.vi_2d != self.main_window.old_vi_2d) or (self.main_window.config.vf_2d != self.main_window.old_vf_2d) or (self.main_window.gate_value != self.main_window.old_gate_value):
-                self.main_window.average_number = 0
-                self.main_window.old_vi_1d = self.main_window.config.vi_1d
-                self.main_window.old_vf_1d = self.main_window.config.vf_1d
-                self.main_window.old_vi_2d = self.main_window.config.vi_2d
-                self.main_window.old_vf_2d = self.main_window.config.vf_2d
-                self.main_window.old_gate_value = self.main_window.gate_value
-      
-            header = self.main_window.header + "\n" + str(self.main_window.config) + "\n" + "Average number: {}".format(self.main_window.average_number+1)
-            data = self.main_window.measure_func(self.main_window.config, self.main_window.module_dict, self.main_window.hvi, self.main_window.config.DAQ_channels_list, self.main_window.max_time, self.main_window.countdown, self.main_window.live_plotting, self.main_window.average_data, self.main_window.nb_averaging, self.main_window.save_data, header)
-            
-            if self.main_window.average_number == 0:
-                data_sum = data
+            # Consistent window for the whole frame, the UI only publishes new snapshots
+            self.frame_index = self.main_window.session.frame_index
+            self.parameters = self.main_window.snapshots.latest()
+            self.parameters.apply(self.main_window.config)
+            shape = (self.main_window.config.num_steps_2d, self.main_window.config.num_steps_1d)
+
+            header = self.main_window.header + "\n" + str(self.main_window.config) + "\n" + "Frame number: {}".format(self.main_window.session.frame_index+1)
+            data = self.main_window.session.measure_frame(header, line_callback=self.send_lines)
+            if data is None:
+                break # the HVI was released after an error
+
+            if self.abort_frame:
+                self.abort_frame = False
+                self.main_window.config.logger.info("Frame {} aborted".format(self.frame_index))
             else:
-                data_sum = data_sum + data
-
-            self.main_window.average_number += 1
-            self.main_window.averageLabel.setText("Average: {}".format(self.main_window.average_number))
-            averaged_data = (data_sum.reshape((self.main_window.config.num_steps_2d, self.main_window.config.num_steps_1d))/self.main_window.average_number)
-            averaged_data = (np.gradient(averaged_data, axis=1) + np.gradient(averaged_data, axis=0))/2
-            self.sig_instrument.emit(averaged_data)
-            
+                # The next frame is started while this one is reduced and rendered
+                self.main_window.frame_queue.put((self.frame_index, time(), self.parameters.window, data.reshape(shape)))
+
+            # Optional frame rate limit, by default the next frame is started right away
             execution_time = time() - start_time
-            min_frame_time = 0.5
+            min_frame_time = self.main_window.min_frame_time
             if execution_time < min_frame_time:
                 sleep(min_frame_time - execution_time)
+                self.main_window.telemetry.record(self.frame_index, "sleep", min_frame_time - execution_time)
 
-        if time()-self.simulation_start_time >= self.timeout:
+        if timeout is not None and time()-self.simulation_start_time >= timeout:
             self.main_window.config.logger.info("Timeout reached. Stopping the simulation...")
-                
-                
+
+class ProcessingThread(QThread):
+    "Processing stage of the video mode: averages the measured frames and sends them to the UI with the partial frames of the frame being measured"
+    sig_instrument = pyqtSignal(int, int, np.ndarray) # index of the frame measured, number of frames averaged, processed frame
+
+    def __init__(self, main_window, parent=None):
+        super(ProcessingThread, self).__init__(parent)
+        self.main_window = main_window
+        self.is_stopped = False
+        self.average_number = 0
+        self.averaging = main_window.averaging
+        self.processing = make_processing_chain(main_window.processing_steps)
+        self.render_pending = False # the UI hasn't drawn the last frame yet
+        self.dropped_frames = 0 # frames not rendered because the UI was busy
+
+    def stop(self):
+        self.is_stopped = True
+
+    def send_frame(self, frame_index, data):
+        if self.render_pending:
+            return False # the UI is behind, it will draw a later frame
+        self.render_pending = True
+        self.sig_instrument.emit(frame_index, self.average_number, self.processing.apply(data).copy()) # the buffers are reused by the next frame
+        return True
+
+    def set_window(self, window):
+        "Restarts the averaging for a new window, seeded with the data already measured in this window"
+        shape = (self.main_window.config.num_steps_2d, self.main_window.config.num_steps_1d)
+        self.averaging.reset(*self.main_window.tile_cache.lookup(window, shape))
+        self.window = window
+        self.average_number = 0
+
+    def send_cached_window(self, window):
+        "Sends the data already measured in the window the UI moved to, before its next frame is measured"
+        shape = (self.main_window.config.num_steps_2d, self.main_window.config.num_steps_1d)
+        data, counts = self.main_window.tile_cache.lookup(window, shape)
+        if np.any(counts > 0):
+            self.send_frame(-1, data) # not a measured frame
+
+    def send_partial_frame(self, frame_index, window, lines):
+        # New lines are overlaid on the average of the previous frames
+        if window != self.window:
+            self.set_window(window)
+        self.send_frame(frame_index, self.averaging.preview(lines))
+
+    def run(self):
+        self.window = None
+        last_frame_index = -1
+        while not self.is_stopped:
+            try:
+                frame_index, timestamp, window, data = self.main_window.frame_queue.get(timeout=0.05)
+            except queue.Empty:
+                # Show the data known in the window the UI moved to
+                try:
+                    self.send_cached_window(self.main_window.window_queue.get(timeout=0))
+                except queue.Empty:
+                    pass
+                # Show the progress of the frame being measured
+                try:
+                    frame_index, window, lines = self.main_window.line_queue.get(timeout=0)
+                    if frame_index > last_frame_index: # lines of a frame already received are ignored
+                        self.send_partial_frame(frame_index, window, lines)
+                except queue.Empty:
+                    pass
+                continue
+            last_frame_index = frame_index
+            start_time = time()
+
+            # Check if vi, vf or gate changed
+            if window != self.window:
+                self.set_window(window)
+
+            self.averaging.add(data, timestamp)
+            self.average_number = self.averaging.num_frames
+
+            averaged_data = self.averaging.average()
+            self.main_window.tile_cache.store(window, averaged_data, self.averaging.counts)
+            if self.main_window.recorder is not None:
+                self.main_window.recorder.record(frame_index, timestamp, window, data, averaged_data)
+            if not self.send_frame(frame_index, averaged_data):
+                self.dropped_frames += 1
+            self.main_window.telemetry.record(frame_index, "reduction", time() - start_time)
+            self.main_window.telemetry.frame_done(frame_index)
 
 class MainWindow(QMainWindow, Ui_MainWindow):
-    def __init__(self, measure_func, config, module_dict, hvi, max_time=20, countdown=False, live_plotting=False, average_data=True, nb_averaging=1, save_data=False, database_folder=r"Data_HVI", save_filename="Sweeper2D_video_{}".format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")), header="", parent=None):
+    def __init__(self, config, module_dict, hvi, max_time=20, save_data=False, database_folder=r"Data_HVI", save_filename="Sweeper2D_video_{}".format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")), header="", plot_pyqtgraph=True, max_fps=20, averaging="cumulative", time_constant=5, num_frames=10, record_session=False, processing_steps=("gradient",), telemetry_file=None, auto_levels=False, level_percentiles=None, session_timeout=40, min_frame_time=0, parent=None):
         super(MainWindow, self).__init__(parent)
         ui_path = r"Video_mode_UI\ui\video_mode_ui.ui"
         uic.loadUi(ui_path, self)
 
         # Define initial parameters
-        self.measure_func = measure_func
         self.config = config
         self.module_dict = module_dict
         self.hvi = hvi
         self.max_time = max_time
-        self.countdown = countdown
-        self.live_plotting = live_plotting
-        self.average_data = average_data
-        self.nb_averaging = nb_averaging
         self.save_data = save_data
         self.database_folder = database_folder
         self.save_filename = save_filename
         self.header = header
+        self.averaging = make_averaging_policy(averaging, time_constant=time_constant, num_frames=num_frames)
+        self.processing_steps = processing_steps
+
+        # Files and modules are set up once for the whole session
+        self.config.database_folder = database_folder
+        self.config.save_filename = save_filename
+        self.telemetry = FrameTelemetry()
+        self.telemetry_file = telemetry_file # the telemetry is saved in this text file when the video mode is stopped
+        self.session_timeout = session_timeout # [s] emulator can't run forever, None to run until the video mode is stopped
+        self.min_frame_time = min_frame_time # [s] the acquisition thread sleeps after frames shorter than this
+        self.session = VideoModeSession(config, module_dict, hvi, config.DAQ_channels_list, max_time=max_time, save_data=save_data, telemetry=self.telemetry)
+
+        # All the frames of the session are recorded in one binary file, see read_session to replay it
+        if record_session:
+            day_folder, filename_incr = create_save_filename(database_folder, save_filename)
+            self.recorder = SessionRecorder(os.path.join(day_folder, "{}_session.bin".format(filename_incr[:-4])))
+            config.logger.info("Recording the session in {}".format(self.recorder.path))
+        else:
+            self.recorder = None
 
-        self.figure = Figure()
-        self.canvas = FigureCanvas(self.figure)  # create canvas to plot on
-
+        # pyqtgraph updates the image texture without redrawing the whole figure like matplotlib
+        self.plot_pyqtgraph = plot_pyqtgraph and PYQTGRAPH_INSTALLED
         self.layout = QVBoxLayout(self.plotWidget)
-        self.layout.addWidget(self.canvas) # add canvas to layout
+        if self.plot_pyqtgraph:
+            pqt.setConfigOptions(imageAxisOrder='row-major')
+            self.graph_widget = pqt.GraphicsLayoutWidget()
+            self.layout.addWidget(self.graph_widget) # add graph to layout
+        else:
+            self.figure = Figure()
+            self.canvas = FigureCanvas(self.figure)  # create canvas to plot on
+            self.layout.addWidget(self.canvas) # add canvas to layout
 
         # Buttons
         self.leftButton.clicked.connect(self.left)
@@ -105,6 +223,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.zoom_inButton.clicked.connect(self.zoom_in)
         self.zoom_outButton.clicked.connect(self.zoom_out)
         self.stopButton.clicked.connect(self.stop)
+        self.abort_shortcut = QShortcut(QKeySequence(Qt.Key_Escape), self)
+        self.abort_shortcut.activated.connect(self.abort_frame)
+        self.sweep_stepLine.editingFinished.connect(self.on_sweep_step_changed)
+        self.gate_stepLine.editingFinished.connect(self.on_gate_step_changed)
+        self.zoom_stepLine.editingFinished.connect(self.on_zoom_step_changed)
 
         # Steps
         self.sweep_step = 0.01
@@ -113,61 +236,126 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.gate_stepLine.setText(str(self.gate_step))
         self.zoom_step = 0.01
         self.zoom_stepLine.setText(str(self.zoom_step))
-        self.gate_value = 0.0
 
-        # Save copy of the initial config
-        self.old_vi_1d = self.config.vi_1d
-        self.old_vf_1d = self.config.vf_1d
-        self.old_vi_2d = self.config.vi_2d
-        self.old_vf_2d = self.config.vf_2d
-        self.old_gate_value = self.gate_value
+        # The window is only changed by publishing new snapshots, the config is written by the acquisition thread
+        self.snapshots = ParameterSnapshots(FrameParameters(0, self.config.vi_1d, self.config.vf_1d, self.config.vi_2d, self.config.vf_2d, 0.0))
 
         # Average label
-        self.average_number = 0
-        self.averageLabel.setText("Average: {}".format(self.average_number))
+        self.averageLabel.setText("Average: 0")
 
-        self.ax = self.figure.add_subplot(111)
         z = np.empty((self.config.num_steps_2d, self.config.num_steps_1d))
         z[:] = np.nan
-
-        self.im = self.ax.imshow(z, cmap='viridis', extent=[self.config.vi_1d, self.config.vf_1d, self.config.vi_2d, self.config.vf_2d], aspect='auto', origin='lower')
-        self.cbar = self.figure.colorbar(self.im)
-        self.cbar.set_label("Signal (a.u.)")
         if self.config.use_virtual_gates:
-            self.im.set_clim(0, 0.06)
+            self.levels = (0, 0.06)
         else:
-            self.im.set_clim(0, 0.12)
-        self.ax.set_xlabel('Vg1 (V)')
-        self.ax.set_ylabel('Vg2 (V)')
-        self.figure.subplots_adjust(left=0.15)  # adjust the left spacing
-
-        self.min_data = None
-        self.max_data = None
-
-        self.canvas.draw()
-
+            self.levels = (0, 0.12)
+
+        if self.plot_pyqtgraph:
+            self.plot_item = self.graph_widget.addPlot(title="")
+            self.plot_item.setLabel('bottom', 'Vg1 (V)')
+            self.plot_item.setLabel('left', 'Vg2 (V)')
+            self.im = pqt.ImageItem()
+            self.plot_item.addItem(self.im)
+            self.im.setImage(z, autoLevels=False, levels=self.levels)
+            self.hist = pqt.HistogramLUTItem()
+            self.hist.setImageItem(self.im)
+            self.hist.gradient.loadPreset('viridis')
+            self.graph_widget.addItem(self.hist)
+        else:
+            self.ax = self.figure.add_subplot(111)
+            self.im = self.ax.imshow(z, cmap='viridis', aspect='auto', origin='lower')
+            self.cbar = self.figure.colorbar(self.im)
+            self.cbar.set_label("Signal (a.u.)")
+            self.ax.set_xlabel('Vg1 (V)')
+            self.ax.set_ylabel('Vg2 (V)')
+            self.figure.subplots_adjust(left=0.15)  # adjust the left spacing
+        self.set_levels(*self.levels)
+        self.update_extent()
+
+        # With auto_levels, the colour limits follow the frames measured in the current window
+        self.auto_levels = auto_levels
+        self.colour_scale = ColourScaleTracker(percentiles=level_percentiles)
+
+        # The frames are drawn at most max_fps times per second, whatever the acquisition rate
+        self.latest_frame = None # frame received but not drawn yet
+        self.skipped_frames = 0 # frames replaced by a newer one before being drawn
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.render_frame)
+        self.refresh_timer.start(int(1000/max_fps))
+
+        # Acquisition and processing stages, the processing of a frame overlaps the acquisition of the next one
+        self.frame_queue = FrameQueue(maxsize=2)
+        self.line_queue = FrameQueue(maxsize=1) # only the latest lines of the frame being measured are shown
+        self.window_queue = FrameQueue(maxsize=1) # only the latest window moved to is shown from the cache
+        self.tile_cache = TileCache()
+        self.processing_thread = ProcessingThread(self)
+        self.processing_thread.sig_instrument.connect(self.plot_data)
+        self.processing_thread.start()
         self.thread = WorkerThread(self)
-        self.thread.sig_instrument.connect(self.plot_data)
         self.thread.start() # run function is called
 
         self.show()
 
-    def plot_data(self, data):
-        self.im.set_data(data)
-        if self.min_data is None:
-            self.min_data = np.nanmin(data)
-        if self.max_data is None:
-            self.max_data = np.nanmax(data)
-        if np.nanmin(data) < self.min_data:
-            self.min_data = np.nanmin(data)
-        if np.nanmax(data) > self.max_data:
-            self.max_data = np.nanmax(data)
+    def plot_data(self, frame_index, average_number, data):
+        # Only keep the latest frame, it is drawn by the refresh timer
+        if self.latest_frame is not None:
+            self.skipped_frames += 1
+        self.latest_frame = (frame_index, average_number, data)
+        self.processing_thread.render_pending = False
+
+    def render_frame(self):
+        if self.latest_frame is None:
+            return
+        frame_index, average_number, data = self.latest_frame
+        self.latest_frame = None
+        start_time = time()
+
+        if frame_index >= 0:
+            self.averageLabel.setText("Average: {}".format(average_number))
+        if self.plot_pyqtgraph:
+            self.im.setImage(data, autoLevels=False, levels=self.levels)
+        else:
+            self.im.set_data(data)
+        if self.auto_levels and self.colour_scale.update(data):
+            self.set_levels(*self.colour_scale.limits())
+
+        if not self.plot_pyqtgraph:
+            self.canvas.draw_idle()
 
-        if self.config.use_virtual_gates:
-            self.im.set_clim(0, 0.06)
+        if frame_index >= 0:
+            self.telemetry.record(frame_index, "render", time() - start_time)
+        self.statusbar.showMessage(self.telemetry.status_message(self.get_dropped_frames()))
+
+    def get_dropped_frames(self):
+        return self.frame_queue.dropped_frames + self.processing_thread.dropped_frames + self.skipped_frames
+
+    def export_telemetry(self):
+        if self.telemetry_file is not None:
+            self.telemetry.export(self.telemetry_file, self.get_dropped_frames())
+            self.config.logger.info("Telemetry saved in {}".format(self.telemetry_file))
+
+
+    def show_cached_window(self):
+        "Asks the processing thread to draw the data already measured in the current window, before the next frame is measured"
+        self.window_queue.put(self.snapshots.latest().window)
+
+    def set_levels(self, vmin, vmax):
+        "Changes the colour levels of the image without rebuilding the figure"
+        self.levels = (vmin, vmax)
+        if self.plot_pyqtgraph:
+            self.hist.setLevels(vmin, vmax)
+        else:
+            self.im.set_clim(vmin, vmax)
+            self.canvas.draw_idle()
+
+    def update_extent(self):
+        "Moves the image to the window currently in the config"
+        parameters = self.snapshots.latest()
+        if self.plot_pyqtgraph:
+            self.im.setRect(QtCore.QRectF(parameters.vi_1d, parameters.vi_2d, parameters.vf_1d-parameters.vi_1d, parameters.vf_2d-parameters.vi_2d))
         else:
-            self.im.set_clim(0, 0.12)
-        self.canvas.draw()
+            self.im.set_extent([parameters.vi_1d, parameters.vf_1d, parameters.vi_2d, parameters.vf_2d])
+            self.canvas.draw_idle()
     
     def on_sweep_step_changed(self):
         new_sweep_step = self.sweep_stepLine.text()
@@ -208,68 +396,79 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     def get_zoom_step(self):
         return self.zoom_step
     
+    def move_window(self, **changes):
+        "Publishes the new window for the next frame and shows the data already known in it"
+        self.snapshots.publish(**changes)
+        self.colour_scale.reset()
+        self.update_extent()
+        self.show_cached_window()
+
     def left(self):
-        self.config.vi_1d -= self.sweep_step
-        self.config.vf_1d -= self.sweep_step
-        self.im.set_extent([self.config.vi_1d, self.config.vf_1d, self.config.vi_2d, self.config.vf_2d])
-        self.canvas.draw()
+        p = self.snapshots.latest()
+        self.move_window(vi_1d=p.vi_1d - self.sweep_step, vf_1d=p.vf_1d - self.sweep_step)
 
     def right(self):
-        self.config.vi_1d += self.sweep_step
-        self.config.vf_1d += self.sweep_step
-        self.im.set_extent([self.config.vi_1d, self.config.vf_1d, self.config.vi_2d, self.config.vf_2d])
-        self.canvas.draw()
+        p = self.snapshots.latest()
+        self.move_window(vi_1d=p.vi_1d + self.sweep_step, vf_1d=p.vf_1d + self.sweep_step)
 
     def up(self):
-        self.config.vi_2d += self.sweep_step
-        self.config.vf_2d += self.sweep_step
-        self.im.set_extent([self.config.vi_1d, self.config.vf_1d, self.config.vi_2d, self.config.vf_2d])
-        self.canvas.draw()
+        p = self.snapshots.latest()
+        self.move_window(vi_2d=p.vi_2d + self.sweep_step, vf_2d=p.vf_2d + self.sweep_step)
 
     def down(self):
-        self.config.vi_2d -= self.sweep_step
-        self.config.vf_2d -= self.sweep_step
-        self.im.set_extent([self.config.vi_1d, self.config.vf_1d, self.config.vi_2d, self.config.vf_2d])
-        self.canvas.draw()
+        p = self.snapshots.latest()
+        self.move_window(vi_2d=p.vi_2d - self.sweep_step, vf_2d=p.vf_2d - self.sweep_step)
+
+    def set_gate_value(self, gate_value):
+        if abs(gate_value) < 1e-9: gate_value = 0.0
+        self.gateLabel.setText("{:.03f}".format(gate_value))
+        self.move_window(gate_value=gate_value)
 
     def plus(self):
-        self.gate_value += self.gate_step
-        if abs(self.gate_value) < 1e-9: self.gate_value = 0.0
-        self.gateLabel.setText("{:.03f}".format(self.gate_value))
+        self.set_gate_value(self.snapshots.latest().gate_value + self.gate_step)
 
     def minus(self):
-        self.gate_value -= self.gate_step
-        if abs(self.gate_value) < 1e-9: self.gate_value = 0.0
-        self.gateLabel.setText("{:.03f}".format(self.gate_value))
+        self.set_gate_value(self.snapshots.latest().gate_value - self.gate_step)
 
     def zoom_in(self):
-        self.config.vi_1d += self.zoom_step/2.0
-        self.config.vf_1d -= self.zoom_step/2.0
-        self.config.vi_2d += self.zoom_step/2.0
-        self.config.vf_2d -= self.zoom_step/2.0
-        self.im.set_extent([self.config.vi_1d, self.config.vf_1d, self.config.vi_2d, self.config.vf_2d])
-        self.canvas.draw()
+        p = self.snapshots.latest()
+        self.move_window(vi_1d=p.vi_1d + self.zoom_step/2.0, vf_1d=p.vf_1d - self.zoom_step/2.0, vi_2d=p.vi_2d + self.zoom_step/2.0, vf_2d=p.vf_2d - self.zoom_step/2.0)
 
     def zoom_out(self):
-        self.config.vi_1d -= self.zoom_step/2.0
-        self.config.vf_1d += self.zoom_step/2.0
-        self.config.vi_2d -= self.zoom_step/2.0
-        self.config.vf_2d += self.zoom_step/2.0
-        self.im.set_extent([self.config.vi_1d, self.config.vf_1d, self.config.vi_2d, self.config.vf_2d])
-        self.canvas.draw()
+        p = self.snapshots.latest()
+        self.move_window(vi_1d=p.vi_1d - self.zoom_step/2.0, vf_1d=p.vf_1d + self.zoom_step/2.0, vi_2d=p.vi_2d - self.zoom_step/2.0, vf_2d=p.vf_2d + self.zoom_step/2.0)
+
+    def abort_frame(self):
+        "Stops the frame being measured, the next frame is started right away"
+        self.thread.abort_frame = True
 
     def stop(self):
+        self.refresh_timer.stop()
         self.thread.is_stopped = True
+        self.processing_thread.is_stopped = True
+        self.close_recorder()
+        self.export_telemetry()
+
+    def close_recorder(self):
+        if self.recorder is not None:
+            self.processing_thread.wait() # the last frame is recorded before closing the file
+            self.recorder.close()
+            self.config.logger.info("Session recorded in {} ({} frames dropped)".format(self.recorder.path, self.recorder.dropped_frames))
+            self.recorder = None
 
     def closeEvent(self, event: QCloseEvent):
         print("Closing the application...")
-        self.thread.stop()  # stop the thread
+        self.refresh_timer.stop()
+        self.thread.stop()  # stop the threads
+        self.processing_thread.stop()
+        self.close_recorder()
+        self.export_telemetry()
         event.accept()  # let the window close
 
     
-def start_video_mode_UI(measure_func, config, awg_module, dig_module, hvi, header):
+def start_video_mode_UI(config, module_dict, hvi, header, averaging="cumulative"):
     #app = QApplication(sys.argv) # remove in iPython
-    main = MainWindow(measure_func, config, awg_module, dig_module, hvi, header)
+    main = MainWindow(config, module_dict, hvi, header=header, averaging=averaging)
     main.show()
     #sys.exit(app.exec_()) # remove in iPython
 
@@ -324,7 +523,7 @@ if __name__ == '__main__':
             update_vg_registers(config, module_dict, hvi)
 
         app = QApplication(sys.argv)
-        main = MainWindow(measure_diagram, config, module_dict, hvi, header="QD emulator")
+        main = MainWindow(config, module_dict, hvi, header="QD emulator")
         sys.exit(app.exec_())
 
     except Exception as error:
@@ -0,0 +1,340 @@
+import os
+import sys
+import time
+from collections import deque
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.widgets import Button, TextBox
+try:
+    import pyqtgraph as pqt
+    from pyqtgraph.Qt import QtWidgets
+    PYQTGRAPH_INSTALLED = True
+except ImportError:
+    from PyQt5 import QtWidgets
+    PYQTGRAPH_INSTALLED = False
+sys.path.append(r'C:\Program Files (x86)\Keysight\SD1\Libraries\Python')
+import keysightSD1
+try:
+    import keysight_tse as kthvi
+except ImportError:
+    import keysight_hvi as kthvi
+from Sweeper1D_KS2201A import ApplicationConfig1D, prepare_hvi_sequence, measure_trace, arm_next_trace, update_awg_registers_1d, update_dig_registers_1d, update_vg_voltage_registers_1d
+from KS2201A_lib import open_modules, load_awg, load_digitizer, configure_awg, configure_digitizer, define_hvi_resources, verify_sweep_parameters_1d
+from video_mode_lib import make_averaging_policy
+
+TRACES_PER_RUN = 2**15-1 # Num Traces 1D is a 16-bit HVI register
+
+class VideoModeSession1D:
+    "Measurement path of the 1D video mode. The HVI repeats the 1D sweep and the traces are read back to back, the run is only restarted to change vi and vf through the registers."
+    def __init__(self, config, module_dict, hvi, DAQ_channel=1, max_time=5, num_traces=TRACES_PER_RUN):
+        """
+        Parameters
+        ----------
+        config : ApplicationConfig1D
+            Experiment configuration.
+        module_dict : dict
+            Dictionary of the opened modules.
+        hvi : kthvi.Hvi
+            Compiled HVI sequence of the repeated 1D sweep (see prepare_hvi_sequence with num_traces).
+        DAQ_channel : int, optional
+            Digitizer channel to measure, by default 1.
+        max_time : float, optional
+            Maximum time allowed between two data acquisitions in seconds, by default 5.
+        num_traces : int, optional
+            Number of traces measured in each run of the HVI, by default TRACES_PER_RUN.
+        """
+        self.config = config
+        self.module_dict = module_dict
+        self.hvi = hvi
+        self.DAQ_channel = DAQ_channel
+        self.max_time = max_time
+        self.num_traces = num_traces
+        self.trace_index = 0
+        self.run_trace_index = 0 # traces measured in the current run
+        self.run_start_time = 0
+        self.running = False
+
+        self.awg_module = module_dict[config.main_awg_engine_name]
+        self.dig_module = module_dict[config.main_dig_engine_name]
+        self.awg_module_list = [module for module in module_dict.values() if not isinstance(module.instrument, keysightSD1.SD_AIN)]
+
+        # Sweep currently in the HVI registers, the registers are only updated when it changes
+        self.registers_window = self.window
+
+    @property
+    def window(self):
+        return (self.config.vi_1d, self.config.vf_1d, self.config.num_steps_1d)
+
+    @property
+    def v_axis(self):
+        return np.linspace(self.config.vi_1d, self.config.vf_1d, self.config.num_steps_1d)
+
+    def set_window(self, vi_1d, vf_1d):
+        """
+        Change the sweep of the next traces. The number of steps is fixed by verify_sweep_parameters_1d if needed.
+
+        Raises
+        ------
+        ValueError
+            If the sweep can't be done with the number of steps of the config. The previous sweep is kept.
+        """
+        old_vi_1d, old_vf_1d, old_num_steps_1d = self.window
+        self.config.vi_1d = vi_1d
+        self.config.vf_1d = vf_1d
+        try:
+            verify_sweep_parameters_1d(self.config, silence_warnings=True, auto_fix=True)
+        except ValueError:
+            self.config.vi_1d, self.config.vf_1d, self.config.num_steps_1d = old_vi_1d, old_vf_1d, old_num_steps_1d
+            raise
+
+    def start(self):
+        "Update the registers, arm the modules and start a run of num_traces traces."
+        if self.window != self.registers_window:
+            update_awg_registers_1d(self.hvi, self.awg_module, self.config, self.module_dict)
+            update_dig_registers_1d(self.hvi, self.dig_module, self.config)
+            self.registers_window = self.window
+        else:
+            # The voltages read on the hardware can change between runs
+            update_vg_voltage_registers_1d(self.hvi, self.awg_module, self.config, self.module_dict)
+        dig_registers = self.hvi.sync_sequence.scopes[self.dig_module.engine_name].registers
+        dig_registers[self.config.trace_counter_1d_name].initial_value = 0
+        dig_registers[self.config.num_traces_1d_name].initial_value = self.num_traces
+
+        configure_digitizer(self.config, self.dig_module)
+        for module in self.awg_module_list:
+            configure_awg(self.config, module)
+
+        self.hvi.run(self.hvi.no_wait)
+        self.running = True
+        self.run_trace_index = 0
+        self.run_start_time = time.time()
+
+    def stop(self):
+        "Stop the current run, if any."
+        if not self.running:
+            return
+        self.hvi.stop()
+        self.running = False
+        if self.run_trace_index > 0:
+            self.config.logger.debug("HVI run of {} traces: {:.1f} traces/s".format(self.run_trace_index, self.run_trace_index/(time.time() - self.run_start_time)))
+
+    def measure_trace(self):
+        """
+        Measure one averaged trace with the sweep currently in the config.
+        The run is restarted when the sweep changed or when all its traces were measured.
+
+        Returns
+        -------
+        np.ndarray
+            Averaged trace of num_steps_1d points.
+        """
+        if self.window != self.registers_window:
+            self.stop()
+        if not self.running:
+            self.start()
+
+        try:
+            if self.config.hardware_simulated:
+                trace = np.full(self.config.num_steps_1d, np.nan)
+            else:
+                trace = measure_trace(self.hvi, self.dig_module, self.DAQ_channel, self.config, max_time=self.max_time, repeated_sweep=True)
+        except:
+            self.stop()
+            raise
+        self.trace_index += 1
+        self.run_trace_index += 1
+
+        if self.run_trace_index < self.num_traces and not self.config.hardware_simulated:
+            # The HVI ramps back to vi while the trace is processed
+            arm_next_trace(self.hvi, self.dig_module, self.config)
+        else:
+            self.stop()
+
+        return trace
+
+def run_video_mode_1d(config, module_dict, hvi, DAQ_channel=1, persistence=5, averaging="exponential", time_constant=1, num_frames=10, max_time=5, plot_pyqtgraph=True)-> np.ndarray:
+    """
+    Measure 1D traces back to back and show them in a live plot until the window is stopped.
+    The last traces are drawn with fading colours and the averaged trace on top. Vi and vf can be changed between traces.
+
+    Parameters
+    ----------
+    config : ApplicationConfig1D
+        Experiment configuration.
+    module_dict : dict
+        Dictionary of the opened modules.
+    hvi : kthvi.Hvi
+        Compiled HVI sequence of the repeated 1D sweep (see prepare_hvi_sequence with num_traces).
+    DAQ_channel : int, optional
+        Digitizer channel to measure, by default 1.
+    persistence : int, optional
+        Number of previous traces drawn, by default 5.
+    averaging : str, optional
+        Averaging policy of the traces, "cumulative", "exponential" or "ring", by default "exponential".
+    time_constant : float, optional
+        Time constant of the exponential moving average in seconds, by default 1.
+    num_frames : int, optional
+        Number of traces averaged by the ring average, by default 10.
+    max_time : float, optional
+        Maximum time allowed between two data acquisitions in seconds, by default 5.
+    plot_pyqtgraph : bool, optional
+        Plot with pyqtgraph, by default True. If False or if pyqtgraph isn't installed, matplotlib is used.
+
+    Returns
+    -------
+    np.ndarray
+        Last averaged trace.
+    """
+    session = VideoModeSession1D(config, module_dict, hvi, DAQ_channel=DAQ_channel, max_time=max_time)
+    average = make_averaging_policy(averaging, time_constant=time_constant, num_frames=num_frames)
+    traces = deque(maxlen=persistence)
+    pending_window = {} # vi/vf typed by the user, applied before the next trace
+    stopped = [False]
+    plot_pyqtgraph = plot_pyqtgraph and PYQTGRAPH_INSTALLED
+
+    if plot_pyqtgraph:
+        app = pqt.mkQApp()
+        win = QtWidgets.QWidget()
+        win.setWindowTitle('1D video mode')
+        layout = QtWidgets.QGridLayout()
+        win.setLayout(layout)
+
+        graph_widget = pqt.GraphicsLayoutWidget()
+        graph = graph_widget.addPlot()
+        graph.setLabel('bottom', 'Voltage Ch{}'.format(config.AWG_channel_1d), 'V')
+        graph.setLabel('left', 'Signal', 'a.u.')
+        persistence_curves = [graph.plot(pen=pqt.mkPen((80, 80, 255, int(200*(i+1)/(persistence+1))))) for i in range(persistence)] # oldest trace first
+        average_curve = graph.plot(pen=pqt.mkPen('r', width=2))
+
+        def add_voltage_box(row, label, value, key):
+            layout.addWidget(QtWidgets.QLabel(label), row, 0)
+            box = QtWidgets.QDoubleSpinBox()
+            box.setDecimals(4)
+            box.setRange(-3, 3) # AWG range on high impedance loads
+            box.setSingleStep(0.01)
+            box.setValue(value)
+            box.valueChanged.connect(lambda v: pending_window.update({key: v}))
+            layout.addWidget(box, row+1, 0)
+            return box
+        add_voltage_box(0, "Vi 1D [V]", config.vi_1d, "vi_1d")
+        add_voltage_box(2, "Vf 1D [V]", config.vf_1d, "vf_1d")
+        stop_button = QtWidgets.QPushButton('Stop')
+        stop_button.clicked.connect(lambda: stopped.__setitem__(0, True))
+        layout.addWidget(stop_button, 4, 0)
+        rate_label = QtWidgets.QLabel("")
+        layout.addWidget(rate_label, 5, 0)
+        layout.addWidget(graph_widget, 0, 1, 7, 1)
+
+        win.resize(1000, 600)
+        win.show()
+        config.win = win # keep the window open after the function returns
+    else:
+        fig, ax = plt.subplots(num="1D video mode")
+        fig.subplots_adjust(bottom=0.2)
+        persistence_lines = [ax.plot([], [], color="b", alpha=0.8*(i+1)/(persistence+1))[0] for i in range(persistence)]
+        average_line, = ax.plot([], [], 'r-', linewidth=2)
+        ax.set_xlabel("Voltage Ch{} [V]".format(config.AWG_channel_1d))
+        ax.set_ylabel("Signal (a.u.)")
+
+        def submit_voltage(key, text):
+            # A mistyped value is ignored, the sweep keeps its current window
+            try:
+                pending_window[key] = float(text.replace(',', '.'))
+            except ValueError as error:
+                config.logger.warning(error)
+        vi_text = TextBox(plt.axes([0.15, 0.05, 0.15, 0.05]), "Vi", initial=str(config.vi_1d))
+        vi_text.on_submit(lambda text: submit_voltage("vi_1d", text))
+        vf_text = TextBox(plt.axes([0.4, 0.05, 0.15, 0.05]), "Vf", initial=str(config.vf_1d))
+        vf_text.on_submit(lambda text: submit_voltage("vf_1d", text))
+        button_stop = Button(plt.axes([0.75, 0.05, 0.1, 0.05]), 'Stop')
+        button_stop.on_clicked(lambda event: stopped.__setitem__(0, True))
+        fig.canvas.mpl_connect('close_event', lambda event: stopped.__setitem__(0, True))
+        plt.show(block=False)
+        config.win = None
+
+    averaged_trace = None
+    window = None
+    start_time = time.time()
+    while not stopped[0]:
+        # Sweep changes are applied between traces through register updates
+        if pending_window:
+            try:
+                session.set_window(pending_window.get("vi_1d", config.vi_1d), pending_window.get("vf_1d", config.vf_1d))
+            except ValueError as error:
+                config.logger.warning(error)
+            pending_window.clear()
+
+        trace = session.measure_trace()
+        trace_time = time.time()
+
+        if session.window != window:
+            # New sweep, the previous traces don't match the voltage axis
+            window = session.window
+            v_axis = session.v_axis
+            average.reset(np.full(trace.shape, np.nan), np.zeros(trace.shape))
+            traces.clear()
+        average.add(trace, trace_time)
+        averaged_trace = average.average()
+        traces.append(trace)
+
+        if plot_pyqtgraph:
+            for curve, old_trace in zip(persistence_curves[persistence-len(traces):], traces):
+                curve.setData(v_axis, old_trace)
+            for curve in persistence_curves[:persistence-len(traces)]:
+                curve.clear()
+            average_curve.setData(v_axis, averaged_trace)
+            rate_label.setText("{:.1f} traces/s".format(session.trace_index/(time.time() - start_time)))
+            app.processEvents()
+            if not win.isVisible():
+                stopped[0] = True
+        else:
+            for line, old_trace in zip(persistence_lines[persistence-len(traces):], traces):
+                line.set_data(v_axis, old_trace)
+            for line in persistence_lines[:persistence-len(traces)]:
+                line.set_data([], [])
+            average_line.set_data(v_axis, averaged_trace)
+            ax.relim()
+            ax.autoscale_view()
+            fig.canvas.draw_idle()
+            fig.canvas.flush_events()
+    session.stop()
+
+    config.logger.info("1D video mode stopped after {} traces ({:.1f} traces/s)".format(session.trace_index, session.trace_index/(time.time() - start_time)))
+
+    return None if averaged_trace is None else averaged_trace.copy()
+
+if __name__ == "__main__":
+    config = ApplicationConfig1D.from_yaml(os.path.join(os.path.dirname(__file__), "experiment_config_Sweeper1D.yaml"))
+
+    try:
+        module_dict = open_modules(config)
+        awg_module = module_dict[config.main_awg_engine_name]
+        load_awg(config, awg_module, reset_voltages=False)
+        dig_module = module_dict[config.main_dig_engine_name]
+        load_digitizer(config, dig_module)
+
+        # Define the system and compile the 1D sweep once
+        my_system = kthvi.SystemDefinition("MySystem")
+        define_hvi_resources(my_system, module_dict, config)
+        sequencer = kthvi.Sequencer("MySequencer", my_system)
+        hvi = prepare_hvi_sequence(sequencer, config, awg_module, dig_module, num_traces=TRACES_PER_RUN)
+
+        run_video_mode_1d(config, module_dict, hvi, DAQ_channel=1)
+
+    except Exception as error:
+        config.logger.exception(error)
+
+    finally:
+        if "hvi" in globals() or "hvi" in locals():
+            if hvi.is_running():
+                hvi.stop()
+                config.logger.info("HVI stopped")
+            # Release HW resources once HVI execution is completed
+            hvi.release_hw()
+            config.logger.info("Releasing HW...")
+
+        # Close all modules at the end of the execution
+        if "module_dict" in globals() or "module_dict" in locals():
+            for engine_name in module_dict:
+                module_dict[engine_name].instrument.close()
+            config.logger.info("PXI modules closed")
@@ -0,0 +1,872 @@
+import os
+import sys
+import time
+import queue
+import threading
+import warnings
+from collections import OrderedDict
+from typing import NamedTuple
+import copy
+import numpy as np
+from scipy.ndimage import gaussian_filter
+sys.path.append(r'C:\Program Files (x86)\Keysight\SD1\Libraries\Python')
+import keysightSD1
+from Sweeper2D_KS2201A import run_hvi, update_hvi_registers, update_vg_voltage_registers
+from KS2201A_lib import configure_awg, configure_digitizer, classify_config_change, snapshot_config, CONFIG_CHANGE_DAQ, CONFIG_CHANGE_REGISTERS, CONFIG_CHANGE_RECOMPILE
+from file_save_system import create_save_filename
+
+class VideoModeSession:
+    "Measurement path of the video mode. The files and modules are set up once per session and each frame only updates the registers that changed."
+    def __init__(self, config, module_dict, hvi, channel_list, max_time=20, save_data=False, telemetry=None):
+        """
+        Parameters
+        ----------
+        config : ApplicationConfig2D
+            Experiment configuration. The window of the next frame is read from the config.
+        module_dict : dict
+            Dictionary of the opened modules.
+        hvi : kthvi.Hvi
+            Compiled HVI sequence of the 2D sweeper.
+        channel_list : list
+            List of digitizer channels to measure.
+        max_time : int, optional
+            Maximum time allowed between two data acquisition in seconds, by default 20.
+        save_data : bool, optional
+            Save each frame in a text file, by default False. The files are named after one file name created at the start of the session.
+        telemetry : FrameTelemetry, optional
+            Records the duration of the register update, DAQ configuration, HVI start and HVI run of each frame, by default None.
+        """
+        self.config = config
+        self.module_dict = module_dict
+        self.hvi = hvi
+        self.channel_list = channel_list
+        self.max_time = max_time
+        self.save_data = save_data
+        self.telemetry = telemetry
+        self.frame_index = 0
+        self.modules_configured = False # the channels and AWGs are configured on the first frame
+
+        self.awg_module = module_dict[config.main_awg_engine_name]
+        self.dig_module = module_dict[config.main_dig_engine_name]
+        self.awg_module_list = [module for module in module_dict.values() if not isinstance(module.instrument, keysightSD1.SD_AIN)]
+
+        if save_data:
+            day_folder, filename_incr = create_save_filename(config.database_folder, config.save_filename)
+            self.savepath = os.path.join(day_folder, filename_incr)
+            config.to_yaml(os.path.join(day_folder, "{}_config.yaml".format(filename_incr[:-4])))
+        else:
+            self.savepath = None
+
+    def measure_frame(self, header="", line_callback=None):
+        """
+        Measure one averaged frame with the window currently in the config.
+
+        Parameters
+        ----------
+        header : str, optional
+            Header of the text file of the frame if the data is saved, by default "".
+        line_callback : callable, optional
+            Function called with the completed lines while the frame is measured (see measure_data), by default None.
+
+        Returns
+        -------
+        np.ndarray
+            Averaged data of the frame, one row per channel.
+
+        Raises
+        ------
+        ValueError
+            If the config changed in a way that requires recompiling the HVI sequence.
+        """
+        start_time = time.time()
+        action, changed_fields = classify_config_change(getattr(self.config, "hvi_config", None), self.config)
+        if action == CONFIG_CHANGE_RECOMPILE:
+            raise ValueError("{} changed since the HVI sequence was compiled. The video mode must be restarted.".format(", ".join(changed_fields)))
+        elif action == CONFIG_CHANGE_REGISTERS:
+            update_hvi_registers(self.config, self.module_dict, self.hvi)
+        else:
+            # The voltages read on the hardware for the virtual gates change between frames even if the config doesn't
+            update_vg_voltage_registers(self.config, self.module_dict, self.hvi)
+        register_time = time.time()
+
+        # The DAQs are armed for each frame, the channels and AWGs are only configured again when their settings changed
+        reconfigure = not self.modules_configured or action == CONFIG_CHANGE_REGISTERS or (action == CONFIG_CHANGE_DAQ and len(changed_fields) > 0)
+        configure_digitizer(self.config, self.dig_module, configure_channels=reconfigure)
+        if reconfigure:
+            for module in self.awg_module_list:
+                configure_awg(self.config, module)
+            self.config.hvi_config = snapshot_config(self.config)
+            self.modules_configured = True
+        configure_time = time.time()
+
+        if self.save_data:
+            savepath = "{}_frame{}.txt".format(self.savepath[:-4], self.frame_index)
+        else:
+            savepath = ""
+        data = run_hvi(self.config, self.awg_module, self.dig_module, self.hvi, channel_list=self.channel_list, max_time=self.max_time, countdown=False, live_plotting=False, average_data=True, save_data=self.save_data, header=header, savepath=savepath, line_callback=line_callback, telemetry=self.telemetry, frame_index=self.frame_index)
+
+        if self.telemetry is not None:
+            self.telemetry.record(self.frame_index, "register_update", register_time - start_time)
+            self.telemetry.record(self.frame_index, "daq_configure", configure_time - register_time)
+        self.frame_index += 1
+
+        return data
+
+class FrameParameters(NamedTuple):
+    "Window of a video-mode frame. The UI publishes a new snapshot with a higher version each time the window changes, and the snapshots are never modified."
+    version: int
+    vi_1d: float
+    vf_1d: float
+    vi_2d: float
+    vf_2d: float
+    gate_value: float
+
+    @property
+    def window(self):
+        "(vi_1d, vf_1d, vi_2d, vf_2d, gate_value), used to restart the averaging and to index the tile cache"
+        return (self.vi_1d, self.vf_1d, self.vi_2d, self.vf_2d, self.gate_value)
+
+    def apply(self, config):
+        "Write the window in the config. Only the acquisition thread writes the config during the video mode."
+        config.vi_1d = self.vi_1d
+        config.vf_1d = self.vf_1d
+        config.vi_2d = self.vi_2d
+        config.vf_2d = self.vf_2d
+
+class ParameterSnapshots:
+    "Latest FrameParameters published by the UI. The acquisition thread takes the latest snapshot at the start of each frame, so a frame never mixes two windows."
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.lock = threading.Lock()
+
+    def publish(self, **changes):
+        """
+        Publish a new snapshot with some fields changed.
+
+        Parameters
+        ----------
+        **changes
+            New values of the FrameParameters fields, except version which is incremented.
+
+        Returns
+        -------
+        FrameParameters
+            Published snapshot.
+        """
+        with self.lock:
+            self.parameters = self.parameters._replace(version=self.parameters.version+1, **changes)
+            return self.parameters
+
+    def latest(self):
+        with self.lock:
+            return self.parameters
+
+class FrameQueue:
+    "Bounded queue between the stages of the video mode. The oldest frame is dropped when the next stage falls behind."
+    def __init__(self, maxsize=2):
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.dropped_frames = 0
+
+    def put(self, frame):
+        with self.lock:
+            if self.queue.full():
+                try:
+                    self.queue.get_nowait()
+                    self.dropped_frames += 1
+                except queue.Empty:
+                    pass # the frame was taken in the meantime
+            self.queue.put_nowait(frame)
+
+    def get(self, timeout=None):
+        # Raises queue.Empty if no frame is available before the timeout
+        return self.queue.get(timeout=timeout)
+
+class TileCache:
+    "Averaged frames of the video mode indexed by their voltage window. The data known in a new window is shown right away when panning and zooming."
+    def __init__(self, max_tiles=16):
+        """
+        Parameters
+        ----------
+        max_tiles : int, optional
+            Number of frames kept in the cache, by default 16. The oldest frames are removed first.
+        """
+        self.tiles = OrderedDict()
+        self.max_tiles = max_tiles
+        self.lock = threading.Lock()
+
+    def store(self, window, data, counts):
+        """
+        Store the averaged frame of a window.
+
+        Parameters
+        ----------
+        window : tuple
+            (vi_1d, vf_1d, vi_2d, vf_2d, gate_value) of the frame.
+        data : np.ndarray
+            Averaged frame of shape (num_steps_2d, num_steps_1d).
+        counts : np.ndarray
+            Number of frames averaged in each point.
+        """
+        with self.lock:
+            self.tiles.pop(window, None)
+            self.tiles[window] = (data.copy(), counts.copy())
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+    def lookup(self, window, shape):
+        """
+        Resample the cached frames on the grid of a window. The most recent frame is used where frames overlap.
+
+        Parameters
+        ----------
+        window : tuple
+            (vi_1d, vf_1d, vi_2d, vf_2d, gate_value) of the new frame. Only the frames with the same gate value are used.
+        shape : tuple
+            (num_steps_2d, num_steps_1d) of the new frame.
+
+        Returns
+        -------
+        data : np.ndarray
+            Cached data on the new grid, NaN where nothing was measured.
+        counts : np.ndarray
+            Number of frames averaged in each point of data, 0 where nothing was measured.
+        """
+        vi_1d, vf_1d, vi_2d, vf_2d, gate_value = window
+        data = np.empty(shape)
+        data[:] = np.nan
+        counts = np.zeros(shape)
+        v1_axis = np.linspace(vi_1d, vf_1d, shape[1])
+        v2_axis = np.linspace(vi_2d, vf_2d, shape[0])
+
+        with self.lock:
+            tiles = list(self.tiles.items())
+        for tile_window, (tile_data, tile_counts) in reversed(tiles):
+            if tile_window[4] != gate_value:
+                continue
+            cols = nearest_grid_index(v1_axis, tile_window[0], tile_window[1], tile_data.shape[1])
+            rows = nearest_grid_index(v2_axis, tile_window[2], tile_window[3], tile_data.shape[0])
+            missing = np.isnan(data) & (rows[:, None] >= 0) & (cols[None, :] >= 0)
+            r, c = np.nonzero(missing)
+            data[r, c] = tile_data[rows[r], cols[c]]
+            counts[r, c] = tile_counts[rows[r], cols[c]]
+            if not np.isnan(data).any():
+                break
+        counts[np.isnan(data)] = 0
+
+        return data, counts
+
+def nearest_grid_index(v, vi, vf, num_steps):
+    "Index of the closest point of the grid linspace(vi, vf, num_steps) for each voltage in v, -1 outside of the grid"
+    if num_steps == 1:
+        return np.where(v == vi, 0, -1)
+    step = (vf - vi)/(num_steps - 1)
+    index = np.rint((v - vi)/step).astype(int)
+    index[(index < 0) | (index >= num_steps)] = -1
+    return index
+
+class CumulativeAverage:
+    "Average of all the frames measured since the window changed. The arrays are updated in place."
+    def __init__(self):
+        self.shape = None
+        self.num_frames = 0
+
+    def allocate(self, shape):
+        # Arrays are only allocated when the frame shape changes
+        if shape != self.shape:
+            self.shape = shape
+            self.data_sum = np.zeros(shape)
+            self.counts = np.zeros(shape)
+            self.averaged_data = np.empty(shape)
+            self.measured = np.empty(shape, dtype=bool)
+            self.valid = np.empty(shape, dtype=bool)
+            self.line_counts = np.empty(shape)
+
+    def reset(self, seed_data, seed_counts):
+        """
+        Restart the averaging.
+
+        Parameters
+        ----------
+        seed_data : np.ndarray
+            Data already known in the new window, NaN where nothing was measured.
+        seed_counts : np.ndarray
+            Number of frames averaged in each point of seed_data.
+        """
+        self.allocate(seed_data.shape)
+        np.copyto(self.counts, seed_counts)
+        np.multiply(np.nan_to_num(seed_data), seed_counts, out=self.data_sum)
+        self.num_frames = 0
+
+    def add(self, data, timestamp=None):
+        "Add a frame. The acquisition timestamp is only used by the exponential average."
+        np.logical_not(np.isnan(data, out=self.measured), out=self.measured)
+        np.add(self.data_sum, data, out=self.data_sum, where=self.measured)
+        np.add(self.counts, 1, out=self.counts, where=self.measured)
+        self.num_frames += 1
+
+    def average(self):
+        self.averaged_data[:] = np.nan
+        np.divide(self.data_sum, self.counts, out=self.averaged_data, where=np.greater(self.counts, 0, out=self.valid))
+        return self.averaged_data
+
+    def preview(self, lines):
+        "Average if the first lines of the next frame were added"
+        self.average()
+        num_lines = lines.shape[0]
+        np.add(self.counts[:num_lines], 1, out=self.line_counts[:num_lines])
+        np.add(self.data_sum[:num_lines], lines, out=self.averaged_data[:num_lines])
+        np.divide(self.averaged_data[:num_lines], self.line_counts[:num_lines], out=self.averaged_data[:num_lines])
+        return self.averaged_data
+
+class RingAverage(CumulativeAverage):
+    "Average of the last num_frames frames. The oldest frame is removed from the sum when a new frame is added."
+    def __init__(self, num_frames=10):
+        super().__init__()
+        self.ring_size = num_frames
+
+    def allocate(self, shape):
+        if shape != self.shape:
+            super().allocate(shape)
+            self.ring = np.zeros((self.ring_size,) + shape)
+            self.ring_measured = np.zeros((self.ring_size,) + shape, dtype=bool)
+
+    def reset(self, seed_data, seed_counts):
+        # The known data counts as one frame and leaves the ring like the measured frames
+        self.allocate(seed_data.shape)
+        self.data_sum[:] = 0
+        self.counts[:] = 0
+        self.ring_measured[:] = False
+        self.ring_index = 0
+        if np.any(seed_counts > 0):
+            self.add(seed_data)
+        self.num_frames = 0
+
+    def add(self, data, timestamp=None):
+        slot = self.ring_index % self.ring_size
+        np.subtract(self.data_sum, self.ring[slot], out=self.data_sum, where=self.ring_measured[slot])
+        np.subtract(self.counts, 1, out=self.counts, where=self.ring_measured[slot])
+
+        np.logical_not(np.isnan(data, out=self.ring_measured[slot]), out=self.ring_measured[slot])
+        np.copyto(self.ring[slot], data)
+        np.add(self.data_sum, data, out=self.data_sum, where=self.ring_measured[slot])
+        np.add(self.counts, 1, out=self.counts, where=self.ring_measured[slot])
+        self.ring_index += 1
+        self.num_frames += 1
+
+    def preview(self, lines):
+        self.average()
+        slot = self.ring_index % self.ring_size
+        num_lines = lines.shape[0]
+        line_sum = self.averaged_data[:num_lines]
+        np.copyto(line_sum, self.data_sum[:num_lines])
+        np.copyto(self.line_counts[:num_lines], self.counts[:num_lines])
+        np.subtract(line_sum, self.ring[slot][:num_lines], out=line_sum, where=self.ring_measured[slot][:num_lines])
+        np.subtract(self.line_counts[:num_lines], 1, out=self.line_counts[:num_lines], where=self.ring_measured[slot][:num_lines])
+        np.add(line_sum, lines, out=line_sum)
+        np.add(self.line_counts[:num_lines], 1, out=self.line_counts[:num_lines])
+        np.divide(line_sum, self.line_counts[:num_lines], out=line_sum)
+        return self.averaged_data
+
+class ExponentialAverage:
+    "Exponential moving average of the frames. Frames older than the time constant have little weight, so changes of the device show quickly."
+    def __init__(self, time_constant=5):
+        """
+        Parameters
+        ----------
+        time_constant : float, optional
+            Time constant of the average in seconds, by default 5.
+        """
+        self.time_constant = time_constant
+        self.shape = None
+        self.num_frames = 0
+
+    def allocate(self, shape):
+        if shape != self.shape:
+            self.shape = shape
+            self.averaged_data = np.empty(shape)
+            self.counts = np.zeros(shape)
+            self.preview_data = np.empty(shape)
+            self.difference = np.empty(shape)
+            self.weights = np.empty(shape)
+            self.measured = np.empty(shape, dtype=bool)
+            self.known = np.empty(shape, dtype=bool)
+            self.update = np.empty(shape, dtype=bool)
+
+    def reset(self, seed_data, seed_counts):
+        self.allocate(seed_data.shape)
+        np.copyto(self.averaged_data, seed_data)
+        np.copyto(self.counts, seed_counts)
+        self.last_time = None
+        # The seed counts as seed_counts frames for the first frame, its acquisition time is unknown
+        np.add(self.counts, 1, out=self.weights)
+        np.reciprocal(self.weights, out=self.weights) # weight of the next frame
+        self.num_frames = 0
+
+    def add(self, data, timestamp=None):
+        """
+        Add a frame.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Frame, NaN where nothing was measured.
+        timestamp : float, optional
+            Acquisition time of the frame (time.time()), by default the current time.
+            Frames that waited before being processed keep the weight of their acquisition interval.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if self.last_time is not None:
+            self.weights[:] = 1 - np.exp(-max(timestamp - self.last_time, 0)/self.time_constant)
+        self.last_time = timestamp
+
+        np.logical_not(np.isnan(data, out=self.measured), out=self.measured)
+        np.logical_not(np.isnan(self.averaged_data, out=self.known), out=self.known)
+        # Points measured for the first time take the value of the frame
+        np.logical_not(self.known, out=self.update)
+        np.logical_and(self.measured, self.update, out=self.update)
+        np.copyto(self.averaged_data, data, where=self.update)
+        np.logical_and(self.measured, self.known, out=self.update)
+        np.subtract(data, self.averaged_data, out=self.difference)
+        np.multiply(self.difference, self.weights, out=self.difference)
+        np.add(self.averaged_data, self.difference, out=self.averaged_data, where=self.update)
+        np.add(self.counts, 1, out=self.counts, where=self.measured)
+        self.num_frames += 1
+
+    def average(self):
+        return self.averaged_data
+
+    def preview(self, lines):
+        np.copyto(self.preview_data, self.averaged_data)
+        num_lines = lines.shape[0]
+        line_data = self.preview_data[:num_lines]
+        np.subtract(lines, line_data, out=self.difference[:num_lines])
+        np.multiply(self.difference[:num_lines], self.weights[:num_lines], out=self.difference[:num_lines])
+        np.add(line_data, self.difference[:num_lines], out=line_data, where=~np.isnan(line_data))
+        np.copyto(line_data, lines, where=np.isnan(line_data))
+        return self.preview_data
+
+def make_averaging_policy(averaging="cumulative", time_constant=5, num_frames=10):
+    """
+    Create the averaging policy of the video mode.
+
+    Parameters
+    ----------
+    averaging : str, optional
+        "cumulative" to average all the frames of the window, "exponential" for an exponential moving average or "ring" to average the last frames, by default "cumulative".
+    time_constant : float, optional
+        Time constant of the exponential moving average in seconds, by default 5.
+    num_frames : int, optional
+        Number of frames averaged by the ring average, by default 10.
+
+    Returns
+    -------
+    CumulativeAverage, ExponentialAverage or RingAverage
+        Averaging policy.
+    """
+    if averaging == "cumulative":
+        return CumulativeAverage()
+    elif averaging == "exponential":
+        return ExponentialAverage(time_constant)
+    elif averaging == "ring":
+        return RingAverage(num_frames)
+    else:
+        raise ValueError("Unknown averaging policy {}. Choose between cumulative, exponential and ring.".format(averaging))
+
+class SessionRecorder:
+    """
+    Records the frames of a video-mode session in one binary file. The frames are written by a background thread in chunks of chunk_size frames.
+    Each chunk is a numpy structured array saved with np.save, so the file can be read back with read_session.
+    """
+    CLOSE = object() # sent to the writing thread to close the file
+    def __init__(self, path, chunk_size=16, max_pending_frames=256):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the binary file.
+        chunk_size : int, optional
+            Number of frames written at once, by default 16.
+        max_pending_frames : int, optional
+            Maximum number of frames waiting to be written, by default 256. Frames are dropped if the disk can't keep up.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.frames = queue.Queue(max_pending_frames)
+        self.dropped_frames = 0
+        self.file = open(path, "wb")
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def record(self, frame_index, timestamp, window, raw_data, averaged_data):
+        """
+        Queue a frame to be written. The arrays are copied, so they can be reused by the caller.
+
+        Parameters
+        ----------
+        frame_index : int
+            Index of the frame in the session.
+        timestamp : float
+            Time at which the frame was measured (time.time()).
+        window : tuple
+            (vi_1d, vf_1d, vi_2d, vf_2d, gate_value) of the frame.
+        raw_data : np.ndarray
+            Measured frame of shape (num_steps_2d, num_steps_1d).
+        averaged_data : np.ndarray
+            Averaged frame of the same shape.
+        """
+        try:
+            self.frames.put_nowait((frame_index, timestamp, window, raw_data.copy(), averaged_data.copy()))
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def write_frames(self):
+        chunk = []
+        closing = False
+        while not closing:
+            try:
+                frame = self.frames.get(timeout=1)
+            except queue.Empty:
+                frame = None
+            if frame is self.CLOSE:
+                closing = True
+            elif frame is not None:
+                # A chunk only contains frames of the same shape
+                if chunk and frame[3].shape != chunk[0][3].shape:
+                    self.write_chunk(chunk)
+                    chunk = []
+                chunk.append(frame)
+
+            # Full chunks are written, and the remaining frames when the session is paused or closed
+            if chunk and (len(chunk) >= self.chunk_size or frame is None or closing):
+                self.write_chunk(chunk)
+                chunk = []
+
+    def write_chunk(self, chunk):
+        shape = chunk[0][3].shape
+        dtype = np.dtype([("frame_index", "i8"), ("timestamp", "f8"), ("window", "f8", (4,)), ("gate_value", "f8"), ("raw", "f8", shape), ("averaged", "f8", shape)])
+        records = np.empty(len(chunk), dtype=dtype)
+        for i, (frame_index, timestamp, window, raw_data, averaged_data) in enumerate(chunk):
+            records[i] = (frame_index, timestamp, window[:4], window[4], raw_data, averaged_data)
+        np.save(self.file, records)
+        self.file.flush()
+
+    def close(self):
+        "Write the remaining frames and close the file"
+        self.frames.put(self.CLOSE)
+        self.thread.join()
+        self.file.close()
+
+def read_session(path):
+    """
+    Read the frames recorded by SessionRecorder.
+
+    Parameters
+    ----------
+    path : str
+        Path of the binary file.
+
+    Yields
+    ------
+    np.void
+        One record per frame with the fields frame_index, timestamp, window (vi_1d, vf_1d, vi_2d, vf_2d), gate_value, raw and averaged.
+    """
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        while f.tell() < file_size:
+            for record in np.load(f):
+                yield record
+
+def replay_session(path, show_frame, speed=1.0):
+    """
+    Replay a recorded session, calling show_frame with each frame at the pace it was measured.
+
+    Parameters
+    ----------
+    path : str
+        Path of the binary file.
+    show_frame : callable
+        Function called with each record (see read_session).
+    speed : float, optional
+        Replay speed, by default 1.0. Frames are shown as fast as possible if speed is 0.
+    """
+    start_time = time.time()
+    first_timestamp = None
+    for record in read_session(path):
+        if first_timestamp is None:
+            first_timestamp = record["timestamp"]
+        if speed > 0:
+            delay = (record["timestamp"] - first_timestamp)/speed - (time.time() - start_time)
+            if delay > 0:
+                time.sleep(delay)
+        show_frame(record)
+
+def central_difference(data, out, axis=1):
+    "Same as np.gradient along one axis of a 2D array, written in out"
+    if axis == 0:
+        data, out = data.T, out.T
+    np.subtract(data[:, 2:], data[:, :-2], out=out[:, 1:-1])
+    np.multiply(out[:, 1:-1], 0.5, out=out[:, 1:-1])
+    np.subtract(data[:, 1], data[:, 0], out=out[:, 0])
+    np.subtract(data[:, -1], data[:, -2], out=out[:, -1])
+    return out.T if axis == 0 else out
+
+class Derivative:
+    "Derivative of the frame along the 1D axis (axis=1), the 2D axis (axis=0) or the mean of both (axis=None)"
+    def __init__(self, axis=None):
+        self.axis = axis
+        self.shape = None
+
+    def allocate(self, shape):
+        if shape != self.shape:
+            self.shape = shape
+            self.out = np.empty(shape)
+            self.buffer = np.empty(shape)
+
+    def apply(self, data):
+        self.allocate(data.shape)
+        if self.axis is None:
+            central_difference(data, self.out, axis=1)
+            central_difference(data, self.buffer, axis=0)
+            np.add(self.out, self.buffer, out=self.out)
+            np.multiply(self.out, 0.5, out=self.out)
+        else:
+            central_difference(data, self.out, axis=self.axis)
+        return self.out
+
+class PlaneSubtraction:
+    "Subtracts the plane fitted on the measured points of the frame, removes the background slope of both gates"
+    def __init__(self):
+        self.shape = None
+
+    def allocate(self, shape):
+        if shape != self.shape:
+            self.shape = shape
+            self.out = np.empty(shape)
+            self.buffer = np.empty(shape)
+            self.valid = np.empty(shape, dtype=bool)
+            self.y, self.x = np.indices(shape, dtype=float)
+
+    def apply(self, data):
+        self.allocate(data.shape)
+        np.logical_not(np.isnan(data, out=self.valid), out=self.valid)
+        if np.count_nonzero(self.valid) < 3:
+            np.copyto(self.out, data)
+            return self.out
+
+        # Least squares fit of z = a*x + b*y + c with the normal equations
+        def masked_sum(array):
+            return np.sum(array, where=self.valid)
+        def masked_product_sum(a, b):
+            return masked_sum(np.multiply(a, b, out=self.buffer))
+        x, y = self.x, self.y
+        matrix = np.array([[masked_product_sum(x, x), masked_product_sum(x, y), masked_sum(x)],
+                           [masked_product_sum(x, y), masked_product_sum(y, y), masked_sum(y)],
+                           [masked_sum(x), masked_sum(y), np.count_nonzero(self.valid)]])
+        vector = np.array([masked_product_sum(x, data), masked_product_sum(y, data), masked_sum(data)])
+        try:
+            a, b, c = np.linalg.solve(matrix, vector)
+        except np.linalg.LinAlgError:
+            # Points on a line, only the mean is subtracted
+            a, b, c = 0, 0, vector[2]/matrix[2, 2]
+
+        np.multiply(x, a, out=self.out)
+        np.multiply(y, b, out=self.buffer)
+        np.add(self.out, self.buffer, out=self.out)
+        np.add(self.out, c, out=self.out)
+        np.subtract(data, self.out, out=self.out)
+        return self.out
+
+class GaussianSmoothing:
+    "Gaussian smoothing of the frame, sigma in pixels. The edges are repeated."
+    def __init__(self, sigma=1.0):
+        self.sigma = sigma
+        self.shape = None
+
+    def allocate(self, shape):
+        if shape != self.shape:
+            self.shape = shape
+            self.out = np.empty(shape)
+
+    def apply(self, data):
+        self.allocate(data.shape)
+        gaussian_filter(data, self.sigma, output=self.out, mode="nearest")
+        return self.out
+
+class LineNormalisation:
+    "Subtracts the mean of each line of the 1D sweep and divides by its standard deviation, removes the line-to-line offsets"
+    def __init__(self):
+        self.shape = None
+
+    def allocate(self, shape):
+        if shape != self.shape:
+            self.shape = shape
+            self.out = np.empty(shape)
+            self.line_values = np.empty((shape[0], 1))
+
+    def apply(self, data):
+        self.allocate(data.shape)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning) # lines not measured yet are NaN
+            np.copyto(self.line_values, np.nanmean(data, axis=1, keepdims=True))
+            np.subtract(data, self.line_values, out=self.out)
+            np.copyto(self.line_values, np.nanstd(self.out, axis=1, keepdims=True))
+        self.line_values[self.line_values == 0] = 1
+        np.divide(self.out, self.line_values, out=self.out)
+        return self.out
+
+class ProcessingChain:
+    "Processing steps applied one after the other on the averaged frames of the video mode"
+    def __init__(self, steps):
+        self.steps = list(steps)
+
+    def apply(self, data):
+        """
+        Apply the steps on a frame. The result is written in the buffer of the last step and is overwritten by the next frame.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Frame of shape (num_steps_2d, num_steps_1d).
+
+        Returns
+        -------
+        np.ndarray
+            Processed frame.
+        """
+        for step in self.steps:
+            data = step.apply(data)
+        return data
+
+PROCESSING_STEPS = {
+    "gradient": lambda: Derivative(),
+    "derivative_1d": lambda: Derivative(axis=1),
+    "derivative_2d": lambda: Derivative(axis=0),
+    "plane_subtraction": PlaneSubtraction,
+    "gaussian": GaussianSmoothing,
+    "line_normalisation": LineNormalisation,
+}
+
+def make_processing_chain(steps=("gradient",)):
+    """
+    Create the processing chain of the video mode.
+
+    Parameters
+    ----------
+    steps : list, optional
+        Names of the steps ("gradient", "derivative_1d", "derivative_2d", "plane_subtraction", "gaussian", "line_normalisation") or step objects, applied in order, by default ("gradient",).
+
+    Returns
+    -------
+    ProcessingChain
+        Processing chain with new buffers.
+    """
+    chain = []
+    for step in steps:
+        if isinstance(step, str):
+            if step not in PROCESSING_STEPS:
+                raise ValueError("Unknown processing step {}. Choose between {}.".format(step, ", ".join(PROCESSING_STEPS)))
+            step = PROCESSING_STEPS[step]()
+        else:
+            step = copy.deepcopy(step) # each chain has its own buffers
+        chain.append(step)
+    return ProcessingChain(chain)
+
+class FrameTelemetry:
+    "Duration of each stage of the video-mode frames, used to find which stage limits the frame rate"
+    # hvi_start is the non-blocking run call, hvi_run lasts until the run is done and includes the acquisition of its data
+    STAGES = ("register_update", "daq_configure", "hvi_start", "hvi_run", "reduction", "render", "sleep")
+
+    def __init__(self, max_frames=1000):
+        """
+        Parameters
+        ----------
+        max_frames : int, optional
+            Number of frames kept in memory, by default 1000. The oldest frames are removed first.
+        """
+        self.frames = OrderedDict() # frame index -> {stage: duration}
+        self.done_times = OrderedDict() # frame index -> time at which the frame was averaged
+        self.max_frames = max_frames
+        self.lock = threading.Lock()
+
+    def record(self, frame_index, stage, duration):
+        """
+        Record the duration of a stage of a frame. The stages are recorded from the acquisition, processing and UI threads.
+
+        Parameters
+        ----------
+        frame_index : int
+            Index of the frame in the session.
+        stage : str
+            One of FrameTelemetry.STAGES.
+        duration : float
+            Duration in seconds.
+        """
+        with self.lock:
+            self.frames.setdefault(frame_index, {})[stage] = duration
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+
+    def frame_done(self, frame_index):
+        with self.lock:
+            self.done_times[frame_index] = time.time()
+            while len(self.done_times) > self.max_frames:
+                self.done_times.popitem(last=False)
+
+    def summary(self, num_frames=20):
+        """
+        Average duration of each stage and frame rate over the last frames.
+
+        Parameters
+        ----------
+        num_frames : int, optional
+            Number of frames averaged, by default 20.
+
+        Returns
+        -------
+        durations : dict
+            Mean duration of each stage in seconds, NaN if the stage wasn't recorded.
+        fps : float
+            Frames averaged per second, NaN before the second frame.
+        """
+        with self.lock:
+            frames = list(self.frames.values())[-num_frames:]
+            done_times = list(self.done_times.values())[-num_frames:]
+        durations = {}
+        for stage in self.STAGES:
+            values = [frame[stage] for frame in frames if stage in frame]
+            durations[stage] = np.mean(values) if values else np.nan
+        if len(done_times) > 1 and done_times[-1] > done_times[0]:
+            fps = (len(done_times) - 1)/(done_times[-1] - done_times[0])
+        else:
+            fps = np.nan
+        return durations, fps
+
+    def status_message(self, dropped_frames=0):
+        durations, fps = self.summary()
+        stages = " | ".join("{} {:.0f} ms".format(stage.replace("_", " "), durations[stage]*1e3) for stage in self.STAGES if not np.isnan(durations[stage]))
+        return "FPS: {:.2f} | {} | dropped frames: {}".format(fps, stages, dropped_frames)
+
+    def export(self, path, dropped_frames=0):
+        """
+        Save the durations of the recorded frames in a text file, one line per frame.
+
+        Parameters
+        ----------
+        path : str
+            Path of the text file.
+        dropped_frames : int, optional
+            Number of dropped frames, saved in the header, by default 0.
+        """
+        with self.lock:
+            frames = list(self.frames.items())
+        table = np.empty((len(frames), len(self.STAGES) + 1))
+        table[:] = np.nan
+        for i, (frame_index, frame) in enumerate(frames):
+            table[i, 0] = frame_index
+            for j, stage in enumerate(self.STAGES):
+                table[i, j+1] = frame.get(stage, np.nan)
+        durations, fps = self.summary(len(frames))
+        header = "Video-mode telemetry, durations in seconds\nFPS: {:.3f}\nDropped frames: {}\nframe_index\t{}".format(fps, dropped_frames, "\t".join(self.STAGES))
+        np.savetxt(path, table, header=header, comments="#") # comments="#" for compatibility with readfile from pyHegel